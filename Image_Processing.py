@@ -2,11 +2,15 @@
 Image Processing Script - Desaturate, Increase Contrast, Remove White Background, Convert to Red
 """
 
+import functools
 import os
 from PIL import Image, ImageEnhance
 import numpy as np
 import time
 
+import blend_modes
+from papercut_mask import PapercutMask, as_mask
+
 
 def desaturate_image(image: Image.Image) -> Image.Image:
     """Set image saturation to 0 (convert to grayscale, but keep RGB channels)"""
@@ -20,21 +24,71 @@ def increase_contrast(image: Image.Image, factor: float = 2.0) -> Image.Image:
     return enhancer.enhance(factor)
 
 
-def remove_white_background(image: Image.Image, threshold: int = 240) -> Image.Image:
-    """Remove white background, make white parts transparent"""
-    if image.mode != 'RGBA':
-        image = image.convert('RGBA')
-    
-    img_array = np.array(image)
-    r, g, b, a = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2], img_array[:, :, 3]
+def _paste_writes_through() -> bool:
+    # Pasting into a frombuffer image after clearing its readonly flag writes into the buffer.
+    # This is undocumented Pillow behaviour (tested with Pillow 12.3), so check it once at import
+    try:
+        pixels = np.zeros((1, 1, 4), dtype=np.uint8)
+        image = Image.frombuffer('RGBA', (1, 1), pixels, 'raw', 'RGBA', 0, 1)
+        image.readonly = 0
+        image.paste((1, 2, 3, 4), (0, 0, 1, 1))
+        return pixels.tolist() == [[[1, 2, 3, 4]]]
+    except Exception:
+        return False
+
+
+_PASTE_WRITES_THROUGH = _paste_writes_through()
+
+
+def _writable_pixels(image: Image.Image):
+    """
+    Copy an image's pixels once into a writable (H, W, 4) RGBA array
     
-    # Create white mask: pixels where all RGB channels are greater than threshold
-    white_mask = (r > threshold) & (g > threshold) & (b > threshold)
+    np.array(image) goes through image.tobytes() and then copies those bytes again;
+    here Pillow writes straight into the array's memory instead. Pillow versions
+    where that does not work get the two copies.
     
+    Returns:
+        tuple: (array, RGBA image sharing the array's memory)
+    """
+    if not _PASTE_WRITES_THROUGH:
+        pixels = np.array(image.convert('RGBA'))
+        return pixels, Image.fromarray(pixels)
+    pixels = np.empty((image.height, image.width, 4), dtype=np.uint8)
+    shared = Image.frombuffer('RGBA', image.size, pixels, 'raw', 'RGBA', 0, 1)
+    # frombuffer images are read-only (writes would copy first); this memory is our own array
+    shared.readonly = 0
+    shared.paste(image, (0, 0))  # converts other modes like image.convert('RGBA')
+    return pixels, shared
+
+
+def _remove_white_background_inplace(pixels: np.ndarray, threshold: int):
+    # White means all RGB channels > threshold, i.e. the smallest channel is > threshold
+    darkest = np.minimum(pixels[:, :, 0], pixels[:, :, 1])
+    np.minimum(darkest, pixels[:, :, 2], out=darkest)
     # Set alpha channel of white pixels to 0 (fully transparent)
-    img_array[white_mask, 3] = 0
+    np.copyto(pixels[:, :, 3], 0, where=darkest > threshold)
+
+
+def _convert_to_red_inplace(pixels: np.ndarray, color: tuple, opacity: float):
+    alpha = pixels[:, :, 3].copy()
+    non_transparent = alpha > 0
+    
+    # Non-transparent pixels become the color, the rest black; written as whole 32-bit RGB0 pixels
+    color_pixel = np.array(list(color) + [0], dtype=np.uint8).view(np.uint32)
+    np.multiply(non_transparent, color_pixel, out=pixels.view(np.uint32)[:, :, 0], casting='unsafe')
     
-    return Image.fromarray(img_array, 'RGBA')
+    # Adjust opacity: multiply original alpha value by opacity (truncated, in buffered chunks without a float copy)
+    if opacity != 1.0:
+        np.multiply(alpha, opacity, out=alpha, casting='unsafe')
+    pixels[:, :, 3] = alpha
+
+
+def remove_white_background(image: Image.Image, threshold: int = 240) -> Image.Image:
+    """Remove white background, make white parts transparent"""
+    pixels, image = _writable_pixels(image)
+    _remove_white_background_inplace(pixels, threshold)
+    return image
 
 
 def convert_to_red(image: Image.Image, color: tuple = (255, 0, 0), opacity: float = 1.0) -> Image.Image:
@@ -46,23 +100,9 @@ def convert_to_red(image: Image.Image, color: tuple = (255, 0, 0), opacity: floa
         color: RGB color tuple, default is (255, 0, 0) = Pure Red
         opacity: Opacity, 0.0-1.0, default is 1.0 (fully opaque)
     """
-    if image.mode != 'RGBA':
-        image = image.convert('RGBA')
-    
-    img_array = np.array(image)
-    a = img_array[:, :, 3]
-    
-    # Set all non-transparent pixels to the specified color
-    non_transparent = a > 0
-    
-    img_array[:, :, 0] = np.where(non_transparent, color[0], 0)  # R
-    img_array[:, :, 1] = np.where(non_transparent, color[1], 0)  # G
-    img_array[:, :, 2] = np.where(non_transparent, color[2], 0)  # B
-    
-    # Adjust opacity: multiply original alpha value by opacity
-    img_array[:, :, 3] = np.where(non_transparent, (a * opacity).astype(np.uint8), 0)
-    
-    return Image.fromarray(img_array, 'RGBA')
+    pixels, image = _writable_pixels(image)
+    _convert_to_red_inplace(pixels, color, opacity)
+    return image
 
 
 def apply_color_effect(base_img: Image.Image, color: tuple) -> Image.Image:
@@ -70,29 +110,31 @@ def apply_color_effect(base_img: Image.Image, color: tuple) -> Image.Image:
     Simulate layer blending mode 'Color': 
     Use Luminance/Value of base_img
     Use Hue and Saturation of color
-    """
-    # Ensure base_img is in RGB mode for conversion
-    if base_img.mode != 'RGB':
-        base_img = base_img.convert('RGB')
-        
-    # 1. Convert base to HSV to get V
-    base_hsv = base_img.convert('HSV')
-    base_np = np.array(base_hsv)
-    v_channel = base_np[:, :, 2]
     
-    # 2. Create solid color image and convert to HSV to get H, S
-    color_layer = Image.new('RGB', base_img.size, color)
-    color_hsv = color_layer.convert('HSV')
-    color_np = np.array(color_hsv)
-    
-    h_channel = color_np[:, :, 0]
-    s_channel = color_np[:, :, 1]
-    
-    # 3. Combine new HSV image
-    new_hsv_np = np.dstack((h_channel, s_channel, v_channel))
-    new_hsv_img = Image.fromarray(new_hsv_np, 'HSV')
+    Hue and saturation are constants of color, so this is a lookup of each pixel's value
+    (see blend_modes) instead of converting a full-size color layer to HSV and back.
+    """
+    return blend_modes.blend_image(base_img, color, "color")
+
+
+def process_image_to_mask(image: Image.Image, contrast: float = 3.0, threshold: int = 230,
+                          color: tuple = (255, 0, 0)) -> PapercutMask:
+    """
+    Papercut processing pipeline producing a PapercutMask instead of an RGBA image
     
-    return new_hsv_img.convert('RGB')
+    Args:
+        image: Raw generated image
+        contrast: Contrast factor
+        threshold: White background threshold
+        color: Papercut color stored with the mask
+        
+    Returns:
+        PapercutMask: Alpha plane of the papercut, renders to any color/opacity on demand
+    """
+    image = desaturate_image(image)
+    image = increase_contrast(image, factor=contrast)
+    image = remove_white_background(image, threshold=threshold)
+    return PapercutMask(image.getchannel('A'), color)
 
 
 def process_image_for_papercut(image_path: str) -> str:
@@ -115,11 +157,14 @@ def process_image_for_papercut(image_path: str) -> str:
         # Step 2: Increase contrast (factor=3.0)
         image = increase_contrast(image, factor=3.0)
         
+        # Steps 3 and 4 share one RGBA pixel buffer
+        pixels, image = _writable_pixels(image)
+        
         # Step 3: Remove white background (threshold=230)
-        image = remove_white_background(image, threshold=230)
+        _remove_white_background_inplace(pixels, threshold=230)
         
         # Step 4: Convert to red
-        image = convert_to_red(image)
+        _convert_to_red_inplace(pixels, (255, 0, 0), 1.0)
         
         # Determine output path
         base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -141,197 +186,295 @@ def process_image_for_papercut(image_path: str) -> str:
         return None
 
 
-def render_on_window(papercut_input, scene_input, output_path=None) -> Image.Image:
+def paste_color_through_mask(scene: Image.Image, papercut: PapercutMask, color: tuple, opacity: float, position: tuple,
+                             blend_mode: str = "normal"):
     """
-    Render to window scene
+    Blend a constant color into an RGB scene through the papercut mask (in place)
+    
+    In "normal" mode this is the same result as pasting convert_to_red(papercut, color, opacity)
+    with itself as mask, without building an RGBA papercut or converting the scene to RGBA and back.
+    "multiply", "screen" and "color" blend the color with the scene pixels under the mask
+    (see blend_modes), so the papercut picks up the scene's lighting.
+    """
+    alpha = papercut.scaled_alpha(opacity)
+    x, y = position
+    if blend_mode == "normal":
+        scene.paste(tuple(color), (x, y, x + alpha.width, y + alpha.height), alpha)
+        return
+    
+    # Only the part of the mask that lies inside the scene
+    box = (max(x, 0), max(y, 0), min(x + alpha.width, scene.width), min(y + alpha.height, scene.height))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return
+    region = np.array(scene.crop(box))
+    mask = np.asarray(alpha.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y)))
+    blend_modes.composite(region, color, mask, blend_mode)
+    scene.paste(Image.fromarray(region, 'RGB'), box[:2])
+
+
+# Papercut color used for scene renders (#980015, Chinese red)
+SCENE_COLOR = (152, 0, 21)
+
+# Colorways offered for side-by-side comparison (see render_variants / render_scene_variants)
+COLORWAYS = {
+    "chinese_red": (152, 0, 21),
+    "gold": (212, 175, 55),
+    "black": (20, 20, 20),
+}
+
+
+@functools.lru_cache(maxsize=8)
+def _load_scene_plate(path: str, mtime_ns: int) -> Image.Image:
+    # Keyed by modification time so an edited plate is reloaded
+    return Image.open(path).convert('RGB')
+
+
+def load_scene(scene_input) -> Image.Image:
+    """
+    Scene image to composite onto (always a fresh RGB copy that may be modified in place)
+    
+    Scene plates given by path are decoded once and cached; every render gets its own copy.
+    
+    Args:
+        scene_input: Scene image path (str) or PIL.Image object
+    """
+    if isinstance(scene_input, str):
+        return _load_scene_plate(scene_input, os.stat(scene_input).st_mtime_ns).copy()
+    return scene_input.convert('RGB')
+
+
+def _window_size(papercut_size, scene_size):
+    # Fixed 1736x1736 (Base_Window.jpg 5760x3840)
+    return 1736, 1736
+
+
+def _wall_size(papercut_size, scene_size):
+    # Base_wall.jpeg (768x768)
+    # Scale papercut image to 49.48% of background height
+    target_height = int(scene_size[1] * 0.4948)
+    aspect_ratio = papercut_size[0] / papercut_size[1]
+    return int(target_height * aspect_ratio), target_height
+
+
+def _door_size(papercut_size, scene_size):
+    # Base_door.jpg (799x799)
+    # Scale papercut image to 18% of background height
+    target_height = int(scene_size[1] * 0.18)
+    aspect_ratio = papercut_size[0] / papercut_size[1]
+    return int(target_height * aspect_ratio), target_height
+
+
+def _package_size(papercut_size, scene_size):
+    # Base_package.jpg (4032x2688)
+    # Scale papercut image size to about 25% of background image (width)
+    target_width = int(scene_size[0] * 0.25)
+    aspect_ratio = papercut_size[1] / papercut_size[0]
+    return target_width, int(target_width * aspect_ratio)
+
+
+def _place_on_window(papercut: PapercutMask, scene_size):
+    # 1. Resize to 1736x1736
+    papercut = papercut.resize(_window_size(papercut.size, scene_size), Image.Resampling.LANCZOS)
+    
+    # Window coordinates
+    return papercut, (2890, 137)
+
+
+def _place_on_wall(papercut: PapercutMask, scene_size):
+    scene_width, scene_height = scene_size
+    target_width, target_height = _wall_size(papercut.size, scene_size)
+    
+    papercut = papercut.resize((target_width, target_height), Image.Resampling.LANCZOS)
+    
+    # Image center point at Height 37.3%, Width 66.67%
+    center_x = int(scene_width * 0.6667)
+    center_y = int(scene_height * 0.373)
+    
+    return papercut, (center_x - target_width // 2, center_y - target_height // 2)
+
+
+def _place_on_door(papercut: PapercutMask, scene_size):
+    scene_width, scene_height = scene_size
+    target_width, target_height = _door_size(papercut.size, scene_size)
+    
+    papercut = papercut.resize((target_width, target_height), Image.Resampling.LANCZOS)
+    
+    # Image center point at Height 36.3%, Width 62.45%
+    center_x = int(scene_width * 0.6245)
+    center_y = int(scene_height * 0.363)
+    
+    return papercut, (center_x - target_width // 2, center_y - target_height // 2)
+
+
+def _place_on_package(papercut: PapercutMask, scene_size):
+    scene_width, scene_height = scene_size
+    
+    # Resize and rotate 33 degrees (counter-clockwise) in one affine transform of the mask
+    papercut = papercut.resize_rotate(_package_size(papercut.size, scene_size), 33,
+                                      resample=Image.Resampling.BICUBIC)
+    
+    # Image center point position at Height 48.33%, Width 48%
+    center_x = int(scene_width * 0.48)
+    center_y = int(scene_height * 0.4833)
+    
+    # Size changes after rotation, need to re-acquire size
+    new_width, new_height = papercut.size
+    
+    return papercut, (center_x - new_width // 2, center_y - new_height // 2)
+
+
+# Scene name -> size the papercut is scaled to before placement (before rotation)
+SCENE_PAPERCUT_SIZES = {
+    "window": _window_size,
+    "wall": _wall_size,
+    "door": _door_size,
+    "package": _package_size,
+}
+
+
+def scene_papercut_size(scene_name: str, scene_size, papercut_size=(1024, 1024)):
+    """
+    Pixel size a papercut is drawn at in a scene
+    
+    Args:
+        scene_name: "window", "wall", "door" or "package"
+        scene_size: (width, height) of the scene plate
+        papercut_size: (width, height) of the papercut
+    Returns:
+        tuple: (width, height) before any rotation
+    """
+    return SCENE_PAPERCUT_SIZES[scene_name](papercut_size, scene_size)
+
+
+# Scene name -> (placement, default opacity)
+SCENE_PLACEMENTS = {
+    "window": (_place_on_window, 0.75),
+    "wall": (_place_on_wall, 0.9),
+    "door": (_place_on_door, 0.9),
+    # Simulate printing texture: slightly reduce opacity
+    "package": (_place_on_package, 0.85),
+}
+
+
+def render_scene(scene_name: str, papercut_input, scene_input, output_path=None,
+                 color: tuple = SCENE_COLOR, opacity: float = None, blend_mode: str = "normal",
+                 in_place: bool = False) -> Image.Image:
+    """
+    Render a papercut onto a named scene
+    
     Args:
-        papercut_input: Papercut image path (str) or PIL.Image object
+        scene_name: "window", "wall", "door" or "package"
+        papercut_input: Papercut image path (str), PIL.Image object or PapercutMask
         scene_input: Scene image path (str) or PIL.Image object
         output_path: (Optional) Output path, save if provided
+        color: RGB papercut color
+        opacity: (Optional) Opacity 0.0-1.0, the scene's default if None
+        blend_mode: "normal", "multiply", "screen" or "color" (see blend_modes)
+        in_place: Draw directly into scene_input, an RGB image handed over by the caller
+                  (e.g. a canvas from pipeline.ScenePreparation), instead of a copy
     Returns:
         PIL.Image: Composited image
     """
     try:
-        # Load Papercut
-        if isinstance(papercut_input, str):
-            papercut = Image.open(papercut_input).convert('RGBA')
-        else:
-            papercut = papercut_input.convert('RGBA')
-
-        # Load Scene
-        if isinstance(scene_input, str):
-            scene = Image.open(scene_input).convert('RGB')
-        else:
-            scene = scene_input.convert('RGB')
-        
-        # Prepare papercut image for window scene composition
-        # 1. Resize to 1736x1736 (Base_Window.jpg 5760x3840)
-        papercut = papercut.resize((1736, 1736), Image.Resampling.LANCZOS)
-        # 2. Apply specific color (#980015) and opacity (75%)
-        processed_papercut = convert_to_red(papercut, color=(152, 0, 21), opacity=0.75)
-        
-        # Window coordinates
-        x, y = 2890, 137
+        place, default_opacity = SCENE_PLACEMENTS[scene_name]
         
-        scene_rgba = scene.convert('RGBA')
-        scene_rgba.paste(processed_papercut, (x, y), processed_papercut)
+        # Load Papercut as a single-channel mask
+        papercut = as_mask(papercut_input)
+        scene = scene_input if in_place and scene_input.mode == 'RGB' else load_scene(scene_input)
         
-        final_image = scene_rgba.convert('RGB')
+        placed, position = place(papercut, scene.size)
+        final_image = scene
+        paste_color_through_mask(final_image, placed, color, default_opacity if opacity is None else opacity, position,
+                                 blend_mode)
         
         if output_path:
             final_image.save(output_path)
             
         return final_image
     except Exception as e:
-        print(f"Error rendering on window: {e}")
+        print(f"Error rendering on {scene_name}: {e}")
         return None
 
 
+def render_on_window(papercut_input, scene_input, output_path=None) -> Image.Image:
+    """
+    Render to window scene
+    Args:
+        papercut_input: Papercut image path (str), PIL.Image object or PapercutMask
+        scene_input: Scene image path (str) or PIL.Image object
+        output_path: (Optional) Output path, save if provided
+    Returns:
+        PIL.Image: Composited image
+    """
+    return render_scene("window", papercut_input, scene_input, output_path)
+
+
 def render_on_wall(papercut_input, scene_input, output_path=None) -> Image.Image:
     """
     Render to wall scene
     """
-    try:
-        # Load Papercut
-        if isinstance(papercut_input, str):
-            papercut = Image.open(papercut_input).convert('RGBA')
-        else:
-            papercut = papercut_input.convert('RGBA')
-
-        # Load Scene
-        if isinstance(scene_input, str):
-            scene = Image.open(scene_input).convert('RGB')
-        else:
-            scene = scene_input.convert('RGB')
-            
-        # Base_wall.jpeg (768x768)
-        # Scale papercut image to 49.48% of background height
-        target_height = int(scene.height * 0.4948)
-        aspect_ratio = papercut.width / papercut.height
-        target_width = int(target_height * aspect_ratio)
-        
-        papercut = papercut.resize((target_width, target_height), Image.Resampling.LANCZOS)
-        processed_papercut = convert_to_red(papercut, color=(152, 0, 21), opacity=0.9) 
-        
-        # Image center point at Height 37.3%, Width 66.67%
-        center_x = int(scene.width * 0.6667)
-        center_y = int(scene.height * 0.373)
-        
-        x = center_x - target_width // 2
-        y = center_y - target_height // 2
-        
-        scene_rgba = scene.convert('RGBA')
-        scene_rgba.paste(processed_papercut, (x, y), processed_papercut)
-        
-        final_image = scene_rgba.convert('RGB')
-        
-        if output_path:
-            final_image.save(output_path)
-            
-        return final_image
-    except Exception as e:
-        print(f"Error rendering on wall: {e}")
-        return None
+    return render_scene("wall", papercut_input, scene_input, output_path)
 
 
 def render_on_door(papercut_input, scene_input, output_path=None) -> Image.Image:
     """
     Render to door scene
     """
-    try:
-        # Load Papercut
-        if isinstance(papercut_input, str):
-            papercut = Image.open(papercut_input).convert('RGBA')
-        else:
-            papercut = papercut_input.convert('RGBA')
-
-        # Load Scene
-        if isinstance(scene_input, str):
-            scene = Image.open(scene_input).convert('RGB')
-        else:
-            scene = scene_input.convert('RGB')
-            
-        # Base_door.jpg (799x799)
-        # Scale papercut image to 18% of background height
-        target_height = int(scene.height * 0.18)
-        aspect_ratio = papercut.width / papercut.height
-        target_width = int(target_height * aspect_ratio)
-        
-        papercut = papercut.resize((target_width, target_height), Image.Resampling.LANCZOS)
-        processed_papercut = convert_to_red(papercut, color=(152, 0, 21), opacity=0.9)
-        
-        # Image center point at Height 36.3%, Width 62.45%
-        center_x = int(scene.width * 0.6245)
-        center_y = int(scene.height * 0.363)
-        
-        x = center_x - target_width // 2
-        y = center_y - target_height // 2
-        
-        scene_rgba = scene.convert('RGBA')
-        scene_rgba.paste(processed_papercut, (x, y), processed_papercut)
-        
-        final_image = scene_rgba.convert('RGB')
-        
-        if output_path:
-            final_image.save(output_path)
-            
-        return final_image
-    except Exception as e:
-        print(f"Error rendering on door: {e}")
-        return None
+    return render_scene("door", papercut_input, scene_input, output_path)
 
 
 def render_on_package(papercut_input, scene_input, output_path=None) -> Image.Image:
     """
     Render to package scene
     """
+    return render_scene("package", papercut_input, scene_input, output_path)
+
+
+def render_variants(papercut_input, variants) -> list:
+    """
+    Colorize one papercut in K colors/opacities at once
+    
+    Args:
+        papercut_input: Papercut image path (str), PIL.Image object or PapercutMask
+        variants: List of (color, opacity) pairs
+    Returns:
+        list: K RGBA images, each identical to convert_to_red(papercut, color, opacity)
+    """
+    batch = as_mask(papercut_input).render_batch(variants)
+    return [Image.fromarray(batch[k], 'RGBA') for k in range(len(batch))]
+
+
+def render_scene_variants(scene_name: str, papercut_input, scene_input, variants, blend_mode: str = "normal") -> list:
+    """
+    Render K color/opacity variants of a papercut onto one scene
+    
+    The mask is resized/rotated once and the scene plate is decoded once;
+    each variant is a copy of the plate with its color blended through the mask.
+    
+    Args:
+        scene_name: "window", "wall", "door" or "package"
+        papercut_input: Papercut image path (str), PIL.Image object or PapercutMask
+        scene_input: Scene image path (str) or PIL.Image object
+        variants: List of (color, opacity) pairs, opacity None for the scene's default
+        blend_mode: "normal", "multiply", "screen" or "color" (see blend_modes)
+    Returns:
+        list: K composited RGB images, None if rendering failed
+    """
     try:
-        # Load Papercut
-        if isinstance(papercut_input, str):
-            papercut = Image.open(papercut_input).convert('RGBA')
-        else:
-            papercut = papercut_input.convert('RGBA')
-
-        # Load Scene
-        if isinstance(scene_input, str):
-            scene = Image.open(scene_input).convert('RGB')
-        else:
-            scene = scene_input.convert('RGB')
-            
-        # Base_package.jpg (4032x2688)
-        # Scale papercut image size to about 25% of background image (width)
-        target_width = int(scene.width * 0.25)
-        aspect_ratio = papercut.height / papercut.width
-        target_height = int(target_width * aspect_ratio)
-        
-        papercut = papercut.resize((target_width, target_height), Image.Resampling.LANCZOS)
-        # Simulate printing texture: slightly reduce opacity
-        processed_papercut = convert_to_red(papercut, color=(152, 0, 21), opacity=0.85)
-        
-        # Rotate 33 degrees (counter-clockwise)
-        processed_papercut = processed_papercut.rotate(33, expand=True, resample=Image.Resampling.BICUBIC)
-        
-        # Image center point position at Height 48.33%, Width 48%
-        center_x = int(scene.width * 0.48)
-        center_y = int(scene.height * 0.4833)
-        
-        # Size changes after rotation, need to re-acquire size
-        new_width, new_height = processed_papercut.size
-        
-        x = center_x - new_width // 2
-        y = center_y - new_height // 2
-        
-        scene_rgba = scene.convert('RGBA')
-        scene_rgba.paste(processed_papercut, (x, y), processed_papercut)
-        
-        final_image = scene_rgba.convert('RGB')
-        
-        if output_path:
-            final_image.save(output_path)
-            
-        return final_image
+        place, default_opacity = SCENE_PLACEMENTS[scene_name]
+        papercut = as_mask(papercut_input)
+        plate = load_scene(scene_input)
+        placed, position = place(papercut, plate.size)
+        
+        rendered = []
+        for color, opacity in variants:
+            scene = plate.copy()
+            paste_color_through_mask(scene, placed, color, default_opacity if opacity is None else opacity, position,
+                                     blend_mode)
+            rendered.append(scene)
+        return rendered
     except Exception as e:
-        print(f"Error rendering on package: {e}")
+        print(f"Error rendering variants on {scene_name}: {e}")
         return None
 
 
@@ -0,0 +1,365 @@
+"""
+Headless HTTP API - generate, process and render without the Streamlit UI
+
+    python api_server.py --port 8765
+
+Endpoints:
+    POST /generate              JSON {"prompt", "seed"?, "output": "papercut"|"raw", "plan_for"?} -> PNG
+                                plan_for: [[target, purpose], ...], e.g. [["door", "preview"]], generates at
+                                the smallest latent those outputs need (see resolution_planner)
+                                "mode": "full" (default), "draft" (few steps, seed in X-Seed) or
+                                "refine" (full quality rerun of a draft this client made, needs its seed;
+                                the prompt is taken from the draft)
+    POST /process               raw image body (PNG/JPEG), ?contrast=&threshold=&color=%23ff0000 -> papercut PNG
+    POST /render/{scene}        papercut PNG body, ?color=&opacity=&blend_mode=&format=&max_side= -> scene image
+    GET  /metrics               Prometheus text format
+    GET  /healthz               "ok"
+
+Request bodies are capped (PAPERCUT_API_MAX_UPLOAD_MB) and so are decoded
+pixel counts and response sizes. Responses are streamed with chunked transfer
+encoding. CPU work runs off the event loop, at most PAPERCUT_API_CPU_JOBS at a
+time; generations go through the same fair GenerationScheduler as the UI, keyed
+by the X-Client-Id header.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from artifact_store import ArtifactStore
+from comfy_api import ComfyUIManager
+from image_output import encode_image, encode_papercut, _MIME_TYPES
+from Image_Processing import SCENE_COLOR, SCENE_PLACEMENTS, process_image_to_mask, render_scene
+from metrics import metrics
+from papercut_mask import PapercutMask
+from processing_dag import DEFAULT_PARAMS
+from render_cache import RenderCache, param_digest
+from resolution_planner import plan_resolution
+from draft_refine import Draft, DraftLedger, submit_draft, submit_refine
+from scheduler import GenerationScheduler, RateLimitExceeded
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKFLOW_PATH = os.path.join(BASE_DIR, "ComfyUI_Workflow", "paper_cut.json")
+OUTPUT_DIR = os.path.join(BASE_DIR, "image_raw")
+DATA_DIR = os.path.join(BASE_DIR, "data")  # Artifact index, shared with the app
+PROTOTYPE_DIR = os.path.join(BASE_DIR, "ui_assets", "prototype_images")
+SCENE_PLATES = {
+    "window": os.path.join(PROTOTYPE_DIR, "Base_Window.jpg"),
+    "package": os.path.join(PROTOTYPE_DIR, "Base_package.jpg"),
+    "door": os.path.join(PROTOTYPE_DIR, "Base_door.jpg"),
+    "wall": os.path.join(PROTOTYPE_DIR, "Base_wall.jpeg"),
+}
+
+# --- Limits ---
+MAX_UPLOAD_BYTES = int(float(os.environ.get("PAPERCUT_API_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+MAX_RESPONSE_BYTES = int(float(os.environ.get("PAPERCUT_API_MAX_RESPONSE_MB", "32")) * 1024 * 1024)
+MAX_PIXELS = int(os.environ.get("PAPERCUT_API_MAX_PIXELS", str(4096 * 4096)))  # Decoded size of an upload
+MAX_OUTPUT_SIDE = int(os.environ.get("PAPERCUT_API_MAX_OUTPUT_SIDE", "4096"))
+CPU_JOBS = int(os.environ.get("PAPERCUT_API_CPU_JOBS", str(max(1, (os.cpu_count() or 2) - 1))))
+CHUNK_BYTES = 64 * 1024
+
+# Output formats of /render (PNG for lossless scene renders)
+_RENDER_FORMATS = {"jpeg": ("JPEG", {"quality": 95, "subsampling": 0}), "webp": ("WEBP", {"quality": 85, "method": 2}),
+                   "png": ("PNG", {"compress_level": 1})}
+
+
+class _ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _parse_color(text, default):
+    """'#980015' or '152,0,21' -> (152, 0, 21)"""
+    if not text:
+        return tuple(default)
+    try:
+        if text.startswith("#") and len(text) == 7:
+            return tuple(int(text[i:i + 2], 16) for i in (1, 3, 5))
+        color = tuple(int(v) for v in text.split(","))
+        if len(color) == 3 and all(0 <= v <= 255 for v in color):
+            return color
+    except ValueError:
+        pass
+    raise _ApiError(400, f"Invalid color {text!r}, expected '#rrggbb' or 'r,g,b'")
+
+
+def _parse_number(query, name, default, cast, low, high):
+    text = query.get(name)
+    if text is None:
+        return default
+    try:
+        value = cast(text)
+    except ValueError:
+        raise _ApiError(400, f"Invalid {name} {text!r}")
+    if not low <= value <= high:
+        raise _ApiError(400, f"{name} must be between {low} and {high}")
+    return value
+
+
+def _open_upload(data: bytes) -> Image.Image:
+    """Decode an uploaded image, refusing oversized pixel counts before decompressing them"""
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Exception:
+        raise _ApiError(415, "Body is not a supported image")
+    if image.width * image.height > MAX_PIXELS:
+        raise _ApiError(413, f"Image has {image.width}x{image.height} pixels, the limit is {MAX_PIXELS}")
+    image.load()
+    return image
+
+
+async def _read_body(request) -> bytes:
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES:
+        raise _ApiError(413, f"Body exceeds {MAX_UPLOAD_BYTES} bytes")
+    try:
+        data = await request.read()
+    except web.HTTPRequestEntityTooLarge:
+        raise _ApiError(413, f"Body exceeds {MAX_UPLOAD_BYTES} bytes")
+    if not data:
+        raise _ApiError(400, "Empty body")
+    return data
+
+
+async def _stream(request, data: bytes, content_type, headers=None):
+    """Send a body with chunked transfer encoding"""
+    if len(data) > MAX_RESPONSE_BYTES:
+        raise _ApiError(413, f"Response would be {len(data)} bytes, the limit is {MAX_RESPONSE_BYTES}; "
+                             "request a smaller max_side or a lossy format")
+    response = web.StreamResponse(headers=headers or {})
+    response.content_type = content_type
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    view = memoryview(data)
+    for offset in range(0, len(view), CHUNK_BYTES):
+        await response.write(view[offset:offset + CHUNK_BYTES])
+    await response.write_eof()
+    metrics.inc("api_response_bytes_total", len(data))
+    return response
+
+
+@web.middleware
+async def _errors(request, handler):
+    endpoint = request.match_info.route.resource.canonical if request.match_info.route.resource else "unknown"
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except _ApiError as e:
+        status = e.status
+        return web.json_response({"error": e.message}, status=e.status)
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    except Exception as e:
+        print(f"API error on {request.path}: {e}")
+        return web.json_response({"error": "Internal error"}, status=500)
+    finally:
+        metrics.inc("api_requests_total", labels={"endpoint": endpoint, "status": str(status)})
+
+
+class ApiService:
+    """
+    Args:
+        store: ArtifactStore for raw and processed images
+        scheduler: (Optional) GenerationScheduler, /generate answers 503 without one
+        cpu_jobs: Concurrent CPU jobs (processing, renders, encodes)
+    """
+
+    def __init__(self, store, scheduler=None, cpu_jobs=CPU_JOBS):
+        self.store = store
+        self.scheduler = scheduler
+        self.cache = RenderCache(store)
+        self.drafts = DraftLedger()  # Refines look up the draft by (client, seed)
+        self._executor = ThreadPoolExecutor(max_workers=cpu_jobs, thread_name_prefix="api-cpu")
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=MAX_UPLOAD_BYTES, middlewares=[_errors])
+        app.router.add_post("/generate", self.generate)
+        app.router.add_post("/process", self.process)
+        app.router.add_post("/render/{scene}", self.render)
+        app.router.add_get("/metrics", self.metrics)
+        app.router.add_get("/healthz", self.healthz)
+        return app
+
+    async def _cpu(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _process_bytes(self, raw: bytes, params: dict) -> bytes:
+        """Papercut PNG of a raw image, through the render cache shared with the UI"""
+        # Same key as main.process_cache_key: content hash of the raw file plus parameters
+        key = RenderCache.key("process", hashlib.sha256(raw).hexdigest(), params=params)
+        path = self.cache.lookup("process", key)
+        if path is not None:
+            with open(path, "rb") as f:
+                return f.read()
+        mask = process_image_to_mask(_open_upload(raw), contrast=params["contrast"], threshold=params["threshold"],
+                                     color=params["color"])
+        data = encode_papercut(mask.render(), mode="P")
+        self.cache.put("process", key, data, "image_processed")
+        return data
+
+    async def generate(self, request):
+        if self.scheduler is None:
+            raise _ApiError(503, "Generation backend is not configured")
+        try:
+            body = await request.json()
+        except ValueError:
+            raise _ApiError(400, "Body must be JSON")
+        if not isinstance(body, dict):
+            raise _ApiError(400, "Body must be a JSON object")
+        mode = body.get("mode", "full")
+        if mode not in ("full", "draft", "refine"):
+            raise _ApiError(400, "mode must be 'full', 'draft' or 'refine'")
+        prompt = (body.get("prompt") or "").strip()
+        if mode != "refine" and (not prompt or len(prompt) > 500):
+            raise _ApiError(400, "prompt must be 1-500 characters")
+        seed = body.get("seed")
+        if seed is not None and not isinstance(seed, int):
+            raise _ApiError(400, "seed must be an integer")
+        output = body.get("output", "papercut")
+        if output not in ("papercut", "raw"):
+            raise _ApiError(400, "output must be 'papercut' or 'raw'")
+        if mode == "refine" and seed is None:
+            raise _ApiError(400, "refine needs the seed of the draft")
+        if body.get("plan_for") and mode != "full":
+            # A draft must keep the refine's latent size, or the refine is a different composition
+            raise _ApiError(400, "plan_for only applies to mode 'full'")
+        plan = None
+        if body.get("plan_for"):
+            plan = plan_resolution(self._plan_outputs(body["plan_for"]), SCENE_PLATES,
+                                   getattr(self.scheduler.manager, "avg_job_seconds", 30.0))
+
+        session_id = f"api:{request.headers.get('X-Client-Id') or request.remote or 'anonymous'}"
+        draft = None
+        if mode == "refine":
+            draft = self.drafts.get(session_id, seed)
+            if draft is None:
+                raise _ApiError(404, "No draft with this seed for this client")
+        try:
+            if mode == "full":
+                future = self.scheduler.submit(session_id, prompt, OUTPUT_DIR, seed=seed, session_id=session_id,
+                                               size=plan.size if plan else None)
+            elif mode == "draft":
+                draft = Draft(prompt, seed)
+                future = submit_draft(self.scheduler, session_id, draft, OUTPUT_DIR, session_id=session_id)
+                self.drafts.issue(session_id, draft)
+                seed = draft.seed
+            else:
+                future = submit_refine(self.scheduler, session_id, draft, OUTPUT_DIR, session_id=session_id)
+        except RateLimitExceeded as e:
+            raise _ApiError(429, str(e) or "Too many queued generations for this client")
+        raw_path = await asyncio.wrap_future(future)
+        if not raw_path:
+            raise _ApiError(502, "ComfyUI did not return an image")
+
+        with open(raw_path, "rb") as f:
+            raw = f.read()
+        headers = {"X-Seed": str(seed)} if seed is not None else {}
+        if plan is not None:
+            headers.update({"X-Latent-Side": str(plan.latent_side),
+                            "X-GPU-Seconds-Saved": f"{plan.gpu_seconds_saved:.1f}"})
+        if output == "raw":
+            return await _stream(request, raw, "image/png", headers)
+        params = {name: DEFAULT_PARAMS[name] for name in ("contrast", "threshold", "color")}
+        data = await self._cpu(self._process_bytes, raw, params)
+        return await _stream(request, data, "image/png", headers)
+
+    @staticmethod
+    def _plan_outputs(plan_for):
+        outputs = []
+        for entry in plan_for if isinstance(plan_for, list) else [None]:
+            if not (isinstance(entry, list) and len(entry) == 2):
+                raise _ApiError(400, "plan_for must be a list of [target, purpose] pairs")
+            target, purpose = entry
+            if target != "papercut" and not (target in SCENE_PLATES and os.path.exists(SCENE_PLATES[target])):
+                raise _ApiError(400, f"Unknown plan_for target {target!r}")
+            if purpose not in ("preview", "download", "archive"):
+                raise _ApiError(400, f"Unknown plan_for purpose {purpose!r}")
+            outputs.append((target, purpose))
+        return outputs
+
+    async def process(self, request):
+        raw = await _read_body(request)
+        params = {
+            "contrast": _parse_number(request.query, "contrast", DEFAULT_PARAMS["contrast"], float, 0.1, 20.0),
+            "threshold": _parse_number(request.query, "threshold", DEFAULT_PARAMS["threshold"], int, 0, 255),
+            "color": _parse_color(request.query.get("color"), DEFAULT_PARAMS["color"]),
+        }
+        data = await self._cpu(self._process_bytes, raw, params)
+        return await _stream(request, data, "image/png", {"X-Params-Digest": param_digest(params)[:16]})
+
+    async def render(self, request):
+        scene = request.match_info["scene"]
+        plate = SCENE_PLATES.get(scene)
+        if scene not in SCENE_PLACEMENTS or plate is None or not os.path.exists(plate):
+            raise _ApiError(404, f"Unknown scene {scene!r}, available: "
+                                 f"{', '.join(s for s, p in SCENE_PLATES.items() if os.path.exists(p))}")
+        papercut = await _read_body(request)
+        color = _parse_color(request.query.get("color"), SCENE_COLOR)
+        opacity = _parse_number(request.query, "opacity", None, float, 0.0, 1.0)
+        blend_mode = request.query.get("blend_mode", "normal")
+        if blend_mode not in ("normal", "multiply", "screen", "color"):
+            raise _ApiError(400, f"Unknown blend_mode {blend_mode!r}")
+        format_name = request.query.get("format", "jpeg").lower()
+        if format_name not in _RENDER_FORMATS:
+            raise _ApiError(400, f"format must be one of {', '.join(_RENDER_FORMATS)}")
+        max_side = _parse_number(request.query, "max_side", MAX_OUTPUT_SIDE, int, 16, MAX_OUTPUT_SIDE)
+        format, options = _RENDER_FORMATS[format_name]
+
+        def work():
+            mask = PapercutMask.from_image(_open_upload(papercut))
+            rendered = render_scene(scene, mask, plate, color=color, opacity=opacity, blend_mode=blend_mode)
+            if rendered is None:
+                raise _ApiError(500, f"Rendering on {scene} failed")
+            return encode_image(rendered, format, max_side, **options)
+
+        data = await self._cpu(work)
+        return await _stream(request, data, _MIME_TYPES.get(format, "application/octet-stream"))
+
+    async def metrics(self, request):
+        return web.Response(text=metrics.to_prometheus(), content_type="text/plain")
+
+    async def healthz(self, request):
+        return web.Response(text="ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Papercraft Maestro headless HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--no-comfyui", action="store_true", help="Serve /process and /render only")
+    args = parser.parse_args()
+
+    store = ArtifactStore(BASE_DIR,
+                          max_bytes=int(float(os.environ.get("PAPERCUT_ARTIFACT_MAX_MB", "2048")) * 1024 * 1024),
+                          max_age_seconds=float(os.environ.get("PAPERCUT_ARTIFACT_MAX_AGE_DAYS", "7")) * 24 * 3600,
+                          index_dir=DATA_DIR)
+    scheduler = None
+    if not args.no_comfyui:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        manager = ComfyUIManager(WORKFLOW_PATH, warmup=os.environ.get("PAPERCUT_WARMUP", "1") == "1",
+                                 keepalive_interval=float(os.environ.get("PAPERCUT_KEEPALIVE_SECONDS", "0")) or None,
+                                 store=store, output_mode=os.environ.get("PAPERCUT_COMFYUI_OUTPUT", "disk"))
+        scheduler = GenerationScheduler(
+            manager,
+            max_inflight=int(os.environ.get("PAPERCUT_MAX_INFLIGHT_JOBS", "1")),
+            rate_per_minute=float(os.environ.get("PAPERCUT_SESSION_RATE_PER_MINUTE", "6")),
+            max_queued_per_session=int(os.environ.get("PAPERCUT_SESSION_MAX_QUEUED", "3")),
+        )
+    web.run_app(ApiService(store, scheduler).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Content-addressed artifact store for raw, processed and rendered images
+
+Files are named by the SHA-256 of their bytes and sharded into two directory
+levels (image_raw/ab/cd/abcd....png), so concurrent users never overwrite each
+other and identical outputs are stored once. A SQLite index records size and
+access time of every artifact, so lookups and quota enforcement never need a
+directory listing. A background evictor keeps the store under a size and age quota.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+INDEX_NAME = "artifact_index.sqlite"
+
+
+class ArtifactStore:
+    """
+    Args:
+        root: Directory holding one sub-directory per artifact kind
+        max_bytes: (Optional) Total size quota, least recently used artifacts are evicted first
+        max_age_seconds: (Optional) Artifacts not accessed for longer than this are evicted
+        evict_interval: Seconds between evictor runs, the evictor is disabled if None
+        index_dir: (Optional) Directory of the SQLite index, root if None
+    """
+
+    def __init__(self, root, max_bytes=None, max_age_seconds=None, evict_interval=60, index_dir=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(index_dir or root, INDEX_NAME)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+            self._move_index(os.path.join(root, INDEX_NAME))
+
+        self._lock = threading.Lock()
+        # WAL mode + busy timeout make the index safe to share between worker processes
+        self._db = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            " path TEXT PRIMARY KEY, kind TEXT NOT NULL, digest TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed)")
+        self._db.commit()
+
+        self._stop_event = threading.Event()
+        if evict_interval and (max_bytes or max_age_seconds):
+            threading.Thread(target=self._evict_loop, args=(evict_interval,), name="artifact-evictor", daemon=True).start()
+
+    def _move_index(self, old_path):
+        """Move an index from its old location (with its WAL files), unless one already exists here"""
+        if old_path == self.index_path or not os.path.exists(old_path) or os.path.exists(self.index_path):
+            return
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(old_path + suffix):
+                os.replace(old_path + suffix, self.index_path + suffix)
+        print(f"Moved artifact index to {self.index_path}")
+
+    def path_for(self, kind, digest, ext=".png"):
+        """Sharded location of an artifact: <root>/<kind>/<d[0:2]>/<d[2:4]>/<digest><ext>"""
+        return os.path.join(self.root, kind, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def put(self, data: bytes, kind, ext=".png") -> str:
+        """
+        Store bytes under their content hash
+
+        Args:
+            data: Encoded file content
+            kind: Artifact kind, e.g. "image_raw", "image_processed", "image_rendered"
+            ext: File extension including the dot
+
+        Returns:
+            str: Path of the stored artifact
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(kind, digest, ext)
+        now = time.time()
+
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM artifacts WHERE path = ?", (path,)).fetchone()
+        if row is not None and os.path.exists(path):
+            # Identical content already stored: just refresh its access time
+            self._touch(path, now)
+            metrics.inc("artifact_store_dedup_total", labels={"kind": kind})
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO artifacts (path, kind, digest, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, kind, digest, len(data), now, now),
+            )
+            self._db.commit()
+        metrics.inc("artifact_store_writes_total", labels={"kind": kind})
+        return path
+
+    def put_image(self, image, kind, format="PNG", **save_kwargs) -> str:
+        """Encode a PIL image and store it (see put)"""
+        buf = io.BytesIO()
+        image.save(buf, format=format, **save_kwargs)
+        ext = ".jpg" if format.upper() == "JPEG" else f".{format.lower()}"
+        return self.put(buf.getvalue(), kind, ext)
+
+    def get(self, kind, digest, ext=".png"):
+        """
+        Look up an artifact by content hash
+
+        Returns:
+            str: Path of the artifact, None if it is not stored (or was evicted)
+        """
+        path = self.path_for(kind, digest, ext)
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM artifacts WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        self._touch(path, time.time())
+        return path
+
+    def touch(self, path):
+        """Mark an artifact as just used, so quota eviction (least recently used first) keeps it"""
+        self._touch(path, time.time())
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+
+    def evict(self) -> int:
+        """
+        Enforce the age and size quota
+
+        Returns:
+            int: Number of evicted artifacts
+        """
+        cutoff = time.time() - self.max_age_seconds if self.max_age_seconds else None
+        victims = []
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, accessed FROM artifacts ORDER BY accessed").fetchall()
+            total = sum(row[1] for row in rows)
+            # Oldest access first: stop at the first artifact that is neither expired nor over quota
+            for path, size, accessed in rows:
+                expired = cutoff is not None and accessed < cutoff
+                over_quota = self.max_bytes is not None and total > self.max_bytes
+                if not (expired or over_quota):
+                    break
+                victims.append(path)
+                total -= size
+
+            self._db.executemany("DELETE FROM artifacts WHERE path = ?", [(p,) for p in victims])
+            self._db.commit()
+
+        for path in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if victims:
+            metrics.inc("artifact_store_evicted_total", len(victims))
+        metrics.set_gauge("artifact_store_bytes", total)
+        return len(victims)
+
+    def close(self):
+        """Stop the evictor and close the index"""
+        self._stop_event.set()
+        with self._lock:
+            self._db.close()
+
+    def _touch(self, path, now):
+        with self._lock:
+            self._db.execute("UPDATE artifacts SET accessed = ? WHERE path = ?", (now, path))
+            self._db.commit()
+
+    def _evict_loop(self, interval):
+        while not self._stop_event.wait(timeout=interval):
+            try:
+                removed = self.evict()
+                if removed:
+                    print(f"Artifact store evicted {removed} files")
+            except Exception as e:
+                print(f"Error evicting artifacts: {e}")
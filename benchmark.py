@@ -0,0 +1,245 @@
+"""
+Benchmarks for the image output and processing paths
+
+Usage:
+    python benchmark.py                 # run all benchmarks
+    python benchmark.py papercut_png    # run one benchmark
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+import blend_modes
+from Image_Processing import (COLORWAYS, convert_to_red, remove_white_background, render_on_door, render_on_package,
+                              render_on_wall, render_scene, render_scene_variants)
+from papercut_mask import PapercutMask
+from image_output import SCENE_OUTPUT_POLICY, encode_image, encode_papercut, load_papercut
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKGROUND_DIR = os.path.join(BASE_DIR, "ui_assets", "background")
+PROTOTYPE_DIR = os.path.join(BASE_DIR, "ui_assets", "prototype_images")
+
+
+def _timeit(fn, repeat=3):
+    """Best wall time of fn over repeat runs, and its last result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def _background_papercuts():
+    """Bundled background papercuts, colored like a processed result"""
+    for f in sorted(os.listdir(BACKGROUND_DIR)):
+        if f.endswith(".png"):
+            image = Image.open(os.path.join(BACKGROUND_DIR, f))
+            yield f, convert_to_red(image, color=(152, 0, 21))
+
+
+def bench_papercut_png():
+    """RGBA vs palette (P) vs LA papercut PNGs: size, encode time and lossless round trip"""
+    modes = ["RGBA", "P", "LA"]
+    totals = {m: [0, 0.0] for m in modes}
+
+    print(f"{'image':<20}" + "".join(f"{m + ' KB':>10}{m + ' ms':>10}" for m in modes))
+    for name, papercut in _background_papercuts():
+        row = f"{name:<20}"
+        reference = np.asarray(papercut)
+        for mode in modes:
+            # RGBA baseline uses Pillow's default compression, like image.save(path, 'PNG')
+            level = 6 if mode == "RGBA" else None
+            kwargs = {"compress_level": level} if level is not None else {}
+            elapsed, data = _timeit(lambda: encode_papercut(papercut, mode, **kwargs))
+            assert np.array_equal(np.asarray(load_papercut(data)), reference), f"{name} {mode} is not lossless"
+            totals[mode][0] += len(data)
+            totals[mode][1] += elapsed
+            row += f"{len(data) / 1024:>10.1f}{elapsed * 1000:>10.1f}"
+        print(row)
+
+    base_size, base_time = totals["RGBA"]
+    for mode in modes[1:]:
+        size, elapsed = totals[mode]
+        print(f"{mode}: {base_size / size:.2f}x smaller, {base_time / elapsed:.2f}x faster to encode than RGBA")
+
+
+def _scene_composites():
+    """Composites of one bundled papercut on every bundled scene plate"""
+    papercut = convert_to_red(Image.open(os.path.join(BACKGROUND_DIR, "BG_Tiger.png")), color=(152, 0, 21))
+    scenes = [
+        ("package", render_on_package, "Base_package.jpg"),
+        ("door", render_on_door, "Base_door.jpg"),
+        ("wall", render_on_wall, "Base_wall.jpeg"),
+    ]
+    for scene, render, plate in scenes:
+        plate_path = os.path.join(PROTOTYPE_DIR, plate)
+        if os.path.exists(plate_path):
+            yield scene, render(papercut, plate_path)
+
+
+def bench_scene_formats():
+    """Scene composites: encode time and size per output format, plus the configured policy per purpose"""
+    candidates = [
+        ("PNG", {}),
+        ("PNG", {"compress_level": 1}),
+        ("JPEG", {"quality": 85}),
+        ("JPEG", {"quality": 95, "subsampling": 0}),
+        ("WEBP", {"quality": 85, "method": 0}),
+        ("WEBP", {"quality": 85, "method": 2}),
+        ("WEBP", {"lossless": True, "method": 0}),
+    ]
+    for scene, composite in _scene_composites():
+        print(f"\n{scene} ({composite.width}x{composite.height})")
+        print(f"{'format':<48}{'KB':>10}{'ms':>10}")
+        for format, options in candidates:
+            elapsed, data = _timeit(lambda: encode_image(composite, format, **options), repeat=1)
+            print(f"{format + ' ' + str(options):<48}{len(data) / 1024:>10.1f}{elapsed * 1000:>10.1f}")
+
+        scene_policy = dict(SCENE_OUTPUT_POLICY["default"], **SCENE_OUTPUT_POLICY.get(scene, {}))
+        for purpose, (format, max_side, options) in scene_policy.items():
+            elapsed, data = _timeit(lambda: encode_image(composite, format, max_side, **options), repeat=1)
+            label = f"policy {purpose}: {format} max_side={max_side}"
+            print(f"{label:<48}{len(data) / 1024:>10.1f}{elapsed * 1000:>10.1f}")
+
+
+def bench_variants():
+    """K color/opacity variants: convert_to_red loop vs one batched render, and per-variant scene renders vs shared placement"""
+    papercut = convert_to_red(Image.open(os.path.join(BACKGROUND_DIR, "BG_Tiger.png")), color=(152, 0, 21))
+    mask = PapercutMask.from_image(papercut)
+    variants = [(color, opacity) for color in COLORWAYS.values() for opacity in (1.0, 0.85, 0.6)]
+    buffer = np.empty((len(variants), mask.height, mask.width, 4), dtype=np.uint8)
+
+    loop_time, references = _timeit(lambda: [convert_to_red(papercut, color, opacity) for color, opacity in variants])
+    batch_time, _ = _timeit(lambda: mask.render_batch(variants, out=buffer))
+    for k, reference in enumerate(references):
+        assert np.array_equal(buffer[k], np.asarray(reference)), f"variant {k} differs from convert_to_red"
+    print(f"{len(variants)} papercut variants: loop {loop_time * 1000:.1f} ms, batch {batch_time * 1000:.1f} ms "
+          f"({loop_time / batch_time:.1f}x)")
+
+    plate = os.path.join(PROTOTYPE_DIR, "Base_package.jpg")
+    if os.path.exists(plate):
+        colors = list(COLORWAYS.values())
+        loop_time, _ = _timeit(lambda: [render_on_package(convert_to_red(papercut, color), Image.open(plate))
+                                        for color in colors], repeat=1)
+        shared_time, _ = _timeit(lambda: render_scene_variants("package", mask, plate, [(c, None) for c in colors]),
+                                 repeat=1)
+        print(f"{len(colors)} package renders: loop {loop_time * 1000:.1f} ms, shared {shared_time * 1000:.1f} ms "
+              f"({loop_time / shared_time:.1f}x)")
+
+
+def _legacy_apply_color_effect(base_img, color):
+    """apply_color_effect before blend_modes: full-size color layer and two extra HSV conversions"""
+    base_img = base_img.convert('RGB')
+    v_channel = np.array(base_img.convert('HSV'))[:, :, 2]
+    color_np = np.array(Image.new('RGB', base_img.size, color).convert('HSV'))
+    new_hsv_np = np.dstack((color_np[:, :, 0], color_np[:, :, 1], v_channel))
+    return Image.fromarray(new_hsv_np, 'HSV').convert('RGB')
+
+
+def bench_blend_modes():
+    """Blend modes on a scene plate vs the previous apply_color_effect, and masked scene composites per mode"""
+    plate_path = os.path.join(PROTOTYPE_DIR, "Base_package.jpg")
+    plate = Image.open(plate_path).convert("RGB")
+    color = COLORWAYS["chinese_red"]
+
+    legacy_time, legacy = _timeit(lambda: _legacy_apply_color_effect(plate, color))
+    print(f"{'legacy apply_color_effect':<28}{legacy_time * 1000:>10.1f} ms")
+    base = np.asarray(plate)
+    for mode in blend_modes.BLEND_MODES:
+        elapsed, result = _timeit(lambda: blend_modes.blend(base, color, mode))
+        if mode == "color":
+            assert np.array_equal(result, np.asarray(legacy)), "color mode differs from apply_color_effect"
+        print(f"{'blend ' + mode:<28}{elapsed * 1000:>10.1f} ms ({legacy_time / elapsed:.1f}x)")
+
+    papercut = convert_to_red(Image.open(os.path.join(BACKGROUND_DIR, "BG_Tiger.png")), color=color)
+    mask = PapercutMask.from_image(papercut)
+    for mode in blend_modes.BLEND_MODES:
+        elapsed, _ = _timeit(lambda: render_scene("package", mask, plate_path, blend_mode=mode))
+        print(f"{'package scene ' + mode:<28}{elapsed * 1000:>10.1f} ms")
+
+
+def _legacy_remove_white_background(image, threshold=240):
+    """remove_white_background before the in-place rewrite: np.array copy, bool temporaries, fromarray"""
+    img_array = np.array(image.convert('RGBA'))
+    r, g, b = img_array[:, :, 0], img_array[:, :, 1], img_array[:, :, 2]
+    img_array[(r > threshold) & (g > threshold) & (b > threshold), 3] = 0
+    return Image.fromarray(img_array, 'RGBA')
+
+
+def _legacy_convert_to_red(image, color=(255, 0, 0), opacity=1.0):
+    """convert_to_red before the in-place rewrite: np.array copy, four np.where temporaries, float alpha"""
+    img_array = np.array(image.convert('RGBA'))
+    a = img_array[:, :, 3]
+    non_transparent = a > 0
+    for channel in range(3):
+        img_array[:, :, channel] = np.where(non_transparent, color[channel], 0)
+    img_array[:, :, 3] = np.where(non_transparent, (a * opacity).astype(np.uint8), 0)
+    return Image.fromarray(img_array, 'RGBA')
+
+
+def _traced_peak(fn):
+    """Peak Python-tracked allocation (NumPy buffers, bytes) while running fn, and its result"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def bench_pixel_memory():
+    """remove_white_background / convert_to_red: tracemalloc peak and time, before vs after the in-place rewrite"""
+    papercut = Image.open(os.path.join(BACKGROUND_DIR, "BG_Tiger.png")).convert("RGBA")
+    # A raw-like generation: opaque RGB on a near-white background, at 2x the generation size
+    raw = Image.new("RGB", papercut.size, (250, 248, 245))
+    raw.paste(papercut.convert("RGB"), (0, 0), papercut)
+    raw = raw.resize((2048, 2048), Image.Resampling.LANCZOS)
+    cleaned = remove_white_background(raw, 230)
+
+    cases = [
+        ("remove_white_background", _legacy_remove_white_background, remove_white_background, (raw, 230)),
+        ("convert_to_red", _legacy_convert_to_red, convert_to_red, (cleaned, (152, 0, 21), 0.85)),
+    ]
+    print(f"{'function':<28}{'before MiB':>12}{'after MiB':>12}{'before ms':>12}{'after ms':>12}")
+    for name, legacy, current, args in cases:
+        legacy_peak, expected = _traced_peak(lambda: legacy(*args))
+        peak, result = _traced_peak(lambda: current(*args))
+        assert np.array_equal(np.asarray(result), np.asarray(expected)), f"{name} output changed"
+        legacy_time, _ = _timeit(lambda: legacy(*args))
+        elapsed, _ = _timeit(lambda: current(*args))
+        print(f"{name:<28}{legacy_peak / 2 ** 20:>12.1f}{peak / 2 ** 20:>12.1f}"
+              f"{legacy_time * 1000:>12.1f}{elapsed * 1000:>12.1f}")
+
+
+BENCHMARKS = {
+    "papercut_png": bench_papercut_png,
+    "scene_formats": bench_scene_formats,
+    "variants": bench_variants,
+    "blend_modes": bench_blend_modes,
+    "pixel_memory": bench_pixel_memory,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Papercraft Maestro benchmarks")
+    parser.add_argument("names", nargs="*", help=f"Benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    for name in args.names or BENCHMARKS:
+        print(f"\n=== {name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Blend Modes - Blend a constant color into RGB images on NumPy arrays
+
+Every mode blends a single color, so its result for one pixel depends only on
+that pixel's channel values (normal, multiply, screen) or on its value
+max(R, G, B) (color). Each mode is therefore a 256-entry lookup table built once
+per color and applied in one pass, instead of building full-size color layers
+and converting whole images between RGB and HSV.
+"""
+
+import functools
+
+import numpy as np
+from PIL import Image
+
+BLEND_MODES = ("normal", "multiply", "screen", "color")
+
+
+def hue_saturation(color: tuple):
+    """
+    Hue and saturation of an RGB color on Pillow's 0-255 HSV scale
+
+    Returns:
+        tuple: (hue, saturation), the same values Image.convert('HSV') gives for this color
+    """
+    # A one-pixel conversion: colorsys works in double precision and is off by one
+    # against Pillow's single-precision math for about 1% of colors
+    hue, saturation, _ = Image.new('RGB', (1, 1), tuple(color)).convert('HSV').getpixel((0, 0))
+    return hue, saturation
+
+
+@functools.lru_cache(maxsize=64)
+def _color_lut(hue: int, saturation: int) -> np.ndarray:
+    # (256, 3) RGB for every value V at a fixed hue and saturation, converted by Pillow itself
+    ramp = Image.frombytes('L', (256, 1), bytes(range(256)))
+    hsv = Image.merge('HSV', (Image.new('L', (256, 1), hue), Image.new('L', (256, 1), saturation), ramp))
+    lut = np.asarray(hsv.convert('RGB')).reshape(256, 3)
+    lut.flags.writeable = False
+    return lut
+
+
+@functools.lru_cache(maxsize=64)
+def _channel_lut(mode: str, color: tuple) -> np.ndarray:
+    # (256, 3): result of each channel value blended with the color's channel
+    base = np.arange(256, dtype=np.uint32)[:, None]
+    top = np.array(color, dtype=np.uint32)[None, :]
+    if mode == "normal":
+        lut = np.broadcast_to(top, (256, 3))
+    elif mode == "multiply":
+        lut = (base * top + 127) // 255
+    elif mode == "screen":
+        lut = 255 - ((255 - base) * (255 - top) + 127) // 255
+    else:
+        raise ValueError(f"Unknown blend mode {mode!r}, expected one of {BLEND_MODES}")
+    lut = np.ascontiguousarray(lut, dtype=np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def blend(base: np.ndarray, color: tuple, mode: str = "color", out: np.ndarray = None) -> np.ndarray:
+    """
+    Blend a constant color over an RGB array
+
+    Args:
+        base: (H, W, 3) uint8 RGB array
+        color: RGB color of the top layer
+        mode: "normal", "multiply", "screen" or "color" (value of base, hue and saturation of color)
+        out: (Optional) (H, W, 3) uint8 array for the result
+
+    Returns:
+        np.ndarray: (H, W, 3) uint8 blended RGB
+    """
+    color = tuple(int(c) for c in color)
+    if mode == "color":
+        # Reducing over the 3-wide last axis is ~15x slower than two elementwise maximums
+        value = np.maximum(np.maximum(base[..., 0], base[..., 1]), base[..., 2])
+        lut = _color_lut(*hue_saturation(color))
+        return np.take(lut, value, axis=0, out=out)
+
+    # Pillow applies a per-channel table in one C pass over interleaved RGB
+    blended = Image.fromarray(base, 'RGB').point(_point_table(mode, color))
+    if out is None:
+        return np.array(blended)
+    out[...] = np.asarray(blended)
+    return out
+
+
+def _point_table(mode: str, color: tuple) -> list:
+    # 768-entry table for Image.point: all of R, then G, then B
+    return _channel_lut(mode, color).T.ravel().tolist()
+
+
+def composite(base: np.ndarray, color: tuple, alpha: np.ndarray, mode: str = "normal") -> np.ndarray:
+    """
+    Blend a constant color into an RGB array through an alpha mask (in place)
+
+    Args:
+        base: (H, W, 3) uint8 RGB array, modified in place
+        color: RGB color of the top layer
+        alpha: (H, W) uint8 coverage of the top layer
+        mode: Blend mode, see blend()
+
+    Returns:
+        np.ndarray: base
+    """
+    blended = blend(base, color, mode).astype(np.uint16)
+    weight = alpha[..., None].astype(np.uint16)
+    # base + (blended - base) * alpha / 255, rounded, in unsigned 16-bit arithmetic
+    blended *= weight
+    blended += base * (255 - weight)
+    blended += 127
+    blended //= 255
+    base[...] = blended
+    return base
+
+
+def blend_image(image: Image.Image, color: tuple, mode: str = "color") -> Image.Image:
+    """PIL version of blend(): blend a constant color over a whole image, returns RGB"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if mode == "color":
+        return Image.fromarray(blend(np.asarray(image), color, mode), 'RGB')
+    return image.point(_point_table(mode, tuple(int(c) for c in color)))
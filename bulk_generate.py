@@ -0,0 +1,312 @@
+"""
+Bulk Generation - Overnight papercut catalogs from a JSONL prompt manifest
+
+    python bulk_generate.py catalog.jsonl --out catalog/ --concurrency 2 --scenes door,wall
+
+Each manifest line is a JSON object:
+
+    {"id": "fish", "prompt": "a koi fish", "seed": 42, "scenes": ["door", "package"]}
+
+Only "prompt" is required. "id" defaults to the line number, "seed" to a random
+seed (recorded, so a rerun reproduces the image), "scenes" to --scenes.
+With --plan-resolution each item is generated at the smallest latent size its
+scenes and --purpose need (see resolution_planner); papercut.png is then only
+as large as that, unless --papercut-purpose or --upscale asks for more.
+
+Generations are kept --concurrency deep in ComfyUI's queue, and each result is
+processed and rendered while the next ones are still generating. Every finished
+item is appended to a checkpoint manifest (<out>/checkpoint.jsonl); an
+interrupted run started again with the same arguments skips the items recorded
+as done and retries the failed ones.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from comfy_api import OUTPUT_MODES, ComfyUIManager
+from image_output import encode_image, encode_papercut, extension_for, load_output_policy, scene_encodings
+from Image_Processing import SCENE_COLOR, process_image_to_mask, render_scene
+from metrics import metrics
+from pipeline import run_pipelined
+from processing_dag import DEFAULT_PARAMS
+from resolution_planner import plan_resolution
+from scheduler import GenerationScheduler
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WORKFLOW_PATH = os.path.join(BASE_DIR, "ComfyUI_Workflow", "paper_cut.json")
+PROTOTYPE_DIR = os.path.join(BASE_DIR, "ui_assets", "prototype_images")
+SCENE_PLATES = {
+    "window": os.path.join(PROTOTYPE_DIR, "Base_Window.jpg"),
+    "package": os.path.join(PROTOTYPE_DIR, "Base_package.jpg"),
+    "door": os.path.join(PROTOTYPE_DIR, "Base_door.jpg"),
+    "wall": os.path.join(PROTOTYPE_DIR, "Base_wall.jpeg"),
+}
+
+CHECKPOINT_NAME = "checkpoint.jsonl"
+
+
+def load_manifest(path, default_scenes):
+    """
+    Read a JSONL prompt manifest
+
+    Returns:
+        list: Items {"id", "prompt", "seed", "scenes"}, seeds filled in for items without one
+    """
+    items = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: invalid JSON ({e})")
+            if not isinstance(entry, dict) or not str(entry.get("prompt", "")).strip():
+                raise ValueError(f"{path}:{number}: an object with a \"prompt\" is required")
+
+            item_id = str(entry.get("id", number))
+            if item_id in seen:
+                raise ValueError(f"{path}:{number}: duplicate id {item_id!r}")
+            seen.add(item_id)
+            items.append({
+                "id": item_id,
+                "prompt": entry["prompt"].strip(),
+                "seed": entry.get("seed"),
+                "scenes": list(entry.get("scenes", default_scenes)),
+            })
+    return items
+
+
+def load_checkpoint(path) -> dict:
+    """
+    Latest checkpoint record per item id
+
+    A torn last line (the run was killed while writing it) is ignored.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record["id"]] = record
+    return records
+
+
+class Checkpoint:
+    """Append-only JSONL progress manifest, flushed to disk after every item"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+            if torn:
+                # Terminate a torn last line, so the next record starts on its own line
+                self._file.write("\n")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _item_dir(out_dir, item_id):
+    safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in item_id)
+    return os.path.join(out_dir, safe_id)
+
+
+def postprocess_item(item, raw_path, out_dir, policy, purpose="download", plan=None):
+    """
+    Process a raw generation and render its scenes into the item's output directory
+
+    Args:
+        plan: (Optional) ResolutionPlan the item was generated with, applies its CPU upscale
+
+    Returns:
+        dict: Output paths {"raw", "papercut", "scenes": {scene name: path}}
+    """
+    if not raw_path:
+        raise RuntimeError("ComfyUI did not return an image")
+    item_dir = _item_dir(out_dir, item["id"])
+    os.makedirs(item_dir, exist_ok=True)
+
+    raw = Image.open(raw_path)
+    if plan is not None:
+        raw = plan.upscale(raw)
+    mask = process_image_to_mask(raw, contrast=DEFAULT_PARAMS["contrast"],
+                                 threshold=DEFAULT_PARAMS["threshold"], color=DEFAULT_PARAMS["color"])
+    papercut_path = os.path.join(item_dir, "papercut.png")
+    with open(papercut_path, "wb") as f:
+        f.write(encode_papercut(mask.render(), mode="P"))
+
+    scenes = {}
+    for scene in item["scenes"]:
+        rendered = render_scene(scene, mask, SCENE_PLATES[scene], color=SCENE_COLOR)
+        if rendered is None:
+            raise RuntimeError(f"Rendering on {scene} failed")
+        format, max_side, options = scene_encodings(scene, (purpose,), policy)[purpose]
+        scene_path = os.path.join(item_dir, f"{scene}{extension_for(format)}")
+        with open(scene_path, "wb") as f:
+            f.write(encode_image(rendered, format, max_side, **options))
+        scenes[scene] = scene_path
+    return {"raw": raw_path, "papercut": papercut_path, "scenes": scenes}
+
+
+def _summary(done, failed, skipped, elapsed, generation_seconds, postprocess_seconds, gpu_seconds_saved=0.0):
+    rate = done / elapsed * 60 if elapsed > 0 else 0.0
+    lines = [
+        f"Done: {done}, failed: {failed}, skipped (already done): {skipped}",
+        f"Wall time: {elapsed:.1f}s, throughput: {rate:.2f} items/min",
+    ]
+    if generation_seconds:
+        lines.append(f"Generation: {sum(generation_seconds) / len(generation_seconds):.1f}s mean per item "
+                     f"(submit to image, including queueing)")
+    if postprocess_seconds:
+        lines.append(f"Post-processing: {sum(postprocess_seconds) / len(postprocess_seconds):.2f}s mean per item, "
+                     f"{metrics.get('pipeline_overlapped_postprocess_total'):.0f} overlapped with generation")
+    if gpu_seconds_saved:
+        lines.append(f"Resolution planning: ~{gpu_seconds_saved:.0f} GPU-seconds saved (estimate)")
+    return "\n".join(lines)
+
+
+def run(items, manager, out_dir, concurrency=1, cpu_workers=1, purpose="download", plan=False, upscale=False,
+        papercut_purpose=None):
+    """
+    Generate, process and render the manifest items that are not checkpointed as done
+
+    Args:
+        plan: Generate each item at the latent size its outputs need
+        upscale: Upscale planned (smaller) generations back to the nominal size on the CPU
+        papercut_purpose: (Optional) Purpose the plan must also cover papercut.png for, scenes only if None
+
+    Returns:
+        tuple: (done, failed, skipped) item counts
+    """
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_NAME)
+    previous = load_checkpoint(checkpoint_path)
+    pending = [item for item in items if previous.get(item["id"], {}).get("status") != "done"]
+    skipped = len(items) - len(pending)
+    for item in pending:
+        if item["seed"] is None:
+            # Reuse the seed of a failed attempt, so the catalog does not depend on where a run stopped
+            item["seed"] = previous.get(item["id"], {}).get("seed") or random.randint(1, 2**48 - 1)
+    print(f"{len(items)} items in manifest, {skipped} already done, {len(pending)} to generate")
+
+    policy = load_output_policy()
+    # One bulk "session": no rate limit, and the queue holds everything that is submitted ahead
+    scheduler = GenerationScheduler(manager, max_inflight=concurrency, max_queued_per_session=concurrency + 1)
+    checkpoint = Checkpoint(checkpoint_path)
+    started = {}
+    plans = {}
+    generation_seconds, postprocess_seconds = [], []
+    done = failed = 0
+
+    def submit(item):
+        started[item["id"]] = time.perf_counter()
+        raw_dir = _item_dir(out_dir, item["id"])
+        os.makedirs(raw_dir, exist_ok=True)
+        size = None
+        if plan:
+            outputs = [(scene, purpose) for scene in item["scenes"]]
+            if papercut_purpose is not None:
+                outputs.append(("papercut", papercut_purpose))
+            plans[item["id"]] = plan_resolution(outputs, SCENE_PLATES, manager.avg_job_seconds, upscale=upscale)
+            size = plans[item["id"]].size
+        return scheduler.submit("bulk", item["prompt"], raw_dir, seed=item["seed"], size=size)
+
+    def postprocess(item, raw_path):
+        generated = time.perf_counter()
+        generation_seconds.append(generated - started[item["id"]])
+        outputs = postprocess_item(item, raw_path, out_dir, policy, purpose, plans.get(item["id"]))
+        postprocess_seconds.append(time.perf_counter() - generated)
+        return outputs
+
+    start = time.perf_counter()
+    try:
+        for item, outputs, error in run_pipelined(pending, submit, postprocess, max_ahead=concurrency,
+                                                  workers=cpu_workers):
+            record = {"id": item["id"], "prompt": item["prompt"], "seed": item["seed"], "finished": time.time()}
+            if item["id"] in plans:
+                record["latent_side"] = plans[item["id"]].latent_side
+            if error is None:
+                record.update(status="done", **outputs)
+                done += 1
+                metrics.inc("bulk_items_total", labels={"status": "done"})
+            else:
+                record.update(status="failed", error=str(error))
+                failed += 1
+                metrics.inc("bulk_items_total", labels={"status": "failed"})
+                print(f"Item {item['id']} failed: {error}")
+            checkpoint.write(record)
+            print(f"[{done + failed}/{len(pending)}] {item['id']}: {record['status']}")
+    except KeyboardInterrupt:
+        print("Interrupted, finished items are checkpointed; run again to resume")
+    finally:
+        scheduler.shutdown()
+        checkpoint.close()
+        print(_summary(done, failed, skipped, time.perf_counter() - start, generation_seconds, postprocess_seconds,
+                       sum(p.gpu_seconds_saved for p in plans.values())))
+    return done, failed, skipped
+
+
+def main():
+    available = [scene for scene, path in SCENE_PLATES.items() if os.path.exists(path)]
+    parser = argparse.ArgumentParser(description="Papercraft Maestro bulk generation")
+    parser.add_argument("manifest", help="JSONL prompt manifest")
+    parser.add_argument("--out", required=True, help="Output directory (also holds the checkpoint manifest)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Generations kept in flight on ComfyUI")
+    parser.add_argument("--cpu-workers", type=int, default=1, help="Post-processing threads")
+    parser.add_argument("--scenes", default=",".join(available),
+                        help=f"Default scenes per item, comma separated (available: {', '.join(available)})")
+    parser.add_argument("--purpose", default="download", choices=("preview", "download", "archive"),
+                        help="Scene output policy to encode with")
+    parser.add_argument("--plan-resolution", action="store_true",
+                        help="Generate at the smallest latent size the item's scenes and --purpose need")
+    parser.add_argument("--upscale", action="store_true",
+                        help="With --plan-resolution, upscale smaller generations to full size on the CPU")
+    parser.add_argument("--papercut-purpose", default=None, choices=("preview", "download", "archive"),
+                        help="With --plan-resolution, also size the generation for papercut.png at this purpose")
+    parser.add_argument("--server", default=None, help="ComfyUI address, detected if omitted")
+    parser.add_argument("--output-mode", default="disk", choices=OUTPUT_MODES,
+                        help="How images come back from ComfyUI (websocket needs the SaveImageWebsocket node)")
+    args = parser.parse_args()
+
+    default_scenes = [scene for scene in args.scenes.split(",") if scene]
+    try:
+        items = load_manifest(args.manifest, default_scenes)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    unknown = sorted({scene for item in items for scene in item["scenes"] if scene not in available})
+    if unknown:
+        parser.error(f"unknown or missing scene(s): {', '.join(unknown)}")
+    if args.concurrency < 1 or args.cpu_workers < 1:
+        parser.error("--concurrency and --cpu-workers must be at least 1")
+
+    os.makedirs(args.out, exist_ok=True)
+    manager = ComfyUIManager(WORKFLOW_PATH, server_address=args.server, warmup=True, output_mode=args.output_mode)
+    done, failed, _ = run(items, manager, args.out, args.concurrency, args.cpu_workers, args.purpose,
+                          args.plan_resolution, args.upscale, args.papercut_purpose)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 import os
 import random
 import asyncio
+import json
 import time
 import socket
+import threading
+import uuid
 import requests
+import websocket
 
 # Handle asyncio event loop issue (Streamlit compatibility)
 try:
@@ -13,6 +17,8 @@ except RuntimeError:
 
 from comfy_api_simplified import ComfyApiWrapper, ComfyWorkflowWrapper
 
+from metrics import metrics
+
 def find_comfyui_address():
     """
     Automatically detect ComfyUI address
@@ -74,35 +80,582 @@ def _check_comfyui_port(port):
     except:
         return False
 
+# Ways of getting the generated image back from ComfyUI:
+# - "disk": SaveImage writes a PNG into ComfyUI's output directory, the client downloads it over /view
+# - "websocket": SaveImageWebsocket sends the image straight over the client's event stream, nothing is
+#   written on the backend and there is no extra HTTP round trip (needs the SaveImageWebsocket node,
+#   bundled with ComfyUI as custom_nodes/websocket_image_save.py)
+OUTPUT_MODES = ("disk", "websocket")
+
+def normalize_prompt(prompt):
+    """Normalize a user prompt for request coalescing (case and whitespace insensitive)"""
+    return " ".join(prompt.lower().split())
+
+
+class _InFlightCall:
+    """State of one in-flight call shared by the leader and all attached waiters"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls into a single execution
+
+    The first caller for a key (the leader) runs the function, every caller that
+    arrives with the same key while it is running waits and receives the same result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Run fn once per in-flight key
+
+        Args:
+            key: Hashable key identifying identical calls
+            fn: Zero-argument callable executed by the leader
+
+        Returns:
+            tuple: (result, shared) where shared is True if the result came from another caller's call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                is_leader = False
+            else:
+                call = _InFlightCall()
+                self._calls[key] = call
+                is_leader = True
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def forget(self, key):
+        """Detach the in-flight call for key so that later callers start a new one"""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def in_flight(self):
+        """Number of distinct calls currently running"""
+        with self._lock:
+            return len(self._calls)
+
+
+class _PromptJob:
+    """Book-keeping for one generation job submitted to ComfyUI"""
+
+    def __init__(self, key):
+        self.key = key
+        self.prompt_id = None
+        self.callers = set()  # one token per caller waiting on this job
+        self.cancelled = threading.Event()
+        self.cancel_sent = False
+        self.queued_at = None
+        self.started_at = None
+        self.warm_at_submit = False
+        self.cost = 1.0  # GPU time relative to a full-size, full-step job
+        self.finished = False  # set once the call that ran this job has returned
+        self.shared = False  # set once a second caller attaches
+
+
 class ComfyUIManager:
-    def __init__(self, workflow_path, server_address=None):
+    def __init__(self, workflow_path, server_address=None, poll_interval=0.5, timeout=600,
+                 warmup=False, keepalive_interval=None, store=None, output_mode="disk"):
         if server_address is None:
             self.server_address = find_comfyui_address()
         else:
             self.server_address = server_address
             
         self.workflow_path = workflow_path
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        # Optional ArtifactStore: raw images are stored by content hash instead of in output_dir
+        self.store = store
+        if output_mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode {output_mode!r}, expected one of {OUTPUT_MODES}")
+        self.output_mode = output_mode
         print(f"Connecting to ComfyUI: {self.server_address}")
         self.api = ComfyApiWrapper(self.server_address)
+        # Whether the backend has SaveImageWebsocket, None until ComfyUI has answered
+        self._websocket_node = None
+        self._probe_lock = threading.Lock()
+        if output_mode == "websocket":
+            self._websocket_available()
+        self._single_flight = SingleFlight()
+        
+        # In-flight job tracking (used to cancel superseded generations)
+        self._jobs_lock = threading.Lock()
+        self._jobs_by_key = {}
+        self._session_jobs = {}  # session_id -> (job, caller token)
+        self._avg_job_seconds = 30.0  # running estimate of GPU time per full-size, full-step job
+        
+        # Warm-up / keep-alive state
+        self.keepalive_interval = keepalive_interval
+        self._warm = False
+        self._last_activity = time.monotonic()
+        self._stop_event = threading.Event()
+        if warmup:
+            threading.Thread(target=self.warm_up, name="comfyui-warmup", daemon=True).start()
+        if keepalive_interval:
+            threading.Thread(target=self._keepalive_loop, name="comfyui-keepalive", daemon=True).start()
         
-    def generate_image(self, prompt, output_dir):
+    @property
+    def base_url(self):
+        return self.server_address.rstrip("/")
+        
+    @property
+    def avg_job_seconds(self):
+        """Running estimate of the GPU time of one full-size, full-step job"""
+        return self._avg_job_seconds
+        
+    def request_key(self, prompt, output_dir, seed=None, session_id=None, size=None, steps=None, supersede=False):
+        """
+        Coalescing key of a generate_image call (takes the same arguments)
+        
+        Returns:
+            tuple: Equal for requests that produce the same image
+        """
+        seed_policy = "random" if seed is None else int(seed)
+        # output_dir is left out so that jobs for other directories (e.g. pre-generation) are shared too
+        return (normalize_prompt(prompt), seed_policy, size, steps)
+        
+    def generate_image(self, prompt, output_dir, seed=None, session_id=None, size=None, steps=None, supersede=False):
         """
         Execute ComfyUI generation task
         
+        Identical requests (same normalized prompt, seed policy, size and steps)
+        that arrive while a matching job is in flight attach to that job and
+        receive the same result instead of starting another Flux job. Without an
+        artifact store the shared image is in the output directory of the first request.
+        
+        If supersede is set, any earlier job of the same session that is still
+        in flight is superseded: it is removed from the ComfyUI queue, or interrupted
+        if it is already running, unless another caller is still waiting on it.
+        
         Args:
             prompt (str): User input prompt
-            output_dir (str): Output directory
+            output_dir (str): Output directory (unused when the manager has an artifact store)
+            seed (int): (Optional) Fixed KSampler seed, a random seed is used if None
+            session_id (str): (Optional) Identifier of the requesting session
+            size (int): (Optional) Latent width and height in pixels, the workflow's size if None
+                        (see resolution_planner)
+            steps (int): (Optional) KSampler steps, the workflow's steps if None (see draft_refine)
+            supersede (bool): Cancel the session's earlier in-flight job first; concurrent requests
+                              of one session (e.g. an API client) run side by side if False
             
         Returns:
-            str: Full path of the generated image, returns None if failed
+            str: Full path of the generated image, returns None if failed or superseded
+        """
+        return self.generate_image_shared(prompt, output_dir, seed, session_id, size, steps, supersede)[0]
+        
+    def generate_image_shared(self, prompt, output_dir, seed=None, session_id=None, size=None, steps=None,
+                              supersede=False):
+        """
+        generate_image that also reports whether the image went to more than one caller
+        
+        Returns:
+            tuple: (image path or None, True if another request attached to the same job)
         """
+        key = self.request_key(prompt, output_dir, seed=seed, size=size, steps=steps)
+        
+        if supersede and session_id is not None:
+            self.cancel_session(session_id)
+        
+        token = object()
+        with self._jobs_lock:
+            job = self._jobs_by_key.get(key)
+            if job is None:
+                job = _PromptJob(key)
+                self._jobs_by_key[key] = job
+            if job.callers:
+                job.shared = True
+            job.callers.add(token)
+            if session_id is not None:
+                self._session_jobs[session_id] = (job, token)
+        
+        def lead():
+            # Only the leader of a call runs this
+            nonlocal job
+            job = self._leader_job(job, token, session_id)
+            try:
+                return self._generate_image(job, prompt, output_dir, seed, size, steps)
+            finally:
+                with self._jobs_lock:
+                    job.finished = True
+                    # Unregister before SingleFlight drops the call, so later callers start a new job
+                    if self._jobs_by_key.get(key) is job:
+                        del self._jobs_by_key[key]
+        
+        metrics.inc("comfyui_generation_requests_total")
+        try:
+            result, shared = self._single_flight.do(key, lead)
+        finally:
+            self._release(job, token, session_id)
+        if shared:
+            metrics.inc("comfyui_coalesced_requests_total")
+        return result, shared or job.shared
+        
+    def cancel_session(self, session_id):
+        """
+        Cancel the in-flight job of a session (if no other caller still waits on it)
+        
+        Args:
+            session_id (str): Identifier of the session whose job is superseded
+            
+        Returns:
+            bool: True if a job was cancelled on the backend
+        """
+        with self._jobs_lock:
+            entry = self._session_jobs.pop(session_id, None)
+            if entry is None:
+                return False
+            job, token = entry
+            job.callers.discard(token)
+            if job.callers or job.cancelled.is_set():
+                return False
+            job.cancelled.set()
+            if self._jobs_by_key.get(job.key) is job:
+                del self._jobs_by_key[job.key]
+        
+        # New requests for the same key must not attach to the cancelled job
+        self._single_flight.forget(job.key)
+        metrics.inc("comfyui_cancelled_jobs_total")
+        if job.prompt_id is not None:
+            self._cancel_prompt(job)
+        return True
+        
+    def warm_up(self, steps=1, size=256):
+        """
+        Load the Flux model, text encoders and LoRA by running a minimal version of the workflow
+        
+        Args:
+            steps (int): KSampler steps for the warm-up run
+            size (int): Latent width/height in pixels for the warm-up run
+            
+        Returns:
+            bool: True if the warm-up job completed
+        """
+        try:
+            wf = ComfyWorkflowWrapper(self.workflow_path)
+            wf.set_node_param("KSampler", "steps", steps)
+            wf.set_node_param("EmptySD3LatentImage", "width", size)
+            wf.set_node_param("EmptySD3LatentImage", "height", size)
+            
+            # Swap the save node for a preview node so nothing lands in ComfyUI's output directory
+            save_node = wf[wf.get_node_id("Save Image")]
+            save_node["class_type"] = "PreviewImage"
+            save_node["inputs"].pop("filename_prefix", None)
+            
+            job = _PromptJob(("__warmup__",))
+            job.queued_at = time.monotonic()
+            job.prompt_id = self.api.queue_prompt(wf)["prompt_id"]
+            entry = self._wait_for_completion(job, record_duration=False)
+            if entry is None:
+                print("ComfyUI warm-up did not complete")
+                return False
+            
+            latency = time.monotonic() - job.queued_at
+            metrics.observe("comfyui_warmup_seconds", latency)
+            print(f"ComfyUI warm-up finished in {latency:.1f}s (models loaded)")
+            self._warm = True
+            self._last_activity = time.monotonic()
+            return True
+        except Exception as e:
+            print(f"ComfyUI Warm-up Error: {e}")
+            return False
+        
+    def close(self):
+        """Stop the keep-alive thread"""
+        self._stop_event.set()
+        
+    def _keepalive_loop(self):
+        """Re-run the warm-up workflow whenever the backend has been idle for keepalive_interval seconds"""
+        while not self._stop_event.wait(timeout=min(self.keepalive_interval, 60)):
+            idle = time.monotonic() - self._last_activity
+            if idle < self.keepalive_interval or self._jobs_by_key:
+                continue
+            print(f"ComfyUI idle for {idle:.0f}s, sending keep-alive job")
+            self.warm_up()
+        
+    def _leader_job(self, job, token, session_id):
+        """
+        Job for a caller that leads a new call
+        
+        A caller may have picked up the job of a call that finished before it reached
+        SingleFlight; that job's prompt id and timings are stale, so it gets a new one.
+        """
+        with self._jobs_lock:
+            if not job.finished:
+                return job
+            job.callers.discard(token)
+            current = self._jobs_by_key.get(job.key)
+            if current is None or current.finished:
+                current = _PromptJob(job.key)
+                self._jobs_by_key[job.key] = current
+            if current.callers:
+                current.shared = True
+            current.callers.add(token)
+            if session_id is not None and self._session_jobs.get(session_id) == (job, token):
+                self._session_jobs[session_id] = (current, token)
+            return current
+        
+    def _release(self, job, token, session_id):
+        """Drop a caller's reference to a job once it has its result"""
+        with self._jobs_lock:
+            job.callers.discard(token)
+            if session_id is not None and self._session_jobs.get(session_id, (None, None))[0] is job:
+                del self._session_jobs[session_id]
+            if not job.callers and self._jobs_by_key.get(job.key) is job:
+                del self._jobs_by_key[job.key]
+        
+    def _get_queue(self):
+        """Return (running prompt ids, pending prompt ids) of the ComfyUI queue"""
+        data = self.api.get_queue()
+        running = [item[1] for item in data.get("queue_running", [])]
+        pending = [item[1] for item in data.get("queue_pending", [])]
+        return running, pending
+        
+    def _cancel_prompt(self, job):
+        """Delete a queued prompt or interrupt it if it is already running, and record reclaimed GPU time"""
+        with self._jobs_lock:
+            if job.cancel_sent:
+                return
+            job.cancel_sent = True
+        try:
+            running, pending = self._get_queue()
+            if job.prompt_id in pending:
+                requests.post(f"{self.base_url}/queue", json={"delete": [job.prompt_id]}, timeout=5)
+                reclaimed = self._avg_job_seconds * job.cost
+                print(f"Removed superseded job {job.prompt_id} from the ComfyUI queue")
+            elif job.prompt_id in running:
+                requests.post(f"{self.base_url}/interrupt", json={"prompt_id": job.prompt_id}, timeout=5)
+                elapsed = time.monotonic() - (job.started_at or job.queued_at)
+                reclaimed = max(0.0, self._avg_job_seconds * job.cost - elapsed)
+                print(f"Interrupted superseded job {job.prompt_id}")
+            else:
+                # Already finished
+                return
+            metrics.inc("comfyui_reclaimed_gpu_seconds_total", reclaimed)
+        except Exception as e:
+            print(f"Error cancelling ComfyUI job {job.prompt_id}: {e}")
+        
+    def _wait_for_completion(self, job, record_duration=True):
+        """
+        Wait until a queued prompt finishes
+        
+        Args:
+            job (_PromptJob): Job with a prompt_id
+            record_duration (bool): Update the per-job GPU time estimate with this job
+            
+        Returns:
+            dict: History entry of the prompt, None if cancelled or timed out
+        """
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if job.cancelled.is_set():
+                return None
+            
+            history = self.api.get_history(job.prompt_id)
+            if history and job.prompt_id in history:
+                break
+            
+            if job.started_at is None:
+                running, _ = self._get_queue()
+                if job.prompt_id in running:
+                    job.started_at = time.monotonic()
+            time.sleep(self.poll_interval)
+        else:
+            print(f"Error: ComfyUI job {job.prompt_id} timed out after {self.timeout}s")
+            return None
+        
+        if record_duration:
+            self._record_duration(job)
+        return history[job.prompt_id]
+        
+    def _record_duration(self, job):
+        """Update the running estimate of per-job GPU time (used for reclaimed-time metrics)"""
+        if job.started_at is not None:
+            duration = time.monotonic() - job.started_at
+            self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * duration / job.cost
+        
+    def _wait_for_outputs(self, job, output_node_title, wf):
+        """
+        Wait until a queued prompt finishes and download the images of its output node
+        
+        Returns:
+            dict: {filename: image bytes}, None if cancelled, failed or timed out
+        """
+        entry = self._wait_for_completion(job)
+        if entry is None:
+            return None
+        
+        node_id = wf.get_node_id(output_node_title)
+        images = entry.get("outputs", {}).get(node_id, {}).get("images", [])
+        return {
+            image["filename"]: self.api.get_image(image["filename"], image["subfolder"], image["type"])
+            for image in images
+        }
+        
+    def _open_websocket(self):
+        """
+        Connect to ComfyUI's event stream under a new client id
+        
+        Returns:
+            tuple: (websocket connection, client id)
+        """
+        client_id = uuid.uuid4().hex
+        scheme = "wss" if self.base_url.startswith("https") else "ws"
+        url = f"{scheme}://{self.base_url.split('//', 1)[-1]}/ws?clientId={client_id}"
+        return websocket.create_connection(url, timeout=self.poll_interval), client_id
+        
+    def _receive_images(self, job, ws, output_node_id):
+        """
+        Collect the images a SaveImageWebsocket node sends for a queued prompt
+        
+        Binary frames are an 8-byte header (event type, image format) followed by the
+        encoded image; only frames sent while the output node executes are kept, the
+        others are KSampler previews.
+        
+        Returns:
+            dict: {name: image bytes}, None if cancelled, failed or timed out
+        """
+        deadline = time.monotonic() + self.timeout
+        current_node = None
+        images = []
+        while time.monotonic() < deadline:
+            if job.cancelled.is_set():
+                return None
+            try:
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                continue
+            
+            if isinstance(message, bytes):
+                if current_node == output_node_id:
+                    images.append(message[8:])
+                continue
+            
+            event = json.loads(message)
+            data = event.get("data", {})
+            if data.get("prompt_id") != job.prompt_id:
+                continue
+            if event["type"] == "execution_start":
+                job.started_at = time.monotonic()
+            elif event["type"] == "executing":
+                current_node = data.get("node")
+                if current_node is None:
+                    # Prompt finished
+                    self._record_duration(job)
+                    metrics.inc("comfyui_websocket_image_bytes_total", sum(len(image) for image in images))
+                    return {f"websocket_{i:05d}.png": image for i, image in enumerate(images)}
+            elif event["type"] in ("execution_error", "execution_interrupted"):
+                print(f"ComfyUI job {job.prompt_id} ended with {event['type']}")
+                return None
+        print(f"Error: ComfyUI job {job.prompt_id} timed out after {self.timeout}s")
+        return None
+        
+    def _record_latency(self, job, results):
+        """Log and export generation latency, separating cold-start from warm requests"""
+        if not results:
+            return
+        latency = time.monotonic() - job.queued_at
+        start = "warm" if job.warm_at_submit else "cold"
+        metrics.observe("comfyui_generation_seconds", latency, labels={"start": start})
+        print(f"ComfyUI generation finished in {latency:.1f}s ({start} start)")
+        self._warm = True
+        self._last_activity = time.monotonic()
+        
+    def _superseded(self, job):
+        """Cancel a job that was superseded while being submitted; returns True if it was"""
+        if job.cancelled.is_set():
+            self._cancel_prompt(job)
+            return True
+        return False
+        
+    def _websocket_available(self):
+        """
+        Whether the backend has the SaveImageWebsocket node
+        
+        Asked once through /object_info; only retried while ComfyUI does not answer.
+        """
+        with self._probe_lock:
+            if self._websocket_node is None:
+                try:
+                    response = requests.get(f"{self.base_url}/object_info/SaveImageWebsocket", timeout=5)
+                    response.raise_for_status()
+                    # Unknown nodes answer with an empty object
+                    self._websocket_node = "SaveImageWebsocket" in response.json()
+                except Exception as e:
+                    print(f"Could not check ComfyUI for the SaveImageWebsocket node: {e}")
+                    return False
+                if not self._websocket_node:
+                    print("ComfyUI has no SaveImageWebsocket node, images are read from disk")
+            return self._websocket_node
+        
+    def _queue_websocket(self, job, wf):
+        """
+        Queue a workflow with its save node swapped for SaveImageWebsocket and read the image from the event stream
+        
+        Returns:
+            dict: {name: image bytes}, None if cancelled, failed or timed out
+        """
+        save_node = wf[wf.get_node_id("Save Image")]
+        save_node["class_type"] = "SaveImageWebsocket"
+        save_node["inputs"].pop("filename_prefix", None)
+        
+        # Connect before queueing, so no event of the prompt is missed
+        ws, client_id = self._open_websocket()
+        try:
+            job.prompt_id = self.api.queue_prompt(wf, client_id)["prompt_id"]
+            if self._superseded(job):
+                return None
+            return self._receive_images(job, ws, wf.get_node_id("Save Image"))
+        finally:
+            ws.close()
+        
+    def _generate_image(self, job, prompt, output_dir, seed=None, size=None, steps=None):
+        """Run one generation job on ComfyUI and save the result (see generate_image)"""
         try:
             # Reload workflow to ensure a clean state every time
             wf = ComfyWorkflowWrapper(self.workflow_path)
             
-            # 1. Set random seed
-            random_seed = random.randint(1, 2**48 - 1)
-            wf.set_node_param("KSampler", "seed", random_seed)
+            # 1. Set seed (random unless fixed by the caller)
+            if seed is None:
+                seed = random.randint(1, 2**48 - 1)
+            wf.set_node_param("KSampler", "seed", seed)
+            if size is not None:
+                # GPU time scales with the latent's pixel count
+                job.cost = size * size / (wf.get_node_param("EmptySD3LatentImage", "width")
+                                          * wf.get_node_param("EmptySD3LatentImage", "height"))
+                wf.set_node_param("EmptySD3LatentImage", "width", size)
+                wf.set_node_param("EmptySD3LatentImage", "height", size)
+            if steps is not None:
+                # GPU time also scales with the number of sampling steps
+                job.cost *= steps / wf.get_node_param("KSampler", "steps")
+                wf.set_node_param("KSampler", "steps", steps)
             
             # 2. Build full prompt
             first_part = "A vibrant red Chinese paper"
@@ -116,13 +669,28 @@ class ComfyUIManager:
             
             # 4. Submit task and wait
             # "Save Image" is the Title of the save node in the workflow
-            results = self.api.queue_and_wait_images(wf, "Save Image")
+            if job.cancelled.is_set():
+                return None
+            # Disk output if the backend does not have the websocket node
+            output = "websocket" if self.output_mode == "websocket" and self._websocket_available() else "disk"
+            metrics.inc("comfyui_jobs_started_total", labels={"output": output})
+            job.queued_at = time.monotonic()
+            job.warm_at_submit = self._warm
+            if output == "websocket":
+                results = self._queue_websocket(job, wf)
+            else:
+                job.prompt_id = self.api.queue_prompt(wf)["prompt_id"]
+                results = None if self._superseded(job) else self._wait_for_outputs(job, "Save Image", wf)
+            self._record_latency(job, results)
             
             if results:
                 # Get the first image
                 filename = list(results.keys())[0]
                 image_data = results[filename]
                 
+                if self.store is not None:
+                    return self.store.put(image_data, "image_raw")
+                
                 # Generate output filename
                 timestamp = int(time.time())
                 safe_prompt = "".join(c for c in prompt[:20] if c.isalnum() or c in (' ', '-', '_')).strip().replace(' ', '_')
@@ -134,6 +702,9 @@ class ComfyUIManager:
                     f.write(image_data)
                     
                 return output_path
+            elif job.cancelled.is_set():
+                print(f"ComfyUI job {job.prompt_id} was superseded")
+                return None
             else:
                 print("Error: No images returned from ComfyUI.")
                 return None
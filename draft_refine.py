@@ -0,0 +1,145 @@
+"""
+Draft and Refine - Quick low-step drafts, refined at full quality on demand
+
+The workflow samples 30 steps, so every request pays full quality even when the
+result is rejected at a glance. A draft runs the same workflow with the same
+prompt and a fixed seed at DRAFT_STEPS steps (about a quarter of the GPU time).
+Refining reruns the draft's seed at the workflow's own steps: with the same
+seed, prompt and latent size the initial noise is identical, so the refined
+image keeps the draft's composition and the refine is reproducible.
+
+A smaller draft latent (PAPERCUT_DRAFT_SIZE) is faster still, but a different
+latent size means different noise: the refined image is then a new composition
+from the same seed.
+
+Drafts, refines and the delay between them are exported as metrics
+(drafts_total, drafts_refined_total, draft_acceptance_ratio, draft_refine_delay_seconds).
+"""
+
+import collections
+import os
+import random
+import threading
+import time
+
+from metrics import metrics
+
+DRAFT_STEPS = int(os.environ.get("PAPERCUT_DRAFT_STEPS", "8"))
+DRAFT_SIZE = int(os.environ.get("PAPERCUT_DRAFT_SIZE", "0")) or None  # Draft latent side, the workflow's if 0
+
+_lock = threading.Lock()
+
+
+def new_seed() -> int:
+    """Random KSampler seed (same range as ComfyUIManager)"""
+    return random.randint(1, 2**48 - 1)
+
+
+class Draft:
+    """
+    Everything needed to rerun a draft at full quality
+
+    Args:
+        prompt: User prompt
+        seed: (Optional) KSampler seed, a new random seed if None
+        steps: KSampler steps of the draft
+        size: (Optional) Latent side of the draft, the workflow's size if None
+    """
+
+    def __init__(self, prompt, seed=None, steps=DRAFT_STEPS, size=DRAFT_SIZE):
+        self.prompt = prompt
+        self.seed = seed if seed is not None else new_seed()
+        self.steps = steps
+        self.size = size
+        self.created = time.monotonic()
+        self.refined = False
+
+    def generate_kwargs(self) -> dict:
+        """generate_image keyword arguments of the draft"""
+        return {"seed": self.seed, "steps": self.steps, "size": self.size}
+
+    def refine_kwargs(self) -> dict:
+        """generate_image keyword arguments of the full-quality rerun (the workflow's own steps and size)"""
+        return {"seed": self.seed}
+
+    def __repr__(self):
+        return f"Draft(prompt={self.prompt!r}, seed={self.seed}, steps={self.steps}, size={self.size})"
+
+
+class DraftLedger:
+    """
+    Drafts issued to clients that only send back the seed (the HTTP API), least recently issued dropped first
+
+    Args:
+        max_drafts: Drafts kept across all clients
+    """
+
+    def __init__(self, max_drafts=1024):
+        self.max_drafts = max_drafts
+        self._lock = threading.Lock()
+        self._drafts = collections.OrderedDict()  # (client, seed) -> Draft
+
+    def issue(self, client, draft):
+        """Remember a draft generated for a client"""
+        with self._lock:
+            self._drafts[(client, draft.seed)] = draft
+            self._drafts.move_to_end((client, draft.seed))
+            while len(self._drafts) > self.max_drafts:
+                self._drafts.popitem(last=False)
+
+    def get(self, client, seed):
+        """The client's draft with this seed, None if it was never issued or has been dropped"""
+        with self._lock:
+            return self._drafts.get((client, seed))
+
+
+def _update_acceptance():
+    drafts = metrics.get("drafts_total")
+    if drafts:
+        metrics.set_gauge("draft_acceptance_ratio", metrics.get("drafts_refined_total") / drafts)
+
+
+def submit_draft(scheduler, session_id, draft, output_dir, /, **kwargs):
+    """
+    Queue a draft generation
+
+    Args:
+        scheduler: GenerationScheduler
+        session_id: Identifier of the submitting session
+        draft: Draft to generate
+        output_dir: Output directory
+        **kwargs: Passed through to scheduler.submit (e.g. supersede=True)
+
+    Returns:
+        Future: Resolves to the draft image path
+    """
+    future = scheduler.submit(session_id, draft.prompt, output_dir, **draft.generate_kwargs(), **kwargs)
+    with _lock:
+        metrics.inc("drafts_total")
+        _update_acceptance()
+    return future
+
+
+def submit_refine(scheduler, session_id, draft, output_dir, /, **kwargs):
+    """
+    Queue the full-quality rerun of a draft (counts the draft as accepted)
+
+    Args:
+        scheduler: GenerationScheduler
+        session_id: Identifier of the submitting session
+        draft: Draft to refine
+        output_dir: Output directory
+        **kwargs: Passed through to scheduler.submit
+
+    Returns:
+        Future: Resolves to the refined image path
+    """
+    future = scheduler.submit(session_id, draft.prompt, output_dir, **draft.refine_kwargs(), **kwargs)
+    with _lock:
+        if not draft.refined:
+            # A retried refine of the same draft is one acceptance
+            draft.refined = True
+            metrics.inc("drafts_refined_total")
+            metrics.observe("draft_refine_delay_seconds", time.monotonic() - draft.created)
+            _update_acceptance()
+    return future
@@ -0,0 +1,336 @@
+"""
+Image Output - Encode results once into the byte formats they are displayed and downloaded in
+"""
+
+import copy
+import io
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PIL import Image, PngImagePlugin
+
+# Encoding runs off the request thread; Pillow releases the GIL while compressing
+_encoder_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-encoder")
+
+# Pseudo-format for single-color papercuts: palette PNG with an alpha palette (see encode_papercut)
+PAPERCUT_PNG = "PAPERCUT_PNG"
+
+# zlib level for papercut PNGs: palette data compresses well at low levels, 9 costs ~30x more time for ~10% size
+PAPERCUT_COMPRESS_LEVEL = 3
+
+_MIME_TYPES = {"PNG": "image/png", PAPERCUT_PNG: "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+_EXTENSIONS = {"PNG": ".png", PAPERCUT_PNG: ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+# Encodings per purpose: (format, max side in pixels or None, save options)
+PAPERCUT_ENCODINGS = {
+    "preview": (PAPERCUT_PNG, None, {}),
+    "download": (PAPERCUT_PNG, None, {}),
+}
+
+# Scene composites are photographs: PNG is the slowest and largest format for them
+# (4032x2688 package: PNG ~17 MB / 4.7 s, JPEG q95 ~5 MB / 0.07 s, see benchmark.py scene_formats).
+# Policy per scene and purpose, "default" applies to scenes that are not listed.
+SCENE_OUTPUT_POLICY = {
+    "default": {
+        # Previews are shown in half-width columns, full resolution is never visible
+        "preview": ("JPEG", 1600, {"quality": 85}),
+        "download": ("JPEG", None, {"quality": 95, "subsampling": 0}),
+        "archive": ("WEBP", None, {"quality": 85, "method": 2}),
+    },
+    "door": {
+        # Small square scene (799x799): the preview is already near full size
+        "preview": ("JPEG", None, {"quality": 90}),
+    },
+    "wall": {
+        "preview": ("JPEG", None, {"quality": 90}),
+    },
+}
+
+
+def load_output_policy(path=None) -> dict:
+    """
+    Scene output policy, optionally overridden by a JSON file
+
+    The file has the same shape as SCENE_OUTPUT_POLICY, with specs written as
+    [format, max_side, {options}]; entries are merged over the defaults.
+
+    Args:
+        path: (Optional) JSON policy file, defaults to $PAPERCUT_OUTPUT_POLICY if set
+    """
+    policy = copy.deepcopy(SCENE_OUTPUT_POLICY)
+    path = path or os.environ.get("PAPERCUT_OUTPUT_POLICY")
+    if not path:
+        return policy
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+        for scene, purposes in overrides.items():
+            for purpose, (format, max_side, options) in purposes.items():
+                policy.setdefault(scene, {})[purpose] = (format.upper(), max_side, options)
+    except (OSError, ValueError) as e:
+        print(f"Error loading output policy {path}: {e}")
+    return policy
+
+
+def scene_encodings(scene, purposes=("preview",), policy=None) -> dict:
+    """
+    Encodings for a scene composite, for use with EncodedImage
+
+    Args:
+        scene: Scene name, e.g. "window", "package", "door", "wall"
+        purposes: Subset of "preview", "download", "archive"
+        policy: (Optional) Policy dict, SCENE_OUTPUT_POLICY if None
+
+    Returns:
+        dict: {purpose: (format, max_side, options)}
+    """
+    policy = policy or SCENE_OUTPUT_POLICY
+    scene_policy = policy.get(scene, {})
+    return {purpose: scene_policy.get(purpose, policy["default"][purpose]) for purpose in purposes}
+
+
+def extension_for(format) -> str:
+    """File extension (with dot) for an encoding format"""
+    return _EXTENSIONS.get(format, f".{format.lower()}")
+
+
+def papercut_color(image: Image.Image):
+    """
+    Color of a single-color papercut (the output of convert_to_red)
+
+    Returns:
+        tuple: (R, G, B), None if the image is not one color over a transparent background
+    """
+    if image.mode != 'RGBA':
+        return None
+    # Per-channel histograms of the visible and the fully transparent pixels (computed in C)
+    visible = image.getchannel('A').point(lambda v: 255 if v > 0 else 0)
+    hidden = visible.point(lambda v: 255 - v)
+    visible_hist = image.histogram(mask=visible)
+    hidden_hist = image.histogram(mask=hidden)
+
+    color = []
+    for channel in range(3):
+        bins = visible_hist[channel * 256:(channel + 1) * 256]
+        used = [value for value, count in enumerate(bins) if count]
+        # convert_to_red writes the color where alpha > 0 and black elsewhere
+        if len(used) > 1 or any(hidden_hist[channel * 256 + 1:(channel + 1) * 256]):
+            return None
+        color.append(used[0] if used else 0)
+    return tuple(color)
+
+
+def papercut_to_palette(image: Image.Image, color: tuple) -> Image.Image:
+    """
+    Convert a single-color papercut to a 'P' image whose index is the alpha value
+
+    Palette entry i is the papercut color with alpha i (entry 0 is transparent black),
+    so the image converts back to exactly the same RGBA pixels.
+    """
+    alpha = image.getchannel('A')
+    palette_img = Image.frombytes('P', image.size, alpha.tobytes())
+    palette_img.putpalette([0, 0, 0] + list(color) * 255)
+    palette_img.info['transparency'] = bytes(range(256))
+    return palette_img
+
+
+def papercut_to_la(image: Image.Image, color: tuple):
+    """
+    Convert a single-color papercut to an 'LA' image plus PNG metadata holding the color
+
+    Returns:
+        tuple: (LA image, PngInfo carrying the papercut color)
+    """
+    alpha = image.getchannel('A')
+    luma = int(round(0.299 * color[0] + 0.587 * color[1] + 0.114 * color[2]))
+    # Constant gray plane: all information is in the alpha channel, so L costs almost nothing to compress
+    lum = Image.new('L', image.size, luma)
+    la_img = Image.merge('LA', (lum, alpha))
+    info = PngImagePlugin.PngInfo()
+    info.add_text("papercut_color", "#%02x%02x%02x" % color)
+    return la_img, info
+
+
+def encode_papercut(image: Image.Image, mode: str = "P", compress_level: int = PAPERCUT_COMPRESS_LEVEL) -> bytes:
+    """
+    Encode a processed papercut as a compact PNG
+
+    Args:
+        image: RGBA papercut (output of convert_to_red)
+        mode: "P" (palette with alpha palette), "LA" (gray + alpha, color in metadata) or "RGBA"
+        compress_level: zlib compression level 0-9
+
+    Returns:
+        bytes: PNG data; falls back to RGBA if the image is not a single-color papercut
+    """
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    color = papercut_color(image) if mode in ("P", "LA") else None
+
+    buf = io.BytesIO()
+    if color is not None and mode == "P":
+        papercut_to_palette(image, color).save(buf, format="PNG", compress_level=compress_level)
+    elif color is not None and mode == "LA":
+        la_img, info = papercut_to_la(image, color)
+        la_img.save(buf, format="PNG", compress_level=compress_level, pnginfo=info)
+    else:
+        image.save(buf, format="PNG", compress_level=compress_level)
+    return buf.getvalue()
+
+
+def load_papercut(source) -> Image.Image:
+    """
+    Load a papercut written by encode_papercut (any mode) back to RGBA
+
+    Args:
+        source: File path, file object or PNG bytes
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    color = image.info.get("papercut_color")
+    if image.mode == 'LA' and color:
+        rgb = tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+        alpha = image.getchannel('A')
+        rgba = Image.new('RGBA', image.size, rgb + (0,))
+        rgba.putalpha(alpha)
+        # Fully transparent pixels are black in convert_to_red output
+        black = Image.new('RGBA', image.size, (0, 0, 0, 0))
+        return Image.composite(rgba, black, alpha.point(lambda v: 255 if v > 0 else 0))
+    return image.convert('RGBA')
+
+
+def encode_image(image: Image.Image, format: str = "PNG", max_side: int = None, **options) -> bytes:
+    """
+    Encode a PIL image to bytes
+
+    Args:
+        image: Image to encode
+        format: Pillow format name, e.g. "PNG", "JPEG", "WEBP", or PAPERCUT_PNG
+        max_side: (Optional) Downscale so that the longer side is at most this many pixels
+        **options: Passed to Image.save (quality, compress_level, ...)
+
+    Returns:
+        bytes: Encoded image
+    """
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    if format == PAPERCUT_PNG:
+        return encode_papercut(image, **options)
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buf = io.BytesIO()
+    image.save(buf, format=format, **options)
+    return buf.getvalue()
+
+
+def _encode_all(image, encodings):
+    """Encode each distinct spec once; purposes with the same spec share one buffer"""
+    encoded = {}
+    by_spec = {}
+    for purpose, (format, max_side, options) in encodings.items():
+        spec = (format, max_side, tuple(sorted(options.items())))
+        if spec not in by_spec:
+            by_spec[spec] = encode_image(image, format, max_side, **options)
+        encoded[purpose] = by_spec[spec]
+    return encoded
+
+
+def _encode_into_cache(image, encodings, cache, session_id):
+    """Encode, then hand the buffers to a SessionArtifactCache and keep only the handles"""
+    handles = {}
+    by_buffer = {}
+    for purpose, data in _encode_all(image, encodings).items():
+        if id(data) not in by_buffer:
+            by_buffer[id(data)] = cache.put(session_id, data)
+        handles[purpose] = by_buffer[id(data)]
+    return handles
+
+
+class EncodedImage:
+    """
+    Immutable encoded byte buffers of one image
+
+    Encoding starts in a background thread as soon as the object is created; the
+    PIL image is not kept afterwards, so reruns only hand out the cached bytes.
+    With a SessionArtifactCache the buffers live in the cache under its memory
+    budget and this object only holds handles.
+
+    Args:
+        image: PIL image to encode
+        encodings: {purpose: (format, max_side, options)}, e.g. PAPERCUT_ENCODINGS
+        cache: (Optional) SessionArtifactCache holding the buffers
+        session_id: Session owning the buffers (required with cache)
+    """
+
+    def __init__(self, image: Image.Image, encodings: dict, cache=None, session_id=None):
+        self.size = image.size
+        self._formats = {purpose: spec[0] for purpose, spec in encodings.items()}
+        self._cache = cache
+        if cache is None:
+            self._future = _encoder_pool.submit(_encode_all, image, encodings)
+        else:
+            self._future = _encoder_pool.submit(_encode_into_cache, image, encodings, cache, session_id)
+
+    @classmethod
+    def from_encoded(cls, encoded: dict, size=None, cache=None, session_id=None) -> "EncodedImage":
+        """
+        Wrap buffers that are already encoded (e.g. read back from a RenderCache)
+
+        Args:
+            encoded: {purpose: (format, bytes)}
+            size: (Optional) Pixel size of the image
+            cache: (Optional) SessionArtifactCache holding the buffers
+            session_id: Session owning the buffers (required with cache)
+        """
+        self = cls.__new__(cls)
+        self.size = size
+        self._formats = {purpose: format for purpose, (format, _) in encoded.items()}
+        self._cache = cache
+        values = {purpose: data for purpose, (_, data) in encoded.items()}
+        if cache is not None:
+            values = {purpose: cache.put(session_id, data) for purpose, data in values.items()}
+        self._future = Future()
+        self._future.set_result(values)
+        return self
+
+    def add_done_callback(self, fn):
+        """Call fn(self) once the background encode has finished (immediately if it already has)"""
+        self._future.add_done_callback(lambda _: fn(self))
+
+    def get(self, purpose):
+        """
+        Encoded bytes for a purpose (waits for the background encode on first access)
+
+        Returns:
+            bytes: Encoded image, None if the cache has dropped it
+        """
+        value = self._future.result()[purpose]
+        if self._cache is None:
+            return value
+        return self._cache.get(value)
+
+    def mime(self, purpose) -> str:
+        return _MIME_TYPES.get(self._formats[purpose], "application/octet-stream")
+
+
+def archive_async(store, image: Image.Image, kind, spec):
+    """
+    Encode an image with spec and put it into an ArtifactStore, off the request thread
+
+    Args:
+        store: ArtifactStore
+        image: Image to archive
+        kind: Artifact kind, e.g. "image_rendered"
+        spec: (format, max_side, options), e.g. scene_encodings(scene, ("archive",))["archive"]
+
+    Returns:
+        Future: Resolves to the stored path
+    """
+    format, max_side, options = spec
+    return _encoder_pool.submit(
+        lambda: store.put(encode_image(image, format, max_side, **options), kind, extension_for(format))
+    )
@@ -4,6 +4,7 @@ import time
 import sys
 import base64
 import io
+import uuid
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
@@ -12,7 +13,19 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 try:
     from comfy_api import ComfyUIManager
-    from Image_Processing import desaturate_image, increase_contrast, remove_white_background, convert_to_red, render_on_window, render_on_wall, render_on_door, render_on_package
+    from scheduler import GenerationScheduler, RateLimitExceeded
+    from pregen_pool import PregenPool, UsageHistory, default_subjects
+    from artifact_store import ArtifactStore
+    from image_output import EncodedImage, PAPERCUT_ENCODINGS, encode_papercut, load_output_policy, scene_encodings, archive_async, extension_for
+    from render_cache import RenderCache, file_digest
+    from session_store import SessionArtifactCache
+    from Image_Processing import SCENE_COLOR, process_image_to_mask, render_scene
+    from papercut_mask import PapercutMask
+    from processing_dag import DEFAULT_PARAMS, PapercutTuner
+    from worker_pool import PostprocessPool
+    from pipeline import ScenePreparation
+    from draft_refine import DRAFT_STEPS, Draft, submit_draft, submit_refine
+    from metrics import metrics
 except ImportError:
     pass # Will handle gracefully later
 
@@ -22,12 +35,58 @@ WORKFLOW_PATH = os.path.join(BASE_DIR, "comfyui_workflow", "paper_cut.json")
 OUTPUT_DIR = os.path.join(BASE_DIR, "image_raw")
 PROCESSED_DIR = os.path.join(BASE_DIR, "image_processed")
 RENDERED_DIR = os.path.join(BASE_DIR, "image_rendered")
+PREGEN_DIR = os.path.join(BASE_DIR, "image_pregen")
+DATA_DIR = os.path.join(BASE_DIR, "data")  # Runtime state: artifact index, usage history
+USAGE_HISTORY_PATH = os.path.join(DATA_DIR, "usage_history.json")
+
+# Scene plates (ui_assets/prototype_images), scenes whose plate is missing are skipped
+SCENE_PLATES = {
+    "window": os.path.join(BASE_DIR, "ui_assets", "prototype_images", "Base_Window.jpg"),
+    "package": os.path.join(BASE_DIR, "ui_assets", "prototype_images", "Base_package.jpg"),
+    "door": os.path.join(BASE_DIR, "ui_assets", "prototype_images", "Base_door.jpg"),
+    "wall": os.path.join(BASE_DIR, "ui_assets", "prototype_images", "Base_wall.jpeg"),
+}
+
+# --- Artifact Store Settings ---
+ARTIFACT_MAX_BYTES = int(float(os.environ.get("PAPERCUT_ARTIFACT_MAX_MB", "2048")) * 1024 * 1024)
+ARTIFACT_MAX_AGE_SECONDS = float(os.environ.get("PAPERCUT_ARTIFACT_MAX_AGE_DAYS", "7")) * 24 * 3600
+
+# --- Session Memory Settings ---
+SESSION_IMAGE_BUDGET = int(float(os.environ.get("PAPERCUT_SESSION_IMAGE_MB", "16")) * 1024 * 1024)
+GLOBAL_IMAGE_BUDGET = int(float(os.environ.get("PAPERCUT_GLOBAL_IMAGE_MB", "256")) * 1024 * 1024)
+
+# --- GPU Scheduling Settings ---
+MAX_INFLIGHT_JOBS = int(os.environ.get("PAPERCUT_MAX_INFLIGHT_JOBS", "1"))  # Jobs kept inside ComfyUI's queue
+SESSION_RATE_PER_MINUTE = float(os.environ.get("PAPERCUT_SESSION_RATE_PER_MINUTE", "6"))
+SESSION_MAX_QUEUED = int(os.environ.get("PAPERCUT_SESSION_MAX_QUEUED", "3"))
+
+# --- Backend Warm-up Settings ---
+WARMUP_ON_START = os.environ.get("PAPERCUT_WARMUP", "1") == "1"  # Load Flux/T5/LoRA before the first request
+KEEPALIVE_SECONDS = float(os.environ.get("PAPERCUT_KEEPALIVE_SECONDS", "0")) or None  # Idle keep-alive, off if 0
+COMFYUI_OUTPUT_MODE = os.environ.get("PAPERCUT_COMFYUI_OUTPUT", "disk")  # "websocket": image over the event stream
+
+# --- Draft Mode Settings ---
+DRAFT_MODE_DEFAULT = os.environ.get("PAPERCUT_DRAFT_MODE", "0") == "1"  # "Quick draft" checked by default
+
+# --- Pre-generation Pool Settings ---
+PREGEN_TOP_N = int(os.environ.get("PAPERCUT_PREGEN_TOP_N", "5"))  # Subjects kept ready, 0 disables the pool
+PREGEN_PER_SUBJECT = int(os.environ.get("PAPERCUT_PREGEN_PER_SUBJECT", "1"))
+
+# --- Debug Settings ---
+SHOW_METRICS = os.environ.get("PAPERCUT_SHOW_METRICS", "0") == "1"  # Metrics expander (Prometheus text) under the results
+
+# --- Post-processing Worker Settings ---
+POSTPROCESS_WORKERS = int(os.environ.get("PAPERCUT_POSTPROCESS_WORKERS", "0"))  # Worker processes, 0 runs in the UI process
 
 # Ensure output directories exist
-for d in [OUTPUT_DIR, PROCESSED_DIR, RENDERED_DIR]:
+for d in [OUTPUT_DIR, PROCESSED_DIR, RENDERED_DIR, DATA_DIR]:
     if not os.path.exists(d):
         os.makedirs(d)
 
+# The usage history used to be kept in the project root
+if os.path.exists(os.path.join(BASE_DIR, "usage_history.json")) and not os.path.exists(USAGE_HISTORY_PATH):
+    os.replace(os.path.join(BASE_DIR, "usage_history.json"), USAGE_HISTORY_PATH)
+
 # Page Configuration
 st.set_page_config(
     page_title="Papercraft Maestro",
@@ -38,6 +97,197 @@ st.set_page_config(
 
 # --- Helper Functions ---
 
+@st.cache_resource
+def get_artifact_store():
+    """Shared content-addressed store for image_raw, image_processed and image_rendered"""
+    return ArtifactStore(BASE_DIR, max_bytes=ARTIFACT_MAX_BYTES, max_age_seconds=ARTIFACT_MAX_AGE_SECONDS,
+                         index_dir=DATA_DIR)
+
+@st.cache_resource
+def get_render_cache():
+    """Persistent memo of processing and scene renders, shared with other processes through the store's index"""
+    return RenderCache(get_artifact_store())
+
+@st.cache_resource
+def get_output_policy():
+    """Scene output formats per purpose (preview, download, archive), overridable via $PAPERCUT_OUTPUT_POLICY"""
+    return load_output_policy()
+
+@st.cache_resource
+def get_session_cache():
+    """Shared byte budget for the encoded images that sessions display (LRU spill-to-disk)"""
+    return SessionArtifactCache(
+        per_session_bytes=SESSION_IMAGE_BUDGET,
+        global_bytes=GLOBAL_IMAGE_BUDGET,
+        max_spill_bytes=ARTIFACT_MAX_BYTES,
+    )
+
+@st.cache_resource
+def get_comfyui_manager():
+    """Shared ComfyUIManager for all sessions, so identical in-flight requests can be coalesced"""
+    return ComfyUIManager(WORKFLOW_PATH, warmup=WARMUP_ON_START, keepalive_interval=KEEPALIVE_SECONDS,
+                          store=get_artifact_store(), output_mode=COMFYUI_OUTPUT_MODE)
+
+@st.cache_resource
+def get_generation_scheduler():
+    """Shared fair scheduler so one heavy session cannot starve the others on a single GPU"""
+    return GenerationScheduler(
+        get_comfyui_manager(),
+        max_inflight=MAX_INFLIGHT_JOBS,
+        rate_per_minute=SESSION_RATE_PER_MINUTE,
+        max_queued_per_session=SESSION_MAX_QUEUED,
+    )
+
+@st.cache_resource
+def get_pregen_pool():
+    """Shared pool of pre-generated papercuts for popular subjects (None if disabled)"""
+    if PREGEN_TOP_N <= 0:
+        return None
+    history = UsageHistory(USAGE_HISTORY_PATH, seed_subjects=default_subjects(BASE_DIR))
+    return PregenPool(
+        get_comfyui_manager(),
+        get_generation_scheduler(),
+        lambda raw_path: (raw_path, postprocess_raw_image(raw_path)[1]),
+        PREGEN_DIR,
+        history,
+        top_n=PREGEN_TOP_N,
+        per_subject=PREGEN_PER_SUBJECT,
+    )
+
+@st.cache_resource
+def get_postprocess_pool():
+    """Shared worker processes for papercut processing and scene renders (None if disabled)"""
+    if POSTPROCESS_WORKERS <= 0:
+        return None
+    return PostprocessPool(workers=POSTPROCESS_WORKERS)
+
+def process_cache_key(raw_image_path, params):
+    """Render cache key of a processed papercut: raw image content plus the processing parameters"""
+    params = {name: params[name] for name in ("contrast", "threshold", "color")}
+    return RenderCache.key("process", file_digest(raw_image_path), params=params)
+
+def postprocess_raw_image(raw_image_path, contrast=None, threshold=None, color=None):
+    """
+    Run the papercut processing chain on a raw generation and save the result
+    
+    A raw image processed before with the same parameters is read back from the render cache.
+    
+    Returns:
+        tuple: (PapercutMask, processed image path)
+    """
+    params = PapercutTuner.params(contrast=contrast, threshold=threshold, color=color)
+    cache = get_render_cache()
+    key = process_cache_key(raw_image_path, params)
+    processed_path = cache.lookup("process", key)
+    if processed_path is not None:
+        return PapercutMask.from_image(Image.open(processed_path)), processed_path
+    
+    # Processing steps (desaturate, contrast, remove background) down to a single alpha mask
+    pool = get_postprocess_pool()
+    if pool:
+        mask = pool.process(raw_image_path, params["contrast"], params["threshold"], params["color"]).result().mask
+    else:
+        mask = process_image_to_mask(Image.open(raw_image_path), contrast=params["contrast"],
+                                     threshold=params["threshold"], color=params["color"])
+    
+    # Save processed image
+    # Palette PNG: a papercut is one color with varying alpha, so this is lossless and several times cheaper than RGBA
+    processed_path = cache.put("process", key, encode_papercut(mask.render(), mode="P"), "image_processed")
+    return mask, processed_path
+
+def available_scene_plates():
+    """Scene plates that exist on disk, {scene name: path}"""
+    return {scene: path for scene, path in SCENE_PLATES.items() if os.path.exists(path)}
+
+def publish_papercut(mask):
+    """Encode the papercut once in the background; the session keeps only the byte buffers"""
+    st.session_state.processed_image = EncodedImage(
+        mask.render(), PAPERCUT_ENCODINGS, cache=get_session_cache(), session_id=st.session_state.session_id)
+
+def publish_scenes(mask, processed_path, scene_images=None, scene_color=SCENE_COLOR, canvases=None):
+    """
+    Publish the scene previews of a papercut into the session
+    
+    Previews rendered before for the same papercut, plate and output policy come from the
+    render cache; everything else is rendered (unless given in scene_images), archived and
+    encoded in the background with the formats from the output policy.
+    
+    Args:
+        mask: PapercutMask to render
+        processed_path: Stored papercut (its content hash keys the cache)
+        scene_images: (Optional) {scene name: already rendered RGB image}
+        scene_color: Papercut color in the scenes
+        canvases: (Optional) {scene name: prepared plate copy} to draw into (see ScenePreparation)
+    """
+    policy = get_output_policy()
+    cache = get_render_cache()
+    papercut_digest = file_digest(processed_path)
+    scene_images = dict(scene_images or {})
+    previews = {}
+    keys = {}
+    missing = {}
+    for scene, plate in available_scene_plates().items():
+        spec = scene_encodings(scene, ("preview",), policy)["preview"]
+        keys[scene] = RenderCache.key("scene", papercut_digest, file_digest(plate),
+                                      params={"scene": scene, "color": scene_color, "preview": spec})
+        if scene in scene_images:
+            continue
+        cached_path = cache.lookup("scene", keys[scene])
+        if cached_path is not None:
+            with open(cached_path, "rb") as f:
+                previews[scene] = EncodedImage.from_encoded(
+                    {"preview": (spec[0], f.read())}, cache=get_session_cache(), session_id=st.session_state.session_id)
+        else:
+            missing[scene] = plate
+    
+    if missing:
+        pool = get_postprocess_pool()
+        if pool:
+            # Worker processes load the stored papercut themselves, no pixels are pickled
+            scene_images.update(pool.render(processed_path, missing, scene_color).result().scenes)
+        else:
+            # All scenes resize the same mask, so they share its mipmap pyramid
+            canvases = canvases or {}
+            scene_images.update({scene: render_scene(scene, mask, canvases.get(scene, plate), color=scene_color,
+                                                     in_place=scene in canvases)
+                                 for scene, plate in missing.items()})
+    
+    for scene, rendered in scene_images.items():
+        if scene not in keys:
+            continue
+        spec = scene_encodings(scene, ("preview",), policy)["preview"]
+        if rendered is not None:
+            archive_async(get_artifact_store(), rendered, "image_rendered",
+                          scene_encodings(scene, ("archive",), policy)["archive"])
+            rendered = EncodedImage(rendered, {"preview": spec},
+                                    cache=get_session_cache(), session_id=st.session_state.session_id)
+            # Remember the preview bytes once they are encoded
+            rendered.add_done_callback(
+                lambda encoded, key=keys[scene], format=spec[0]: cache.put(
+                    "scene", key, encoded.get("preview"), "image_rendered", extension_for(format)))
+        previews[scene] = rendered
+    # Keep the scene order of SCENE_PLATES
+    st.session_state.scene_previews = {scene: previews[scene] for scene in keys if scene in previews}
+
+def get_tuner(raw_image_path):
+    """This session's PapercutTuner for the current raw image (proxy intermediates stay cached across reruns)"""
+    tuner = st.session_state.get('tuner')
+    if tuner is None or tuner.image_path != raw_image_path:
+        tuner = PapercutTuner(raw_image_path, available_scene_plates())
+        st.session_state.tuner = tuner
+    return tuner
+
+def show_scene_preview(scene, label):
+    """One scene preview of the current result (its buffer may have been released by the session budget)"""
+    preview = st.session_state.scene_previews.get(scene)
+    data = preview.get("preview") if preview else None
+    if data is not None:
+        st.image(data, caption=f"{label} Effect", use_container_width=True)
+    elif preview:
+        st.info(f"{label} preview has been released from memory, please generate again.")
+    else:
+        st.info(f"{label} preview failed")
+
 def img_to_base64(img):
     buff = io.BytesIO()
     img.save(buff, format="PNG")
@@ -285,6 +535,23 @@ def main():
         st.session_state.processed_image = None
     if 'scene_previews' not in st.session_state:
         st.session_state.scene_previews = {}
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'tuner' not in st.session_state:
+        st.session_state.tuner = None
+    if 'draft' not in st.session_state:
+        st.session_state.draft = None  # Draft behind the current result, until it is refined
+    
+    # Start the shared backend with the app, so the warm-up and pre-generation run before the first click
+    # (once per session: if ComfyUI is down, reruns do not scan the ports again)
+    if 'backend_started' not in st.session_state:
+        st.session_state.backend_started = True
+        try:
+            get_comfyui_manager()
+            get_generation_scheduler()
+            get_pregen_pool()  # Fills the pool while the GPU is idle
+        except Exception as e:
+            print(f"Connection error: {e}")
     
     # Title Section
     st.markdown("""
@@ -303,18 +570,28 @@ def main():
         # Dynamic button label
         btn_label = "Regen" if st.session_state.processed_image else "Generate"
         generate_btn = st.button(btn_label)
+        draft_mode = st.checkbox("Quick draft", value=DRAFT_MODE_DEFAULT,
+                                 help=f"Generate a {DRAFT_STEPS}-step draft in a few seconds, refine it if you like it")
+        # Rerun the shown draft's seed at full quality
+        refine_btn = st.button("Refine") if st.session_state.draft is not None else False
 
     # Create a placeholder for results to allow explicit clearing
     results_placeholder = st.empty()
 
-    if generate_btn:
+    if generate_btn or refine_btn:
+        refine_draft = st.session_state.draft if refine_btn else None
+        if refine_draft is not None:
+            prompt = refine_draft.prompt
         if not prompt:
             st.warning("Please enter a description first!")
         else:
-            # Clear previous results immediately
+            # Clear previous results immediately (and release their buffers)
+            get_session_cache().drop_session(st.session_state.session_id)
             st.session_state.processed_image = None
             st.session_state.generated_image = None
             st.session_state.scene_previews = {}
+            st.session_state.tuner = None
+            st.session_state.draft = None
             results_placeholder.empty() # Explicitly clear the UI
             
             status_container = st.empty()
@@ -326,8 +603,8 @@ def main():
                 progress_bar.progress(10)
                 
                 try:
-                    # Use ComfyUIManager from root
-                    manager = ComfyUIManager(WORKFLOW_PATH)
+                    # Use the shared ComfyUIManager from root behind the fair scheduler
+                    scheduler = get_generation_scheduler()
                     connection_ok = True
                 except Exception as e:
                     print(f"Connection error: {e}")
@@ -337,63 +614,64 @@ def main():
                     status_container.error("Cannot connect to ComfyUI. Please ensure the service is running (127.0.0.1:8188)")
                 else:
                     # Generate (Using default parameters)
-                    status_container.info("Generating papercut pattern (this may take a few seconds)...")
+                    if refine_draft is not None:
+                        status_container.info("Refining the draft at full quality...")
+                    else:
+                        status_container.info("Generating papercut pattern (this may take a few seconds)...")
                     progress_bar.progress(30)
                     
-                    # Generate image using manager
-                    raw_image_path = manager.generate_image(prompt, OUTPUT_DIR)
+                    # Popular subjects may already be waiting in the pre-generation pool (at full quality)
+                    pool = get_pregen_pool() if refine_draft is None else None
+                    pooled = pool.take(prompt) if pool else None
+                    if pooled and not all(os.path.exists(p) for p in pooled):
+                        pooled = None  # Evicted from the artifact store in the meantime
+                    
+                    rate_limited = False
+                    draft = None
+                    # Decode scene plates and load encoders while the GPU works
+                    preparation = ScenePreparation(available_scene_plates()).start()
+                    if pooled:
+                        raw_image_path, processed_path = pooled
+                    else:
+                        # Generate image through the scheduler (waits for this session's turn on the GPU)
+                        try:
+                            # A new click supersedes this session's previous generation (queued or running)
+                            session_id = st.session_state.session_id
+                            if refine_draft is not None:
+                                future = submit_refine(scheduler, session_id, refine_draft, OUTPUT_DIR,
+                                                       session_id=session_id, supersede=True)
+                            elif draft_mode:
+                                draft = Draft(prompt)
+                                future = submit_draft(scheduler, session_id, draft, OUTPUT_DIR,
+                                                      session_id=session_id, supersede=True)
+                            else:
+                                future = scheduler.submit(session_id, prompt, OUTPUT_DIR, session_id=session_id, supersede=True)
+                            raw_image_path = future.result()
+                        except RateLimitExceeded:
+                            rate_limited = True
+                            raw_image_path = None
                     
                     if raw_image_path:
                         progress_bar.progress(70)
                         status_container.info("Processing papercut (removing background, coloring)...")
                         
-                        # Process
-                        img = Image.open(raw_image_path)
-                        st.session_state.generated_image = img
-                        
-                        # Processing steps
-                        img = desaturate_image(img)
-                        img = increase_contrast(img, factor=3.0)
-                        img = remove_white_background(img, threshold=230)
-                        img = convert_to_red(img)
+                        # Process (pooled results are already processed)
+                        # Keep only a compact handle (the store path) to the raw image
+                        st.session_state.generated_image = raw_image_path
+                        st.session_state.draft = draft
+                        if pooled:
+                            mask = PapercutMask.from_image(Image.open(processed_path))
+                        else:
+                            mask, processed_path = postprocess_raw_image(raw_image_path)
                         
-                        st.session_state.processed_image = img
-                        
-                        # Save processed image
-                        timestamp = int(time.time())
-                        processed_filename = f"processed_{timestamp}.png"
-                        processed_path = os.path.join(PROCESSED_DIR, processed_filename)
-                        img.save(processed_path)
+                        # Encode once in the background; the session keeps only the byte buffers
+                        publish_papercut(mask)
                         
                         # Generate Scene Previews
                         status_container.info("Generating scene previews...")
                         
-                        # Use ui_assets/prototype_images for scene backgrounds
-                        ui_assets_dir = os.path.join(BASE_DIR, 'ui_assets', 'prototype_images')
-                        
-                        # Window (Base_Window.jpg)
-                        window_bg = os.path.join(ui_assets_dir, 'Base_Window.jpg')
-                        if os.path.exists(window_bg):
-                            output_path = os.path.join(RENDERED_DIR, f"window_{timestamp}.png")
-                            st.session_state.scene_previews['window'] = render_on_window(img, window_bg, output_path)
-                        
-                        # Package (Base_package.jpg)
-                        package_bg = os.path.join(ui_assets_dir, 'Base_package.jpg')
-                        if os.path.exists(package_bg):
-                            output_path = os.path.join(RENDERED_DIR, f"package_{timestamp}.png")
-                            st.session_state.scene_previews['package'] = render_on_package(img, package_bg, output_path)
-                            
-                        # Door (Base_door.jpg)
-                        door_bg = os.path.join(ui_assets_dir, 'Base_door.jpg')
-                        if os.path.exists(door_bg):
-                            output_path = os.path.join(RENDERED_DIR, f"door_{timestamp}.png")
-                            st.session_state.scene_previews['door'] = render_on_door(img, door_bg, output_path)
-                            
-                        # Wall (Base_wall.jpeg)
-                        wall_bg = os.path.join(ui_assets_dir, 'Base_wall.jpeg')
-                        if os.path.exists(wall_bg):
-                            output_path = os.path.join(RENDERED_DIR, f"wall_{timestamp}.png")
-                            st.session_state.scene_previews['wall'] = render_on_wall(img, wall_bg, output_path)
+                        # Window, package, door and wall from ui_assets/prototype_images
+                        publish_scenes(mask, processed_path, canvases=preparation.canvases())
                         
                         progress_bar.progress(100)
                         status_container.success("Creation complete!")
@@ -404,14 +682,21 @@ def main():
                         # Rerun to update button state
                         st.rerun()
                         
+                    elif rate_limited:
+                        preparation.cancel()
+                        status_container.warning("Too many requests from this session, please wait for the current ones to finish.")
                     else:
+                        preparation.cancel()
                         status_container.error(f"Generation failed: ComfyUI did not return an image")
             
             except Exception as e:
                 status_container.error(f"Error occurred: {e}")
 
     # Results Display
-    if st.session_state.processed_image:
+    papercut_bytes = st.session_state.processed_image.get("preview") if st.session_state.processed_image else None
+    if st.session_state.processed_image and papercut_bytes is None:
+        st.info("This result has been released from memory, please generate again.")
+    if papercut_bytes:
         with results_placeholder.container():
             st.markdown("---")
             
@@ -419,22 +704,46 @@ def main():
             col_res1, col_res2, col_res3 = st.columns([1, 8, 1]) # Much wider middle column
             with col_res2:
                 st.markdown("<h3 style='text-align: center;'>Papercut Result</h3>", unsafe_allow_html=True)
-                st.image(st.session_state.processed_image, use_container_width=True)
+                if st.session_state.draft is not None:
+                    st.caption(f"Quick draft ({st.session_state.draft.steps} steps, seed {st.session_state.draft.seed}), "
+                               "click Refine for full quality")
+                st.image(papercut_bytes, use_container_width=True)
                 
                 # Download button (Centered under image)
                 col_dl1, col_dl2, col_dl3 = st.columns([1, 2, 1])
                 with col_dl2:
-                    import io
-                    buf = io.BytesIO()
-                    st.session_state.processed_image.save(buf, format="PNG")
-                    byte_im = buf.getvalue()
-                    
+                    # Bytes were encoded once after generation, reruns do no encoding
                     st.download_button(
                         label="Download Papercut",
-                        data=byte_im,
+                        data=st.session_state.processed_image.get("download"),
                         file_name=f"papercut_{int(time.time())}.png",
-                        mime="image/png"
+                        mime=st.session_state.processed_image.mime("download")
                     )
+                
+                # Parameter tuning: proxy-resolution previews while sliding, one full-resolution pass on apply
+                raw_image_path = st.session_state.generated_image
+                if raw_image_path and os.path.exists(raw_image_path) and st.checkbox("Adjust papercut"):
+                    contrast = st.slider("Contrast", 1.0, 6.0, float(DEFAULT_PARAMS["contrast"]), 0.1)
+                    threshold = st.slider("White threshold", 150, 254, int(DEFAULT_PARAMS["threshold"]))
+                    color_hex = st.color_picker("Papercut color", "#%02x%02x%02x" % DEFAULT_PARAMS["color"])
+                    color = tuple(int(color_hex[i:i + 2], 16) for i in (1, 3, 5))
+                    
+                    tuner = get_tuner(raw_image_path)
+                    preview = tuner.preview(contrast=contrast, threshold=threshold, color=color)
+                    st.image(preview["papercut"], caption="Preview", use_container_width=True)
+                    if preview["scenes"]:
+                        for col, (scene, image) in zip(st.columns(len(preview["scenes"])), preview["scenes"].items()):
+                            col.image(image, caption=scene.capitalize(), use_container_width=True)
+                    
+                    if st.button("Apply"):
+                        mask, scene_images = tuner.commit(contrast=contrast, threshold=threshold, color=color)
+                        key = process_cache_key(raw_image_path, tuner.params(contrast=contrast, threshold=threshold, color=color))
+                        processed_path = get_render_cache().put(
+                            "process", key, encode_papercut(mask.render(), mode="P"), "image_processed")
+                        get_session_cache().drop_session(st.session_state.session_id)
+                        publish_papercut(mask)
+                        publish_scenes(mask, processed_path, scene_images)
+                        st.rerun()
     
             # Scene Simulation
             st.markdown("---")
@@ -445,33 +754,26 @@ def main():
                 col_r1_1, col_r1_2 = st.columns(2)
                 
                 with col_r1_1:
-                    if 'window' in st.session_state.scene_previews and st.session_state.scene_previews['window']:
-                        st.image(st.session_state.scene_previews['window'], caption="Window Effect", use_container_width=True)
-                    else:
-                        st.info("Window preview failed")
+                    show_scene_preview('window', "Window")
                         
                 with col_r1_2:
-                    if 'package' in st.session_state.scene_previews and st.session_state.scene_previews['package']:
-                        st.image(st.session_state.scene_previews['package'], caption="Package Effect", use_container_width=True)
-                    else:
-                        st.info("Package preview failed")
+                    show_scene_preview('package', "Package")
                 
                 # Row 2: Door & Wall (Square 1:1)
                 col_r2_1, col_r2_2 = st.columns(2)
                 
                 with col_r2_1:
-                    if 'door' in st.session_state.scene_previews and st.session_state.scene_previews['door']:
-                        st.image(st.session_state.scene_previews['door'], caption="Door Effect", use_container_width=True)
-                    else:
-                        st.info("Door preview failed")
+                    show_scene_preview('door', "Door")
                         
                 with col_r2_2:
-                    if 'wall' in st.session_state.scene_previews and st.session_state.scene_previews['wall']:
-                        st.image(st.session_state.scene_previews['wall'], caption="Wall Effect", use_container_width=True)
-                    else:
-                        st.info("Wall preview failed")
+                    show_scene_preview('wall', "Wall")
             else:
                 st.warning("Preview generation failed. Please check resource files.")
 
+    # Debug: process-wide counters (coalesced requests, cache hits, queue times...) in Prometheus format
+    if SHOW_METRICS:
+        with st.expander("Metrics"):
+            st.code(metrics.to_prometheus(), language="text")
+
 if __name__ == "__main__":
     main()
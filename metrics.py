@@ -0,0 +1,74 @@
+"""
+Lightweight in-process metrics - counters, gauges and summaries shared by the generation and processing modules
+"""
+
+import threading
+
+
+def _format_key(name, labels=None):
+    """Build the Prometheus style series key, e.g. name{scene="window"}"""
+    if not labels:
+        return name
+    label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of named metrics
+
+    Counters only go up, gauges are set to the latest value and summaries keep
+    a running count and sum (exported as <name>_count and <name>_sum).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+
+    def inc(self, name, value=1.0, labels=None):
+        """Increase a counter by value"""
+        key = _format_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_gauge(self, name, value, labels=None):
+        """Set a gauge to value"""
+        key = _format_key(name, labels)
+        with self._lock:
+            self._gauges[key] = float(value)
+
+    def observe(self, name, value, labels=None):
+        """Record one observation of a summary (e.g. a latency in seconds)"""
+        self.inc(f"{name}_count", 1.0, labels)
+        self.inc(f"{name}_sum", value, labels)
+
+    def get(self, name, default=0.0, labels=None):
+        """Read the current value of a counter or gauge"""
+        key = _format_key(name, labels)
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            return self._gauges.get(key, default)
+
+    def snapshot(self) -> dict:
+        """Return a copy of all current values"""
+        with self._lock:
+            values = dict(self._counters)
+            values.update(self._gauges)
+        return values
+
+    def to_prometheus(self) -> str:
+        """Export all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+
+        lines = []
+        for key, value in counters + gauges:
+            lines.append(f"{key} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide default registry
+metrics = MetricsRegistry()
@@ -0,0 +1,242 @@
+"""
+Papercut Mask - Compact mask-plus-color representation of a processed papercut
+
+After processing, a papercut is nothing but an alpha mask and a color. Keeping
+only the single 'L' alpha plane (or a bit-packed plane when the mask is binary)
+is 4x (or 32x) smaller than RGBA, and resizing or rotating it touches one channel
+instead of four. Any color and opacity is rendered on demand.
+
+Each mask keeps a lazily built mipmap pyramid of its alpha plane (successive 2x
+box reductions). Resizes resample from the nearest level that is still at least
+as large as the target, so every scene, thumbnail and preview of one result
+shares the cheap reductions instead of filtering the full-resolution plane again.
+"""
+
+import io
+import math
+
+import numpy as np
+from PIL import Image, PngImagePlugin
+
+from image_output import papercut_color
+
+# Default papercut color, same as convert_to_red
+DEFAULT_COLOR = (255, 0, 0)
+
+
+class PapercutMask:
+    """
+    Args:
+        alpha: 'L' image holding the papercut alpha
+        color: RGB color of the papercut
+    """
+
+    def __init__(self, alpha: Image.Image, color: tuple = DEFAULT_COLOR):
+        if alpha.mode != 'L':
+            raise ValueError(f"PapercutMask needs an 'L' alpha plane, got mode {alpha.mode}")
+        self.alpha = alpha
+        self.color = tuple(color)
+        self._levels = [alpha]  # mipmap pyramid, level i is 2**i times smaller
+
+    @classmethod
+    def from_image(cls, image: Image.Image, color: tuple = None) -> "PapercutMask":
+        """
+        Build a mask from an RGBA papercut (only the alpha channel is kept)
+
+        Args:
+            image: Papercut image; images without alpha are treated as fully opaque
+            color: (Optional) Papercut color, detected from a single-color papercut if None
+        """
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        if color is None:
+            color = papercut_color(image) or DEFAULT_COLOR
+        alpha = image.getchannel('A')
+        return cls(alpha, color)
+
+    @property
+    def size(self):
+        return self.alpha.size
+
+    @property
+    def width(self):
+        return self.alpha.width
+
+    @property
+    def height(self):
+        return self.alpha.height
+
+    def is_binary(self) -> bool:
+        """True if every pixel is fully transparent or fully opaque"""
+        histogram = self.alpha.histogram()
+        return sum(histogram[1:255]) == 0
+
+    def level_for(self, size) -> Image.Image:
+        """
+        Smallest pyramid level that is at least size in both dimensions
+
+        Levels are built on first use with 2x box reductions and kept for later calls.
+        """
+        width, height = size
+        level = self._levels[-1]
+        while (level.width + 1) // 2 >= width and (level.height + 1) // 2 >= height and min(level.size) > 1:
+            level = level.reduce(2)
+            self._levels.append(level)
+        for level in reversed(self._levels):
+            if level.width >= width and level.height >= height:
+                return level
+        return self.alpha
+
+    def pyramid_levels(self):
+        """Sizes of the pyramid levels built so far"""
+        return [level.size for level in self._levels]
+
+    def resize(self, size, resample=Image.Resampling.LANCZOS) -> "PapercutMask":
+        """Resize the alpha plane, resampling from the nearest larger pyramid level"""
+        if tuple(size) == self.size:
+            return PapercutMask(self.alpha, self.color)
+        return PapercutMask(self.level_for(size).resize(size, resample), self.color)
+
+    def thumbnail(self, max_side, resample=Image.Resampling.LANCZOS) -> "PapercutMask":
+        """Downscale (never upscale) so that the longer side is at most max_side, keeping the aspect ratio"""
+        scale = max_side / max(self.size)
+        if scale >= 1.0:
+            return self
+        size = (max(1, round(self.width * scale)), max(1, round(self.height * scale)))
+        return self.resize(size, resample)
+
+    def rotate(self, angle, resample=Image.Resampling.BICUBIC, expand=True) -> "PapercutMask":
+        """Rotate the alpha plane counter-clockwise (same alpha as rotating the RGBA papercut)"""
+        return PapercutMask(self.alpha.rotate(angle, resample=resample, expand=expand), self.color)
+
+    def resize_rotate(self, size, angle, resample=Image.Resampling.BICUBIC) -> "PapercutMask":
+        """
+        Resize to size and rotate counter-clockwise with expand=True in one affine transform
+
+        Equivalent to resize(size).rotate(angle, expand=True) but resamples the plane once.
+        """
+        width, height = size
+        # An affine transform does not low-pass filter, so start from the nearest larger pyramid level
+        alpha = self.level_for(size)
+        sx, sy = alpha.width / width, alpha.height / height
+
+        # Same matrix as Image.rotate(expand=True) for a width x height image (output -> input coords)
+        theta = -math.radians(angle)
+        a, b = round(math.cos(theta), 15), round(math.sin(theta), 15)
+        d, e = -b, a
+        cx, cy = width / 2.0, height / 2.0
+        corners = [(a * (x - cx) + b * (y - cy) + cx, d * (x - cx) + e * (y - cy) + cy)
+                   for x, y in ((0, 0), (width, 0), (width, height), (0, height))]
+        xs, ys = [c[0] for c in corners], [c[1] for c in corners]
+        new_width = math.ceil(max(xs)) - math.floor(min(xs))
+        new_height = math.ceil(max(ys)) - math.floor(min(ys))
+        ox, oy = -(new_width - width) / 2.0 - cx, -(new_height - height) / 2.0 - cy
+        c = a * ox + b * oy + cx
+        f = d * ox + e * oy + cy
+
+        # Compose with the scale from target size back to the source plane
+        matrix = (a * sx, b * sx, c * sx, d * sy, e * sy, f * sy)
+        transformed = alpha.transform((new_width, new_height), Image.Transform.AFFINE, matrix, resample)
+        return PapercutMask(transformed, self.color)
+
+    def scaled_alpha(self, opacity: float = 1.0) -> Image.Image:
+        """Alpha plane multiplied by opacity, truncated like convert_to_red"""
+        if opacity >= 1.0:
+            return self.alpha
+        return self.alpha.point(lambda v: int(v * opacity))
+
+    def render(self, color: tuple = None, opacity: float = 1.0) -> Image.Image:
+        """
+        Render the papercut as RGBA, identical to convert_to_red(papercut, color, opacity)
+
+        Args:
+            color: (Optional) RGB color, the mask's own color if None
+            opacity: Opacity, 0.0-1.0
+        """
+        color = tuple(color or self.color)
+        alpha = self.scaled_alpha(opacity)
+        # convert_to_red writes the color where the original alpha > 0 and black elsewhere
+        visible = self.alpha.point(lambda v: 255 if v > 0 else 0)
+        rgba = Image.new('RGBA', self.size, (0, 0, 0, 0))
+        rgba.paste(color + (0,), (0, 0) + self.size, visible)
+        rgba.putalpha(alpha)
+        return rgba
+
+    def render_batch(self, variants, out: np.ndarray = None) -> np.ndarray:
+        """
+        Render K color/opacity variants in two broadcast passes (color pixels, then alpha)
+
+        Args:
+            variants: List of (color, opacity) pairs
+            out: (Optional) Preallocated C-contiguous uint8 buffer of shape (K, H, W, 4) to write into
+
+        Returns:
+            np.ndarray: (K, H, W, 4) RGBA buffer; out[k] equals convert_to_red(papercut, *variants[k])
+        """
+        shape = (len(variants), self.height, self.width, 4)
+        if out is None:
+            out = np.empty(shape, dtype=np.uint8)
+        elif out.shape != shape or out.dtype != np.uint8 or not out.flags.c_contiguous:
+            raise ValueError(f"Output buffer must be a contiguous uint8 {shape} array, got {out.dtype} {out.shape}")
+
+        alpha = np.asarray(self.alpha)
+        # Each variant's RGB0 pixel as one 32-bit word, so the color pass writes whole pixels
+        colors = np.zeros((len(variants), 4), dtype=np.uint8)
+        colors[:, :3] = [color for color, _ in variants]
+        opacities = np.array([opacity for _, opacity in variants], dtype=np.float64)
+
+        # Color where alpha > 0, black elsewhere (like convert_to_red)
+        visible = (alpha > 0).view(np.uint8)
+        pixels = out.view(np.uint32).reshape(shape[:3])
+        np.multiply(visible[None, :, :], colors.view(np.uint32)[:, :, None], out=pixels, casting='unsafe')
+        # Alpha times opacity, truncated like convert_to_red's astype(np.uint8)
+        np.multiply(alpha[None, :, :], opacities[:, None, None], out=out[..., 3], casting='unsafe')
+        return out
+
+    def nbytes(self, packed: bool = True) -> int:
+        """In-memory size of the mask's pixel data (bit-packed if binary and packed is True)"""
+        if packed and self.is_binary():
+            return (self.width * self.height + 7) // 8
+        return self.width * self.height
+
+    def pack(self) -> bytes:
+        """Bit-pack a binary mask (1 bit per pixel)"""
+        if not self.is_binary():
+            raise ValueError("Only binary masks can be bit-packed")
+        return np.packbits(np.asarray(self.alpha) > 0).tobytes()
+
+    @classmethod
+    def unpack(cls, data: bytes, size, color: tuple = DEFAULT_COLOR) -> "PapercutMask":
+        """Inverse of pack()"""
+        width, height = size
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=width * height)
+        alpha = Image.fromarray((bits * 255).astype(np.uint8).reshape(height, width), 'L')
+        return cls(alpha, color)
+
+    def to_png(self, compress_level: int = 3) -> bytes:
+        """Encode as a 1-bit or 8-bit grayscale PNG carrying the color as metadata"""
+        info = PngImagePlugin.PngInfo()
+        info.add_text("papercut_color", "#%02x%02x%02x" % self.color)
+        plane = self.alpha.convert('1', dither=Image.Dither.NONE) if self.is_binary() else self.alpha
+        buf = io.BytesIO()
+        plane.save(buf, format="PNG", compress_level=compress_level, pnginfo=info)
+        return buf.getvalue()
+
+    @classmethod
+    def from_png(cls, source) -> "PapercutMask":
+        """Load a mask written by to_png (path, file object or bytes)"""
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        image = Image.open(source)
+        color = image.info.get("papercut_color")
+        rgb = tuple(int(color[i:i + 2], 16) for i in (1, 3, 5)) if color else DEFAULT_COLOR
+        return cls(image.convert('L'), rgb)
+
+
+def as_mask(papercut_input) -> PapercutMask:
+    """Accept a PapercutMask, a papercut image path or a PIL image and return a PapercutMask"""
+    if isinstance(papercut_input, PapercutMask):
+        return papercut_input
+    if isinstance(papercut_input, str):
+        papercut_input = Image.open(papercut_input)
+    return PapercutMask.from_image(papercut_input)
@@ -0,0 +1,148 @@
+"""
+Pipeline - Overlap CPU work with GPU generation
+
+A generation spends 10-60 s waiting for ComfyUI. ScenePreparation uses that
+time to decode the scene plates, copy them into ready-to-draw canvases and
+load the image encoders, so post-processing starts on warm buffers the moment
+the image arrives. run_pipelined does the same across a batch: result k is
+post-processed while result k+1 is still generating.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from PIL import Image
+
+from Image_Processing import load_scene
+from image_output import PAPERCUT_PNG, encode_image
+from metrics import metrics
+
+# Preparation runs next to the GPU wait, it must not compete with request threads for many cores
+_prep_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="request-prep")
+
+_encoders_warm = threading.Event()
+
+
+def warm_encoders():
+    """Encode a tiny image once per output format, so codec plugins and libraries are loaded before first use"""
+    if _encoders_warm.is_set():
+        return
+    tiny = Image.new("RGBA", (16, 16), (152, 0, 21, 255))
+    for format in ("JPEG", "WEBP", "PNG", PAPERCUT_PNG):
+        try:
+            encode_image(tiny, format)
+        except (OSError, KeyError) as e:
+            # e.g. Pillow built without WebP: the real encode reports it
+            print(f"Could not warm up {format} encoder: {e}")
+    _encoders_warm.set()
+
+
+class ScenePreparation:
+    """
+    Scene canvases prepared in the background while the GPU generates
+
+    Args:
+        scene_plates: {scene name: plate path}
+    """
+
+    def __init__(self, scene_plates: dict):
+        self.scene_plates = dict(scene_plates)
+        self._futures = {}
+        self._encoders = None
+
+    def start(self) -> "ScenePreparation":
+        """Start decoding plates into canvases and warming encoders; returns self"""
+        self._futures = {scene: _prep_pool.submit(self._prepare, scene, path)
+                         for scene, path in self.scene_plates.items()}
+        self._encoders = _prep_pool.submit(warm_encoders)
+        return self
+
+    def canvases(self, timeout=None) -> dict:
+        """
+        Ready canvases, each a fresh RGB copy of its plate for render_scene(..., in_place=True)
+
+        Canvases are handed over once; scenes whose preparation failed are left out.
+        """
+        canvases = {}
+        for scene, future in self._futures.items():
+            try:
+                canvases[scene] = future.result(timeout=timeout)
+            except Exception as e:
+                print(f"Error preparing scene {scene}: {e}")
+        self._futures = {}
+        return canvases
+
+    def cancel(self):
+        """Drop preparations that have not started (e.g. the generation failed)"""
+        for future in self._futures.values():
+            future.cancel()
+        self._futures = {}
+
+    @staticmethod
+    def _prepare(scene, path):
+        start = time.perf_counter()
+        canvas = load_scene(path)
+        metrics.observe("pipeline_prepare_seconds", time.perf_counter() - start, labels={"scene": scene})
+        return canvas
+
+
+_END = object()
+
+
+def run_pipelined(items, submit, postprocess, max_ahead=2, workers=1):
+    """
+    Generate a batch on the GPU and post-process each result while later ones are still generating
+
+    Args:
+        items: Iterable of work items (e.g. prompts)
+        submit: Callable(item) -> Future of the generation result (e.g. a GenerationScheduler.submit wrapper)
+        postprocess: Callable(item, generation result) -> final result, run on a CPU thread
+        max_ahead: Generations submitted ahead of the post-processing (bounds queued GPU work)
+        workers: Post-processing threads
+
+    Yields:
+        tuple: (item, result, error) in completion order; error is the exception of a failed item, else None
+    """
+    items = iter(items)
+    generating = {}  # generation future -> item
+    processing = {}  # post-processing future -> item
+    failed = []  # (item, error) of submissions that raised
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline-post") as cpu:
+        def fill():
+            while len(generating) < max_ahead:
+                item = next(items, _END)
+                if item is _END:
+                    return
+                try:
+                    generating[submit(item)] = item
+                except Exception as e:
+                    failed.append((item, e))
+
+        fill()
+        while generating or processing or failed:
+            while failed:
+                item, error = failed.pop(0)
+                yield item, None, error
+            if not (generating or processing):
+                fill()
+                continue
+
+            done, _ = wait(list(generating) + list(processing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in generating:
+                    item = generating.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        yield item, None, error
+                    else:
+                        if generating:
+                            # Overlapped: the next generation is already running on the GPU
+                            metrics.inc("pipeline_overlapped_postprocess_total")
+                        processing[cpu.submit(postprocess, item, future.result())] = item
+                else:
+                    item = processing.pop(future)
+                    error = future.exception()
+                    yield item, (None if error else future.result()), error
+            fill()
@@ -0,0 +1,248 @@
+"""
+Speculative pre-generation pool for popular subjects
+
+While the GPU is idle, keep a small bounded pool of ready, already post-processed
+papercuts for the most requested subjects. A request that matches a pooled subject
+is served immediately and the pool refills in the background.
+"""
+
+import collections
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from comfy_api import normalize_prompt
+from metrics import metrics
+
+# Session id used for pre-generation jobs, so they can be cancelled as soon as a user job arrives
+PREGEN_SESSION_ID = "__pregen__"
+
+# Fix-ups for asset filenames that do not spell the subject (e.g. BG_Dargon.png)
+_SUBJECT_ALIASES = {"dargon": "dragon", "animal": None}
+
+
+def subject_key(prompt):
+    """Normalize a prompt to a pool subject key ("A Tiger " -> "tiger")"""
+    text = normalize_prompt(prompt)
+    return re.sub(r"^(a|an|the) ", "", text)
+
+
+def default_subjects(base_dir):
+    """
+    Seed subjects from the bundled background papercuts and the default word bank
+
+    Args:
+        base_dir: Project root directory
+
+    Returns:
+        list: Subject keys, most representative first
+    """
+    subjects = []
+
+    # 1. ui_assets/background/BG_<Subject>.png
+    assets_dir = os.path.join(base_dir, "ui_assets", "background")
+    if os.path.exists(assets_dir):
+        for f in sorted(os.listdir(assets_dir)):
+            name, ext = os.path.splitext(f)
+            if ext.lower() not in (".png", ".jpg") or not name.startswith("BG_"):
+                continue
+            subject = re.sub(r"\d+$", "", name[3:]).lower()
+            subject = _SUBJECT_ALIASES.get(subject, subject)
+            if subject:
+                subjects.append(subject_key(subject))
+
+    # 2. Previous_Work/data/default_words.json subjects
+    words_path = os.path.join(base_dir, "Previous_Work", "data", "default_words.json")
+    if os.path.exists(words_path):
+        try:
+            with open(words_path, "r", encoding="utf-8") as f:
+                subjects.extend(subject_key(s) for s in json.load(f).get("subjects", []))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error loading default words {words_path}: {e}")
+
+    # Keep order, drop duplicates
+    return list(dict.fromkeys(subjects))
+
+
+class UsageHistory:
+    """Persistent request counts per subject, used to pick which subjects to pre-generate"""
+
+    def __init__(self, path, seed_subjects=()):
+        self.path = path
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+        # Seed subjects start with a small count so they rank above never-seen subjects
+        for subject in seed_subjects:
+            self._counts[subject] = 1
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._counts.update(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error loading usage history {self.path}: {e}")
+
+    def record(self, prompt):
+        """Count one request for the prompt's subject"""
+        with self._lock:
+            self._counts[subject_key(prompt)] += 1
+            counts = dict(self._counts)
+        if self.path:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(counts, f)
+            os.replace(tmp_path, self.path)
+
+    def top(self, n):
+        """The n most requested subjects"""
+        with self._lock:
+            return [subject for subject, _ in self._counts.most_common(n)]
+
+
+class PregenPool:
+    """
+    Bounded pool of pre-generated, post-processed papercuts
+
+    Args:
+        manager: ComfyUIManager used for generation
+        scheduler: GenerationScheduler, pre-generation only runs while it is idle
+        process_fn: Callable(raw_image_path) -> ready result (e.g. processed image path), None on failure
+        raw_dir: Directory for pre-generated raw images (kept apart from user requests)
+        history: UsageHistory ranking the subjects
+        top_n: Number of subjects kept in the pool
+        per_subject: Ready results kept per subject
+        poll_interval: Seconds between idle checks
+    """
+
+    def __init__(self, manager, scheduler, process_fn, raw_dir, history, top_n=5, per_subject=1, poll_interval=5.0):
+        self.manager = manager
+        self.scheduler = scheduler
+        self.process_fn = process_fn
+        self.raw_dir = raw_dir
+        self.history = history
+        self.top_n = top_n
+        self.per_subject = per_subject
+        self.poll_interval = poll_interval
+
+        os.makedirs(raw_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pool = collections.defaultdict(collections.deque)  # subject -> ready results
+        self._pending = collections.Counter()  # subject -> results still being post-processed
+        # Post-processing runs beside the next pre-generation, so GPU and CPU work overlap
+        self._postprocess = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pregen-post")
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._fill_loop, name="pregen-pool", daemon=True)
+        self._thread.start()
+
+    def take(self, prompt):
+        """
+        Record a request and pop a ready result for its subject
+
+        Args:
+            prompt (str): User prompt
+
+        Returns:
+            Ready result from process_fn, or None if the pool has nothing for this subject
+        """
+        self.history.record(prompt)
+        with self._lock:
+            ready = self._pool.get(subject_key(prompt))
+            result = ready.popleft() if ready else None
+            self._update_gauge()
+        if result is None:
+            metrics.inc("pregen_pool_misses_total")
+        else:
+            metrics.inc("pregen_pool_hits_total")
+        return result
+
+    def size(self):
+        """Number of ready results in the pool"""
+        with self._lock:
+            return sum(len(q) for q in self._pool.values())
+
+    def stop(self):
+        """Stop refilling and cancel a running pre-generation job"""
+        self._stop_event.set()
+        self.manager.cancel_session(PREGEN_SESSION_ID)
+        self._postprocess.shutdown(wait=False, cancel_futures=True)
+
+    def _next_subject(self):
+        """Most requested subject whose pool is below per_subject, None if all are full"""
+        targets = self.history.top(self.top_n)
+        with self._lock:
+            # Drop subjects that fell out of the top-N so the pool stays bounded
+            for subject in list(self._pool):
+                if subject not in targets:
+                    del self._pool[subject]
+            self._update_gauge()
+            for subject in targets:
+                if len(self._pool[subject]) + self._pending[subject] < self.per_subject:
+                    return subject
+        return None
+
+    def _fill_loop(self):
+        while not self._stop_event.wait(timeout=self.poll_interval):
+            if not self.scheduler.is_idle():
+                continue
+            subject = self._next_subject()
+            if subject is None:
+                continue
+            self._pregenerate(subject)
+
+    def _pregenerate(self, subject):
+        """Generate and post-process one result, giving the GPU back as soon as a user job shows up"""
+        outcome = {}
+
+        def run():
+            outcome["raw_path"], outcome["shared"] = self.manager.generate_image_shared(
+                subject, self.raw_dir, session_id=PREGEN_SESSION_ID)
+
+        worker = threading.Thread(target=run, daemon=True)
+        started = time.monotonic()
+        worker.start()
+        cancelled = False
+        while worker.is_alive():
+            worker.join(timeout=0.5)
+            if worker.is_alive() and not cancelled and (not self.scheduler.is_idle() or self._stop_event.is_set()):
+                # User work arrived: the GPU belongs to them
+                cancelled = self.manager.cancel_session(PREGEN_SESSION_ID)
+                if cancelled:
+                    metrics.inc("pregen_jobs_cancelled_total")
+
+        raw_path, shared = outcome.get("raw_path"), outcome.get("shared")
+        if shared:
+            # A user request for the same subject attached to this job and already got the image
+            metrics.inc("pregen_jobs_shared_total")
+        if not raw_path or shared:
+            return
+        with self._lock:
+            self._pending[subject] += 1
+        self._postprocess.submit(self._finish, subject, raw_path, started)
+
+    def _finish(self, subject, raw_path, started):
+        """Post-process a pre-generated image (on the post-processing thread) and add it to the pool"""
+        try:
+            result = self.process_fn(raw_path)
+        except Exception as e:
+            print(f"Error post-processing pre-generated '{subject}': {e}")
+            result = None
+        # The subject may have left the top-N while it was generating
+        targets = self.history.top(self.top_n)
+        with self._lock:
+            self._pending[subject] -= 1
+            if result is not None and subject in targets:
+                self._pool[subject].append(result)
+            self._update_gauge()
+        if result is not None:
+            metrics.inc("pregen_jobs_total")
+            print(f"Pre-generated papercut for '{subject}' in {time.monotonic() - started:.1f}s")
+
+    def _update_gauge(self):
+        # Caller must hold self._lock
+        metrics.set_gauge("pregen_pool_ready", sum(len(q) for q in self._pool.values()))
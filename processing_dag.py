@@ -0,0 +1,247 @@
+"""
+Processing DAG - Memoized papercut processing and scene rendering for interactive tuning
+
+The processing chain and the scene renders are modeled as a small DAG:
+
+    source -> luminance -> contrast -> mask -> papercut
+                                         \-> scene:<name>  (+ plate:<name>)
+
+Every node caches its last few results keyed by the parameters it reads and the
+keys of its inputs, so moving one slider only recomputes the stages downstream
+of that parameter (a color change never re-runs contrast or thresholding).
+PapercutTuner runs the DAG on a downscaled proxy while parameters are being
+tuned and once at full resolution when they are committed.
+"""
+
+import collections
+import time
+
+from PIL import Image
+
+from Image_Processing import SCENE_COLOR, SCENE_PLACEMENTS, desaturate_image, increase_contrast, \
+    load_scene, remove_white_background, render_scene
+from metrics import metrics
+from papercut_mask import PapercutMask
+
+# Parameters of the papercut processing chain (see postprocess_raw_image in main.py)
+DEFAULT_PARAMS = {
+    "contrast": 3.0,
+    "threshold": 230,
+    "color": (255, 0, 0),
+    "scene_color": SCENE_COLOR,
+}
+
+# Longer side of the proxy papercut and proxy scene plates while tuning
+PROXY_SIDE = 512
+PROXY_SCENE_SIDE = 800
+
+# Scenes whose placement is relative to the plate size and can be previewed on a downscaled plate
+# (the window placement uses absolute coordinates of the 5760x3840 plate)
+PROXY_SCENES = ("package", "door", "wall")
+
+
+class _Node:
+    def __init__(self, name, fn, deps, params):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+
+
+class ProcessingDAG:
+    """
+    Args:
+        cache_per_node: Results kept per node, so flipping a slider back and forth stays cached
+        label: Label for the metrics of this DAG, e.g. "proxy" or "full"
+    """
+
+    def __init__(self, cache_per_node=4, label="full"):
+        self.cache_per_node = cache_per_node
+        self.label = label
+        self._nodes = {}
+        self._inputs = {}  # name -> (key, value)
+        self._cache = {}  # name -> OrderedDict(node key -> value), least recently used first
+
+    def add_input(self, name, value, key=None):
+        """
+        Set (or replace) a source node
+
+        Args:
+            name: Node name
+            value: Node value
+            key: (Optional) Hashable identity of value, id(value) if None
+        """
+        self._inputs[name] = (id(value) if key is None else key, value)
+        self._cache.pop(name, None)
+
+    def add_node(self, name, fn, deps=(), params=()):
+        """
+        Add a computed node
+
+        Args:
+            name: Node name
+            fn: Called as fn(*dep_values, **{param: value}) for the params it reads
+            deps: Names of the nodes whose values are passed positionally
+            params: Names of the parameters the node reads
+        """
+        self._nodes[name] = _Node(name, fn, deps, params)
+        self._cache[name] = collections.OrderedDict()
+
+    def get(self, name, params):
+        """
+        Value of a node, computing only the stages whose inputs or parameters changed
+
+        Args:
+            name: Node name
+            params: Parameter values, dict
+        """
+        return self._resolve(name, params)[1]
+
+    def _resolve(self, name, params):
+        # Returns (key, value); the key of a node identifies its value across calls
+        if name in self._inputs:
+            return self._inputs[name]
+
+        node = self._nodes[name]
+        resolved = [self._resolve(dep, params) for dep in node.deps]
+        node_params = {p: params[p] for p in node.params}
+        key = (name, tuple(node_params.items()), tuple(k for k, _ in resolved))
+
+        cache = self._cache[name]
+        if key in cache:
+            cache.move_to_end(key)
+            metrics.inc("processing_dag_cache_hits_total", labels={"dag": self.label})
+            return key, cache[key]
+
+        start = time.perf_counter()
+        value = node.fn(*(v for _, v in resolved), **node_params)
+        metrics.observe("processing_dag_stage_seconds", time.perf_counter() - start,
+                        labels={"dag": self.label, "stage": name.split(":")[0]})
+
+        cache[key] = value
+        while len(cache) > self.cache_per_node:
+            cache.popitem(last=False)
+        return key, value
+
+
+def _luminance(source: Image.Image) -> Image.Image:
+    # Desaturated image; without alpha its three channels are equal, so one 'L' plane carries it
+    if 'A' in source.getbands():
+        return desaturate_image(source)
+    return source.convert('L')
+
+
+def _contrast(luminance: Image.Image, contrast) -> Image.Image:
+    return increase_contrast(luminance, factor=contrast)
+
+
+def _mask(contrasted: Image.Image, threshold) -> PapercutMask:
+    # Same alpha as remove_white_background: transparent where every channel is above threshold
+    if contrasted.mode == 'L':
+        return PapercutMask(contrasted.point(lambda v: 0 if v > threshold else 255))
+    return PapercutMask(remove_white_background(contrasted, threshold=threshold).getchannel('A'))
+
+
+def _papercut(mask: PapercutMask, color) -> Image.Image:
+    return mask.render(color=color)
+
+
+def _scene_renderer(scene_name):
+    def render(mask, plate, scene_color):
+        return render_scene(scene_name, mask, plate, color=scene_color)
+    return render
+
+
+def build_papercut_dag(source: Image.Image, plates: dict, source_key=None, cache_per_node=4, label="full"):
+    """
+    DAG of the papercut processing chain and the scene renders
+
+    Args:
+        source: Raw generated image
+        plates: {scene name: RGB scene plate image}
+        source_key: (Optional) Hashable identity of source, e.g. its path
+        cache_per_node: Results kept per node
+        label: Metrics label
+
+    Returns:
+        ProcessingDAG: Nodes "luminance", "contrast", "mask", "papercut" and "scene:<name>"
+    """
+    dag = ProcessingDAG(cache_per_node=cache_per_node, label=label)
+    dag.add_input("source", source, source_key)
+    dag.add_node("luminance", _luminance, deps=("source",))
+    dag.add_node("contrast", _contrast, deps=("luminance",), params=("contrast",))
+    dag.add_node("mask", _mask, deps=("contrast",), params=("threshold",))
+    dag.add_node("papercut", _papercut, deps=("mask",), params=("color",))
+    for scene_name, plate in plates.items():
+        dag.add_input(f"plate:{scene_name}", plate, (source_key, scene_name, plate.size))
+        dag.add_node(f"scene:{scene_name}", _scene_renderer(scene_name), deps=("mask", f"plate:{scene_name}"),
+                     params=("scene_color",))
+    return dag
+
+
+class PapercutTuner:
+    """
+    Interactive tuning of the processing parameters of one generated image
+
+    Args:
+        image_path: Raw generated image
+        scene_plates: {scene name: scene plate path}, scenes without a placement are ignored
+        proxy_side: Longer side of the proxy papercut
+        proxy_scene_side: Longer side of the proxy scene plates
+    """
+
+    def __init__(self, image_path, scene_plates: dict, proxy_side=PROXY_SIDE, proxy_scene_side=PROXY_SCENE_SIDE):
+        self.image_path = image_path
+        self.scene_plates = {name: path for name, path in scene_plates.items() if name in SCENE_PLACEMENTS}
+
+        with Image.open(image_path) as source:
+            proxy = source.copy()
+        proxy.thumbnail((proxy_side, proxy_side), Image.Resampling.LANCZOS)
+
+        proxy_plates = {}
+        for name, path in self.scene_plates.items():
+            if name in PROXY_SCENES:
+                plate = load_scene(path)
+                plate.thumbnail((proxy_scene_side, proxy_scene_side), Image.Resampling.LANCZOS)
+                proxy_plates[name] = plate
+
+        # Only the proxy DAG is kept: the full-resolution source, plates and DAG live for one commit
+        self._proxy = build_papercut_dag(proxy, proxy_plates, source_key=(image_path, "proxy"), label="proxy")
+
+    @staticmethod
+    def params(**overrides) -> dict:
+        """DEFAULT_PARAMS with overrides applied (None values are ignored)"""
+        params = dict(DEFAULT_PARAMS)
+        params.update({k: v for k, v in overrides.items() if v is not None})
+        params["color"] = tuple(params["color"])
+        params["scene_color"] = tuple(params["scene_color"])
+        return params
+
+    def preview(self, **params) -> dict:
+        """
+        Proxy-resolution papercut and scene previews for a set of parameters
+
+        Returns:
+            dict: {"papercut": RGBA image, "scenes": {scene name: RGB image}}
+        """
+        params = self.params(**params)
+        scenes = {name: self._proxy.get(f"scene:{name}", params)
+                  for name in self.scene_plates if name in PROXY_SCENES}
+        return {"papercut": self._proxy.get("papercut", params), "scenes": scenes}
+
+    def commit(self, **params):
+        """
+        Full-resolution pass with the chosen parameters
+
+        Returns:
+            tuple: (PapercutMask in the chosen color, {scene name: rendered RGB image})
+        """
+        params = self.params(**params)
+        with Image.open(self.image_path) as source:
+            source.load()
+            plates = {name: load_scene(path) for name, path in self.scene_plates.items()}
+            full = build_papercut_dag(source, plates, source_key=(self.image_path, "full"),
+                                      cache_per_node=1, label="full")
+            mask = full.get("mask", params)
+            scenes = {name: full.get(f"scene:{name}", params) for name in self.scene_plates}
+        return PapercutMask(mask.alpha, params["color"]), scenes
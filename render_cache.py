@@ -0,0 +1,214 @@
+"""
+Render Cache - Persistent memo of processing and scene-render results
+
+A raw image that comes back (Regen with a cached seed, pre-generated pool,
+history replay, batch reruns) is processed and rendered with the same
+parameters again. This cache maps
+
+    (stage, input content hash, canonical parameter digest, scene asset hash)
+
+to an artifact in the ArtifactStore, so a repeated request is a lookup instead
+of a recompute. The memo table lives in the store's SQLite index (WAL mode), so
+several app processes share it; its size is bounded by the store's quota, and
+entries whose artifact was evicted are dropped on lookup.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+# Bump when processing or rendering changes output for the same parameters
+CACHE_VERSION = 1
+
+
+def param_digest(params: dict) -> str:
+    """Canonical digest of a parameter dict (key order, tuples vs lists and int vs float 3 vs 3.0 do not matter)"""
+    def canonical(value):
+        if isinstance(value, dict):
+            return {str(k): canonical(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [canonical(v) for v in value]
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    text = json.dumps(canonical(params), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+_digest_lock = threading.Lock()
+_digests = collections.OrderedDict()  # (path, size, mtime_ns) -> sha256, least recently used first
+
+
+def file_digest(path) -> str:
+    """SHA-256 of a file's content, memoized per (path, size, mtime)"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        if key in _digests:
+            _digests.move_to_end(key)
+            return _digests[key]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _digest_lock:
+        _digests[key] = digest
+        while len(_digests) > 1024:
+            _digests.popitem(last=False)
+    return digest
+
+
+class RenderCache:
+    """
+    Args:
+        store: ArtifactStore holding the cached results (and bounding their size)
+        prune_every: Drop memo rows of evicted artifacts after this many new entries
+        stats_flush_every: Lookups counted in memory before the hit/miss counters are written to the index
+        stats_flush_seconds: Also write them on the first lookup this many seconds after the last write
+    """
+
+    def __init__(self, store, prune_every=256, stats_flush_every=64, stats_flush_seconds=30.0):
+        self.store = store
+        self.prune_every = prune_every
+        self.stats_flush_every = stats_flush_every
+        self.stats_flush_seconds = stats_flush_seconds
+        self._lock = threading.Lock()
+        self._since_prune = 0
+        self._pending_stats = collections.Counter()  # (stage, "hits" or "misses") -> lookups not written yet
+        self._stats_flushed = time.monotonic()
+        self._db = sqlite3.connect(store.index_path, timeout=30,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS memo ("
+            " key TEXT PRIMARY KEY, stage TEXT NOT NULL, path TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        # Hit/miss counters shared by every process using the store (written in batches, see _count)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS memo_stats ("
+            " stage TEXT PRIMARY KEY, hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(stage, *digests, params=None) -> str:
+        """
+        Cache key of a stage result
+
+        Args:
+            stage: Stage name, e.g. "process" or "scene"
+            *digests: Content hashes of the inputs (raw image, papercut, scene plate, ...)
+            params: (Optional) Parameters of the stage
+        """
+        parts = [f"v{CACHE_VERSION}", stage, *digests, param_digest(params or {})]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def lookup(self, stage, key):
+        """
+        Path of a cached result
+
+        Returns:
+            str: Artifact path, None on a miss (including results whose artifact was evicted)
+        """
+        with self._lock:
+            row = self._db.execute("SELECT path FROM memo WHERE key = ?", (key,)).fetchone()
+        path = row[0] if row else None
+        if path is not None and not os.path.exists(path):
+            with self._lock:
+                self._db.execute("DELETE FROM memo WHERE key = ?", (key,))
+                self._db.commit()
+            path = None
+
+        hit = path is not None
+        self._count(stage, hit)
+        if hit:
+            # Keep the artifact from being evicted as least recently used
+            self.store.touch(path)
+        return path
+
+    def record(self, stage, key, path):
+        """Remember the artifact holding the result of key"""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO memo (key, stage, path, created) VALUES (?, ?, ?, ?)",
+                             (key, stage, path, time.time()))
+            self._db.commit()
+            self._since_prune += 1
+            prune = self._since_prune >= self.prune_every
+        if prune:
+            self.prune()
+
+    def put(self, stage, key, data: bytes, kind, ext=".png") -> str:
+        """Store result bytes in the ArtifactStore and record them under key; returns the artifact path"""
+        path = self.store.put(data, kind, ext)
+        self.record(stage, key, path)
+        return path
+
+    def get_or_compute(self, stage, key, compute, kind, ext=".png") -> str:
+        """
+        Cached result path, computing and storing the result on a miss
+
+        Args:
+            compute: Called without arguments on a miss, returns the encoded result bytes
+        """
+        path = self.lookup(stage, key)
+        if path is None:
+            path = self.put(stage, key, compute(), kind, ext)
+        return path
+
+    def prune(self) -> int:
+        """Drop memo rows whose artifact is no longer in the store; returns the number of rows dropped"""
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM memo WHERE path NOT IN (SELECT path FROM artifacts)")
+            self._db.commit()
+            self._since_prune = 0
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        """
+        Hit rates of all processes sharing the store
+
+        Returns:
+            dict: {stage: {"hits": int, "misses": int, "hit_rate": float}}
+        """
+        with self._lock:
+            self._flush_stats()
+            rows = self._db.execute("SELECT stage, hits, misses FROM memo_stats").fetchall()
+        return {stage: {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else 0.0}
+                for stage, hits, misses in rows}
+
+    def close(self):
+        with self._lock:
+            self._flush_stats()
+            self._db.close()
+
+    def _count(self, stage, hit):
+        metrics.inc("render_cache_requests_total", labels={"stage": stage, "result": "hit" if hit else "miss"})
+        # Counted in memory: a write per lookup would make every cache hit a SQLite commit
+        with self._lock:
+            self._pending_stats[(stage, "hits" if hit else "misses")] += 1
+            if (sum(self._pending_stats.values()) >= self.stats_flush_every
+                    or time.monotonic() - self._stats_flushed >= self.stats_flush_seconds):
+                self._flush_stats()
+
+    def _flush_stats(self):
+        # Caller must hold self._lock
+        self._stats_flushed = time.monotonic()
+        if not self._pending_stats:
+            return
+        stages = {stage for stage, _ in self._pending_stats}
+        self._db.executemany("INSERT OR IGNORE INTO memo_stats (stage) VALUES (?)", [(stage,) for stage in stages])
+        self._db.executemany(
+            "UPDATE memo_stats SET hits = hits + ?, misses = misses + ? WHERE stage = ?",
+            [(self._pending_stats[(stage, "hits")], self._pending_stats[(stage, "misses")], stage) for stage in stages])
+        self._db.commit()
+        self._pending_stats.clear()
@@ -0,0 +1,136 @@
+"""
+Resolution Planner - Choose the latent size from the outputs a request actually needs
+
+The workflow always generates 1024x1024, but the scenes show the papercut much
+smaller: about 144 px on the door plate (18% of 799), 380 px on the wall and
+~1008 px on the package (400 px in its 1600 px preview). Only window and
+package downloads need 1024 px or more. The planner works out the largest
+papercut size the requested outputs show and picks the smallest latent that
+covers it, so preview-only or low-resolution requests spend less GPU time.
+Optionally, the raw image is upscaled on the CPU to the nominal size afterwards
+(Lanczos, a few ms), so downstream sizes do not change.
+"""
+
+import functools
+import math
+import os
+
+from PIL import Image
+
+from Image_Processing import scene_papercut_size
+from image_output import scene_encodings
+from metrics import metrics
+
+# Latent size of the workflow's EmptySD3LatentImage node
+NOMINAL_SIDE = 1024
+# Flux loses the fine cut patterns below this size
+MIN_SIDE = 512
+# Flux needs multiples of 16 (VAE downscale 8 x patch size 2); a 64 px step keeps the set of sizes small
+LATENT_STEP = 64
+# The papercut preview is shown in a half-width column
+PAPERCUT_PREVIEW_SIDE = 512
+
+
+@functools.lru_cache(maxsize=16)
+def _plate_size(path, mtime_ns):
+    with Image.open(path) as image:  # Header only, the plate is not decoded
+        return image.size
+
+
+def plate_size(path):
+    """(width, height) of a scene plate"""
+    return _plate_size(path, os.stat(path).st_mtime_ns)
+
+
+def output_side(target, purpose, scene_plates=None, policy=None, nominal_side=NOMINAL_SIDE) -> float:
+    """
+    Longest side in pixels at which an output shows the papercut
+
+    Args:
+        target: "papercut" or a scene name
+        purpose: "preview", "download" or "archive"
+        scene_plates: {scene name: plate path}, required for scene targets
+        policy: (Optional) Scene output policy, SCENE_OUTPUT_POLICY if None
+        nominal_side: Papercut size the scene placements assume
+    """
+    if target == "papercut":
+        return PAPERCUT_PREVIEW_SIDE if purpose == "preview" else nominal_side
+
+    plate = plate_size(scene_plates[target])
+    side = max(scene_papercut_size(target, plate, (nominal_side, nominal_side)))
+    _, max_side, _ = scene_encodings(target, (purpose,), policy)[purpose]
+    if max_side and max(plate) > max_side:
+        # The encoded output is downscaled, and the papercut with it
+        side *= max_side / max(plate)
+    return side
+
+
+class ResolutionPlan:
+    """
+    Args:
+        latent_side: Latent width and height to generate at
+        required_side: Longest side at which any requested output shows the papercut
+        upscale_side: (Optional) Side to upscale the raw image to on the CPU, None for no upscale
+        gpu_seconds_saved: Estimated GPU time saved against a nominal-size generation
+        nominal_side: Latent size of the workflow
+    """
+
+    def __init__(self, latent_side, required_side, upscale_side=None, gpu_seconds_saved=0.0,
+                 nominal_side=NOMINAL_SIDE):
+        self.latent_side = latent_side
+        self.nominal_side = nominal_side
+        self.required_side = required_side
+        self.upscale_side = upscale_side
+        self.gpu_seconds_saved = gpu_seconds_saved
+
+    @property
+    def reduced(self) -> bool:
+        return self.latent_side < self.nominal_side
+
+    @property
+    def size(self):
+        """Latent size for ComfyUIManager.generate_image(size=...), None for the workflow's own size"""
+        return self.latent_side if self.reduced else None
+
+    def upscale(self, image: Image.Image) -> Image.Image:
+        """Raw image upscaled to upscale_side (unchanged if no upscale is planned)"""
+        if self.upscale_side is None or max(image.size) >= self.upscale_side:
+            return image
+        return image.resize((self.upscale_side, self.upscale_side), Image.Resampling.LANCZOS)
+
+    def __repr__(self):
+        return (f"ResolutionPlan(latent_side={self.latent_side}, required_side={self.required_side:.0f}, "
+                f"upscale_side={self.upscale_side}, gpu_seconds_saved={self.gpu_seconds_saved:.1f})")
+
+
+def plan_resolution(outputs, scene_plates=None, job_seconds=30.0, upscale=False, policy=None,
+                    nominal_side=NOMINAL_SIDE, min_side=MIN_SIDE) -> ResolutionPlan:
+    """
+    Smallest latent that covers every requested output
+
+    Args:
+        outputs: Iterable of (target, purpose), e.g. [("door", "preview"), ("papercut", "download")]
+        scene_plates: {scene name: plate path}, required for scene targets
+        job_seconds: GPU time of a nominal-size job (e.g. ComfyUIManager.avg_job_seconds)
+        upscale: Upscale reduced generations back to nominal_side on the CPU
+        policy: (Optional) Scene output policy, SCENE_OUTPUT_POLICY if None
+        nominal_side: Latent size of the workflow, also the upper bound of the plan
+        min_side: Lower bound of the plan
+
+    Returns:
+        ResolutionPlan: Outputs larger than nominal_side (window downloads) keep nominal_side,
+                        as before the render upsamples the papercut for them
+    """
+    required = max((output_side(target, purpose, scene_plates, policy, nominal_side) for target, purpose in outputs),
+                   default=nominal_side)
+    latent_side = math.ceil(required / LATENT_STEP) * LATENT_STEP
+    latent_side = min(nominal_side, max(min_side, latent_side))
+
+    # Flux time grows at least with the token count, i.e. the pixel count; this estimate is conservative
+    saved = job_seconds * (1.0 - (latent_side / nominal_side) ** 2)
+    plan = ResolutionPlan(latent_side, required, nominal_side if upscale and latent_side < nominal_side else None,
+                          saved, nominal_side)
+
+    metrics.inc("resolution_plans_total", labels={"latent": str(latent_side)})
+    metrics.inc("resolution_plan_gpu_seconds_saved_total", saved)
+    return plan
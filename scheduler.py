@@ -0,0 +1,345 @@
+"""
+Fair per-session scheduling and rate limiting for GPU generation jobs
+
+Jobs are queued per session and dispatched with smooth weighted round-robin,
+so one user clicking Regen repeatedly cannot starve everyone else. At most
+max_inflight jobs are handed to ComfyUI at a time; everything else waits here
+where it can still be reordered or dropped. Identical requests (same
+manager.request_key) share one queued or running job instead of each waiting
+for a turn on the GPU.
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import metrics
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a session submits more jobs than it is allowed to queue"""
+
+
+class _TokenBucket:
+    """Token bucket limiting how often a session may start a job"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens >= 1.0
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def full(self, now):
+        """True once the bucket has refilled to its burst size, i.e. it is the same as a new one"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def wait_time(self, now):
+        """Seconds until the next token is available"""
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class _Job:
+    def __init__(self, session_id, args, kwargs, key=None):
+        self.session_id = session_id  # Session whose queue and rate limit the job uses
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.waiters = {}  # Future -> session_id of every submission sharing this job
+        self.submitted_at = time.monotonic()
+
+    def wanted(self):
+        """Drop waiters whose future was cancelled, True if any are left"""
+        for future in [f for f in self.waiters if f.cancelled()]:
+            del self.waiters[future]
+        return bool(self.waiters)
+
+
+class GenerationScheduler:
+    """
+    Per-session fair queue in front of ComfyUIManager.generate_image
+
+    Args:
+        manager: ComfyUIManager (or any object with a generate_image method)
+        max_inflight: Maximum number of jobs inside ComfyUI's own queue at once (K)
+        rate_per_minute: (Optional) Jobs each session may start per minute, unlimited if None
+        burst: Number of jobs a session may start back to back before the rate limit applies
+        max_queued_per_session: Submissions beyond this queue depth raise RateLimitExceeded
+    """
+
+    def __init__(self, manager, max_inflight=1, rate_per_minute=None, burst=3, max_queued_per_session=5):
+        self.manager = manager
+        self.max_inflight = max_inflight
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_queued_per_session = max_queued_per_session
+
+        self._cond = threading.Condition()
+        self._queues = collections.OrderedDict()  # session_id -> deque of _Job
+        self._by_key = {}  # request key -> queued or running _Job
+        self._running_jobs = set()
+        self._weights = {}
+        self._current = {}  # smooth weighted round-robin state
+        self._buckets = {}
+        self._inflight = 0
+        self._running = True
+
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="generation-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def set_weight(self, session_id, weight):
+        """
+        Give a session a larger (or smaller) share of dispatch slots, default weight is 1
+
+        With a rate limit, the weight is forgotten with the session's bucket once it is idle.
+        """
+        with self._cond:
+            self._weights[session_id] = max(1, int(weight))
+
+    def submit(self, session_id, /, *args, supersede=False, **kwargs) -> Future:
+        """
+        Queue a generation job for a session
+
+        Args:
+            session_id: Identifier of the submitting session
+            *args, **kwargs: Passed through to manager.generate_image
+            supersede: Drop the session's queued jobs and cancel its in-flight job on the backend first
+
+        Returns:
+            Future: Resolves to the generate_image result
+
+        A job identical to one that is already queued or running (same
+        manager.request_key) shares that job's result; it takes no queue slot
+        and no rate-limit token.
+        """
+        if supersede:
+            self.cancel_session(session_id)
+            # Leave the backend job alone if another session still waits on it
+            if hasattr(self.manager, "cancel_session") and not self._shares_running_job(session_id):
+                self.manager.cancel_session(session_id)
+
+        key = self._job_key(args, kwargs)
+        future = Future()
+        with self._cond:
+            job = self._by_key.get(key) if key is not None else None
+            if job is not None and job.wanted():
+                job.waiters[future] = session_id
+                metrics.inc("scheduler_coalesced_jobs_total")
+                return future
+
+            queue = self._queues.setdefault(session_id, collections.deque())
+            if len(queue) >= self.max_queued_per_session:
+                metrics.inc("scheduler_rejected_jobs_total")
+                raise RateLimitExceeded(f"Session {session_id} already has {len(queue)} queued jobs")
+            job = _Job(session_id, args, kwargs, key)
+            job.waiters[future] = session_id
+            queue.append(job)
+            if key is not None:
+                self._by_key[key] = job
+            metrics.inc("scheduler_submitted_jobs_total")
+            self._update_gauges()
+            self._cond.notify_all()
+        return future
+
+    def cancel_session(self, session_id) -> int:
+        """
+        Cancel every submission of a session that has not completed yet
+
+        Queued jobs that no other session shares are dropped; shared ones keep
+        their turn in a waiting session's queue. Running jobs are not interrupted.
+
+        Returns:
+            int: Number of cancelled submissions
+        """
+        cancelled = []
+        with self._cond:
+            jobs = [job for queue in self._queues.values() for job in queue] + list(self._running_jobs)
+            for job in jobs:
+                for future, waiter in list(job.waiters.items()):
+                    if waiter == session_id:
+                        del job.waiters[future]
+                        cancelled.append(future)
+
+            queue = self._queues.pop(session_id, None) or ()
+            self._current.pop(session_id, None)
+            for job in reversed(queue):
+                if job.wanted():
+                    job.session_id = next(iter(job.waiters.values()))
+                    self._queues.setdefault(job.session_id, collections.deque()).appendleft(job)
+                else:
+                    self._forget(job)
+            self._update_gauges()
+        for future in cancelled:
+            future.cancel()
+        if cancelled:
+            metrics.inc("scheduler_cancelled_jobs_total", len(cancelled))
+        return len(cancelled)
+
+    def queued_jobs(self) -> int:
+        """Number of jobs waiting in the scheduler (not yet sent to ComfyUI)"""
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def inflight_jobs(self) -> int:
+        """Number of jobs currently inside ComfyUI"""
+        with self._cond:
+            return self._inflight
+
+    def is_idle(self) -> bool:
+        """True if there are no queued or running user jobs"""
+        with self._cond:
+            return self._inflight == 0 and not any(self._queues.values())
+
+    def shutdown(self):
+        """Stop dispatching, cancelling every job that is still queued"""
+        with self._cond:
+            self._running = False
+            session_ids = {waiter for queue in self._queues.values() for job in queue for waiter in job.waiters.values()}
+            self._cond.notify_all()
+        for session_id in session_ids:
+            self.cancel_session(session_id)
+
+    def _job_key(self, args, kwargs):
+        """Coalescing key of a submission, None if the manager has no request_key"""
+        request_key = getattr(self.manager, "request_key", None)
+        if request_key is None:
+            return None
+        try:
+            return request_key(*args, **kwargs)
+        except TypeError:
+            return None  # Bad arguments, generate_image reports them through the future
+
+    def _forget(self, job):
+        # Caller must hold self._cond
+        if job.key is not None and self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _shares_running_job(self, session_id):
+        """True if a running job started for this session is still awaited by another session"""
+        with self._cond:
+            return any(job.kwargs.get("session_id") == session_id and job.wanted() for job in self._running_jobs)
+
+    def _bucket(self, session_id):
+        if self.rate_per_minute is None:
+            return None
+        bucket = self._buckets.get(session_id)
+        if bucket is None:
+            bucket = _TokenBucket(self.rate_per_minute, self.burst)
+            self._buckets[session_id] = bucket
+        return bucket
+
+    def _pick_next(self, now):
+        """
+        Choose the next job with smooth weighted round-robin over eligible sessions
+
+        Returns:
+            tuple: (job or None, seconds until a rate-limited session becomes eligible or None)
+        """
+        # Forget idle sessions whose rate limit has recovered: session ids may come from clients
+        # (X-Client-Id), so their state must not grow forever
+        for session_id in [s for s, b in self._buckets.items() if s not in self._queues and b.full(now)]:
+            del self._buckets[session_id]
+            self._weights.pop(session_id, None)
+
+        eligible = []
+        next_ready = None
+        for session_id, queue in self._queues.items():
+            if not queue:
+                continue
+            bucket = self._bucket(session_id)
+            if bucket is not None and not bucket.available(now):
+                wait = bucket.wait_time(now)
+                next_ready = wait if next_ready is None else min(next_ready, wait)
+                continue
+            eligible.append(session_id)
+
+        if not eligible:
+            return None, next_ready
+
+        total = 0
+        best = None
+        for session_id in eligible:
+            weight = self._weights.get(session_id, 1)
+            total += weight
+            self._current[session_id] = self._current.get(session_id, 0) + weight
+            if best is None or self._current[session_id] > self._current[best]:
+                best = session_id
+        self._current[best] -= total
+
+        bucket = self._bucket(best)
+        if bucket is not None:
+            bucket.take(now)
+
+        queue = self._queues[best]
+        job = queue.popleft()
+        if not queue:
+            # Forget empty sessions so the round-robin state does not grow forever
+            del self._queues[best]
+            self._current.pop(best, None)
+        return job, None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while self._running:
+                    if self._inflight < self.max_inflight:
+                        job, wait = self._pick_next(time.monotonic())
+                        if job is not None:
+                            break
+                    else:
+                        wait = None
+                    self._cond.wait(timeout=wait)
+                if not self._running:
+                    return
+
+                if not job.wanted():
+                    self._forget(job)
+                    continue
+                self._running_jobs.add(job)
+                self._inflight += 1
+                self._update_gauges()
+
+            metrics.observe("scheduler_queue_wait_seconds", time.monotonic() - job.submitted_at)
+            worker = threading.Thread(target=self._run_job, args=(job,), daemon=True)
+            worker.start()
+
+    def _run_job(self, job):
+        try:
+            result, error = self.manager.generate_image(*job.args, **job.kwargs), None
+        except Exception as e:
+            result, error = None, e
+        with self._cond:
+            self._inflight -= 1
+            self._running_jobs.discard(job)
+            self._forget(job)
+            waiters = list(job.waiters)
+            self._update_gauges()
+            self._cond.notify_all()
+        for future in waiters:
+            if future.set_running_or_notify_cancel():
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def _update_gauges(self):
+        # Caller must hold self._cond
+        metrics.set_gauge("scheduler_queued_jobs", sum(len(q) for q in self._queues.values()))
+        metrics.set_gauge("scheduler_inflight_jobs", self._inflight)
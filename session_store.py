@@ -0,0 +1,162 @@
+"""
+Per-session memory budget for encoded image artifacts
+
+Sessions keep small handles in st.session_state; the bytes live here under a
+per-session and a global byte budget. When a budget is exceeded, the least
+recently used buffers are spilled to disk and read back on demand.
+"""
+
+import collections
+import os
+import tempfile
+import threading
+import uuid
+
+from metrics import metrics
+
+
+class _Entry:
+    def __init__(self, session_id, data):
+        self.session_id = session_id
+        self.data = data  # None once spilled
+        self.nbytes = len(data)
+        self.spill_path = None
+
+
+class SessionArtifactCache:
+    """
+    Args:
+        per_session_bytes: In-memory budget of one session
+        global_bytes: In-memory budget of all sessions together
+        spill_dir: (Optional) Directory for spilled buffers, a temporary directory if None
+        max_spill_bytes: (Optional) Disk budget for spilled buffers, the oldest are dropped beyond it
+    """
+
+    def __init__(self, per_session_bytes=32 * 1024 * 1024, global_bytes=512 * 1024 * 1024,
+                 spill_dir=None, max_spill_bytes=None):
+        self.per_session_bytes = per_session_bytes
+        self.global_bytes = global_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="papercut_session_")
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # handle -> _Entry, least recently used first
+        self._memory_bytes = 0
+        self._session_bytes = collections.Counter()
+        self._spill_bytes = 0
+
+    def put(self, session_id, data: bytes) -> str:
+        """
+        Keep a buffer for a session
+
+        Returns:
+            str: Handle to pass to get()
+        """
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._entries[handle] = _Entry(session_id, data)
+            self._memory_bytes += len(data)
+            self._session_bytes[session_id] += len(data)
+            self._enforce_budgets(session_id)
+        return handle
+
+    def get(self, handle):
+        """
+        Read a buffer, loading it back into memory if it was spilled
+
+        Returns:
+            bytes: The buffer, None if the handle is unknown or was dropped
+        """
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return None
+            self._entries.move_to_end(handle)
+            if entry.data is not None:
+                return entry.data
+            spill_path = entry.spill_path
+
+        try:
+            with open(spill_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # Dropped by another session's put (disk budget) after the lock was released
+            return None
+        metrics.inc("session_store_spill_reads_total")
+
+        with self._lock:
+            if self._entries.get(handle) is entry and entry.data is None:
+                entry.data = data
+                self._memory_bytes += entry.nbytes
+                self._session_bytes[entry.session_id] += entry.nbytes
+                self._enforce_budgets(entry.session_id, keep=handle)
+        return data
+
+    def drop_session(self, session_id):
+        """Release every buffer of a session (e.g. when its results are replaced)"""
+        with self._lock:
+            handles = [h for h, e in self._entries.items() if e.session_id == session_id]
+            for handle in handles:
+                self._remove(handle)
+            self._session_bytes.pop(session_id, None)
+            self._update_gauges()
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return self._memory_bytes
+
+    def _enforce_budgets(self, session_id, keep=None):
+        # Caller must hold self._lock
+        # 1. Per-session budget: spill that session's least recently used buffers
+        if self._session_bytes[session_id] > self.per_session_bytes:
+            for handle, entry in list(self._entries.items()):
+                if self._session_bytes[session_id] <= self.per_session_bytes:
+                    break
+                if entry.session_id == session_id and entry.data is not None and handle != keep:
+                    self._spill(handle, entry)
+
+        # 2. Global budget: spill the least recently used buffers of any session
+        if self._memory_bytes > self.global_bytes:
+            for handle, entry in list(self._entries.items()):
+                if self._memory_bytes <= self.global_bytes:
+                    break
+                if entry.data is not None and handle != keep:
+                    self._spill(handle, entry)
+
+        # 3. Disk budget: drop the oldest spilled buffers entirely
+        if self.max_spill_bytes is not None and self._spill_bytes > self.max_spill_bytes:
+            for handle, entry in list(self._entries.items()):
+                if self._spill_bytes <= self.max_spill_bytes:
+                    break
+                if entry.data is None:
+                    self._remove(handle)
+
+        self._update_gauges()
+
+    def _spill(self, handle, entry):
+        if entry.spill_path is None:
+            entry.spill_path = os.path.join(self.spill_dir, f"{handle}.bin")
+            with open(entry.spill_path, "wb") as f:
+                f.write(entry.data)
+            self._spill_bytes += entry.nbytes
+        entry.data = None
+        self._memory_bytes -= entry.nbytes
+        self._session_bytes[entry.session_id] -= entry.nbytes
+        metrics.inc("session_store_spills_total")
+
+    def _remove(self, handle):
+        entry = self._entries.pop(handle)
+        if entry.data is not None:
+            self._memory_bytes -= entry.nbytes
+            self._session_bytes[entry.session_id] -= entry.nbytes
+        if entry.spill_path is not None:
+            self._spill_bytes -= entry.nbytes
+            try:
+                os.remove(entry.spill_path)
+            except FileNotFoundError:
+                pass
+
+    def _update_gauges(self):
+        metrics.set_gauge("session_image_memory_bytes", self._memory_bytes)
+        metrics.set_gauge("session_image_spilled_bytes", self._spill_bytes)
@@ -0,0 +1,228 @@
+"""
+Post-processing worker pool - Papercut processing and scene renders in separate processes
+
+NumPy/Pillow work in the Streamlit process competes with the UI and runs on one
+core per request. This pool runs the papercut chain and the scene renders in
+worker processes instead. Pixel data crosses the process boundary only through
+multiprocessing.shared_memory blocks: a job carries a path or a shared-memory
+descriptor (name, mode, size), never pickled pixels, and results come back the
+same way. Scene plates are decoded once per worker (load_scene cache).
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+from metrics import metrics
+
+# Bytes per pixel of the modes that cross the process boundary
+_MODE_BYTES = {"L": 1, "RGB": 3, "RGBA": 4}
+
+
+def _share(image: Image.Image):
+    """Copy an image into a new shared-memory block; returns its descriptor (name, mode, size)"""
+    if image.mode not in _MODE_BYTES:
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    nbytes = image.width * image.height * _MODE_BYTES[image.mode]
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    try:
+        shm.buf[:nbytes] = image.tobytes()
+    finally:
+        shm.close()
+    return shm.name, image.mode, image.size
+
+
+def _attach(descriptor) -> Image.Image:
+    """Image copied out of a shared-memory block (the block is left for _release)"""
+    name, mode, size = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        nbytes = size[0] * size[1] * _MODE_BYTES[mode]
+        view = np.ndarray((nbytes,), dtype=np.uint8, buffer=shm.buf)
+        image = Image.frombytes(mode, size, view)
+        del view  # release the export before closing
+    finally:
+        shm.close()
+    return image
+
+
+def _release(descriptor):
+    """Unlink a shared-memory block that will not be read"""
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor[0])
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _load_source(source) -> Image.Image:
+    kind, value = source
+    if kind == "path":
+        return Image.open(value)
+    return _attach(value)
+
+
+def _run_job(source, processed, color, params, scenes, scene_color):
+    # Runs in a worker process: everything it returns is a small descriptor
+    from Image_Processing import process_image_to_mask, render_scene
+    from papercut_mask import PapercutMask, as_mask
+
+    start = time.perf_counter()
+    outputs = []
+    try:
+        image = _load_source(source)
+        if processed:
+            mask = PapercutMask(image, color) if image.mode == "L" else as_mask(image)
+            mask_descriptor = None
+        else:
+            mask = process_image_to_mask(image, contrast=params["contrast"], threshold=params["threshold"],
+                                         color=params["color"])
+            mask_descriptor = _share(mask.alpha)
+            outputs.append(mask_descriptor)
+
+        scene_descriptors = {}
+        for scene, plate in scenes.items():
+            rendered = render_scene(scene, mask, plate, color=scene_color)
+            scene_descriptors[scene] = _share(rendered) if rendered is not None else None
+            if rendered is not None:
+                outputs.append(scene_descriptors[scene])
+        return {"mask": mask_descriptor, "color": mask.color, "scenes": scene_descriptors,
+                "seconds": time.perf_counter() - start, "pid": os.getpid()}
+    except Exception:
+        # The parent never sees these blocks, so they must not outlive the job
+        for descriptor in outputs:
+            _release(descriptor)
+        raise
+
+
+class PostprocessResult:
+    """
+    Args:
+        mask: PapercutMask (None for render-only jobs)
+        scenes: {scene name: rendered RGB image, None if rendering failed}
+    """
+
+    def __init__(self, mask, scenes):
+        self.mask = mask
+        self.scenes = scenes
+
+
+class PostprocessPool:
+    """
+    Args:
+        workers: Number of worker processes, all cores but one if None
+        start_method: multiprocessing start method; "spawn" keeps workers free of the UI process state
+    """
+
+    def __init__(self, workers=None, start_method="spawn"):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context(start_method))
+        self._lock = threading.Lock()
+        self._inflight = 0
+
+    def process(self, raw, contrast=3.0, threshold=230, color=(255, 0, 0), scenes=None, scene_color=None) -> Future:
+        """
+        Run the papercut chain (and optionally scene renders) on a raw image in a worker
+
+        Args:
+            raw: Raw image path (str) or PIL image (handed over through shared memory)
+            contrast, threshold, color: Processing parameters (see process_image_to_mask)
+            scenes: (Optional) {scene name: plate path} to render with the result
+            scene_color: (Optional) Papercut color in the scenes, SCENE_COLOR if None
+
+        Returns:
+            Future: Resolves to a PostprocessResult
+        """
+        params = {"contrast": contrast, "threshold": threshold, "color": tuple(color)}
+        return self._submit(raw, False, None, params, scenes or {}, scene_color)
+
+    def render(self, papercut, scenes, scene_color=None) -> Future:
+        """
+        Render a processed papercut onto scenes in a worker
+
+        Args:
+            papercut: Processed papercut path (str), PIL image or PapercutMask
+            scenes: {scene name: plate path}
+            scene_color: (Optional) Papercut color in the scenes, SCENE_COLOR if None
+
+        Returns:
+            Future: Resolves to a PostprocessResult without mask
+        """
+        color = None
+        if hasattr(papercut, "alpha"):
+            papercut, color = papercut.alpha, papercut.color
+        return self._submit(papercut, True, color, None, scenes, scene_color)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _submit(self, source, processed, color, params, scenes, scene_color):
+        from Image_Processing import SCENE_COLOR
+
+        shared_input = None
+        if isinstance(source, str):
+            source = ("path", source)
+        else:
+            shared_input = _share(source)
+            source = ("shm", shared_input)
+
+        outer = Future()
+        submitted = time.perf_counter()
+        try:
+            inner = self._executor.submit(_run_job, source, processed, color, params, scenes,
+                                          tuple(scene_color or SCENE_COLOR))
+        except Exception:
+            if shared_input is not None:
+                _release(shared_input)
+            raise
+        with self._lock:
+            self._inflight += 1
+            metrics.set_gauge("postprocess_pool_inflight", self._inflight)
+        inner.add_done_callback(lambda f: self._collect(f, outer, shared_input, submitted))
+        return outer
+
+    def _collect(self, inner, outer, shared_input, submitted):
+        with self._lock:
+            self._inflight -= 1
+            metrics.set_gauge("postprocess_pool_inflight", self._inflight)
+        if shared_input is not None:
+            _release(shared_input)
+
+        try:
+            result = inner.result()
+        except BaseException as e:
+            metrics.inc("postprocess_pool_jobs_total", labels={"status": "error"})
+            outer.set_exception(e)
+            return
+
+        from papercut_mask import PapercutMask
+
+        descriptors = [result["mask"], *result["scenes"].values()]
+        try:
+            mask = None
+            if result["mask"] is not None:
+                mask = PapercutMask(_attach(result["mask"]), result["color"])
+            scenes = {scene: _attach(d) if d is not None else None for scene, d in result["scenes"].items()}
+        except Exception as e:
+            # A block that is missing or cannot be mapped must still resolve the caller's future
+            metrics.inc("postprocess_pool_jobs_total", labels={"status": "error"})
+            outer.set_exception(e)
+            return
+        finally:
+            # Every block the worker created is unlinked, including those not read after an error
+            for descriptor in descriptors:
+                if descriptor is not None:
+                    _release(descriptor)
+
+        metrics.inc("postprocess_pool_jobs_total", labels={"status": "ok"})
+        metrics.observe("postprocess_pool_job_seconds", result["seconds"])
+        metrics.observe("postprocess_pool_roundtrip_seconds", time.perf_counter() - submitted)
+        outer.set_result(PostprocessResult(mask, scenes))